@@ -0,0 +1,49 @@
+"""Lookups for asyncio applications
+
+Lookups run on a RomePool, in a thread pool, leaving the event loop free.
+sqlite releases the GIL while executing statements,
+so that several lookups progress at the same time.
+
+    pool = RomePool("rome.db")
+    async with AsyncRome(pool) as r:
+        data = await r.get_rome(ogr_id)
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from . import rome
+from .pool import LOOKUPS
+
+
+class AsyncRome:
+    """coroutine versions of rome lookups, running on pool
+
+    executor defaults to a thread pool of max_workers threads, shut down by close.
+    """
+
+    def __init__(self, pool, executor=None, max_workers=None):
+        self.pool = pool
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers, thread_name_prefix="pyrome")
+        for name in LOOKUPS:
+            setattr(self, name, functools.partial(self.call, getattr(rome, name)))
+
+    async def call(self, func, *args, **kwargs):
+        """run func in executor, with its queries on pool
+        """
+        # get_running_loop only exists since python 3.7
+        loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(self.pool.call, func, *args, **kwargs))
+
+    def close(self):
+        if self._own_executor:
+            self.executor.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
@@ -0,0 +1,167 @@
+"""Benchmarks of the loader and lookups, on synthetic data
+
+    python -m pyrome.bench --scale 1 --save baseline.json
+    python -m pyrome.bench --scale 1 --baseline baseline.json
+
+Report loader phases wall time and rows/s, loader peak memory,
+and latency percentiles of lookups.
+With a baseline, exit with an error if a measure regressed
+more than the tolerance.
+"""
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from queue import Empty
+
+from . import contents
+from . import metrics
+from . import parser
+from . import rome
+from . import schema as s
+from .synthetic import Generator
+
+
+# how often the loading process is checked while waiting for its results
+LOAD_POLL_SECONDS = 1
+
+
+def _load(zip_path, db_path, options, queue):
+    """run in a child process so that its peak memory can be measured
+    """
+    loader = parser.Loader(**options)
+    start = time.perf_counter()
+    loader(zip_path, db_path)
+    total = time.perf_counter() - start
+    results = {"load.total.seconds": total}
+    for phase in loader.metrics.report():
+        name = "load.%s" % ".".join(filter(None, [phase["phase"], phase["model"]]))
+        rows = sum(t["rows_inserted"] for t in phase["tables"].values())
+        results["%s.seconds" % name] = phase["elapsed"]
+        if rows:
+            results["%s.rows_per_second" % name] = rows / phase["elapsed"]
+    results["load.peak_memory_kb"] = metrics.peak_memory_kb()
+    queue.put(results)
+
+
+def bench_load(zip_path, db_path, options):
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_load, args=(zip_path, db_path, options, queue))
+    process.start()
+    while True:
+        try:
+            results = queue.get(timeout=LOAD_POLL_SECONDS)
+            break
+        except Empty:
+            if not process.is_alive():
+                raise RuntimeError("Loading process died (exit code %s)" % process.exitcode)
+    process.join()
+    return results
+
+
+def percentiles(durations, prefix):
+    durations = sorted(durations)
+    results = {}
+    for p in (50, 90, 99):
+        index = min(len(durations) - 1, int(len(durations) * p / 100))
+        results["%s.p%d_ms" % (prefix, p)] = durations[index] * 1000
+    return results
+
+
+def timed_calls(func, keys):
+    durations = []
+    for key in keys:
+        start = time.perf_counter()
+        func(key)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def bench_lookups(db_path, samples, seed=0):
+    rnd = random.Random(seed)
+    results = {}
+    with s.RomeDB(db_path):
+        codes = [c for c, in s.Ogr.select(s.Ogr.code).where(s.Ogr.type != 5).tuples()]
+        romes = [c for c, in s.Rome.select(s.Rome.ogr).tuples()]
+        referentiels = [c for c, in s.Referentiel.select(s.Referentiel.ogr).tuples()]
+        code_samples = [rnd.choice(codes) for i in range(samples)]
+        rome_samples = [rnd.choice(romes) for i in range(samples)]
+        results.update(percentiles(timed_calls(rome.get_ogr, code_samples), "get_ogr"))
+        results.update(percentiles(timed_calls(rome.get_rome, rome_samples), "get_rome"))
+        objs = [s.Rome.get(s.Rome.ogr == c) for c in rome_samples]
+        results.update(percentiles(timed_calls(contents.to_dict, objs), "contents.to_dict"))
+        ref_samples = [rnd.choice(referentiels) for i in range(max(1, samples // 20))]
+        results.update(percentiles(timed_calls(rome.referentiel, ref_samples), "referentiel"))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """return measures worse than baseline by more than tolerance
+    """
+    regressions = []
+    for key, value in sorted(results.items()):
+        base = baseline.get(key)
+        if value is None or not base:
+            continue
+        # for rates, higher is better
+        ratio = base / value if key.endswith("per_second") else value / base
+        if ratio > 1 + tolerance:
+            regressions.append((key, base, value))
+    return regressions
+
+
+def main(args=None):
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description='Benchmark pyrome on synthetic data')
+    arg_parser.add_argument("-s", "--scale", type=float, default=1,
+                            help='Size relative to the real referential')
+    arg_parser.add_argument("-n", "--samples", type=int, default=200,
+                            help='Number of calls for lookups latency')
+    arg_parser.add_argument("-d", "--workdir", help='Where to keep zip and database')
+    arg_parser.add_argument("-j", "--workers", type=int, default=1,
+                            help='Loader workers')
+    arg_parser.add_argument("-f", "--fast", action='store_true', help='Loader fast build')
+    arg_parser.add_argument("--baseline", help='Compare to results stored in this file')
+    arg_parser.add_argument("--tolerance", type=float, default=0.2,
+                            help='Allowed regression, relative to baseline')
+    arg_parser.add_argument("--save", help='Store results in this file')
+    args = arg_parser.parse_args(args)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pyrome-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    zip_path = os.path.join(workdir, "rome-x%s.zip" % args.scale)
+    db_path = os.path.join(workdir, "rome-x%s.db" % args.scale)
+    if not os.path.exists(zip_path):
+        Generator(args.scale)(zip_path)
+
+    results = {"scale": args.scale}
+    results.update(bench_load(
+        zip_path, db_path, {"workers": args.workers, "fast_build": args.fast}))
+    results.update(bench_lookups(db_path, args.samples))
+    for key, value in sorted(results.items()):
+        print("%-44s %s" % (key, "%.3f" % value if isinstance(value, float) else value))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("scale") != args.scale:
+            print("baseline was run at scale %s" % baseline.get("scale"), file=sys.stderr)
+            return 2
+        regressions = compare(results, baseline, args.tolerance)
+        for key, base, value in regressions:
+            print("REGRESSION %s: %.3f -> %.3f" % (key, base, value), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
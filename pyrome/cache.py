@@ -0,0 +1,196 @@
+"""Optional cache around rome lookups
+
+Data only changes when the loader runs, so results can be kept
+as long as the database file stays the same.
+"""
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+
+from . import rome
+from . import schema as s
+
+
+def sizeof(obj):
+    """approximate size in memory of a lookup result
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(k) + sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(sizeof(v) for v in obj)
+    return size
+
+
+class LRUCache:
+    """a thread safe LRU cache, bounded in entries and / or bytes
+
+    Entries older than ttl seconds are considered missing.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=None, ttl=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """return (found, value)
+        """
+        with self._lock:
+            try:
+                value, size, expires = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return False, None
+            if expires is not None and expires < self.clock():
+                self._remove(key)
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def set(self, key, value):
+        size = sizeof(value) if self.max_bytes is not None else 0
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = value, size, expires
+            self.bytes += size
+            while self._entries and (
+                    (self.max_entries is not None and len(self._entries) > self.max_entries) or
+                    (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        value, size, expires = self._entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+class RomeCache:
+    """cached versions of get_ogr, get_rome and referentiel
+
+    Cache is emptied when the database file changes (rebuilt, replaced or updated),
+    which is checked at most every check_interval seconds.
+    A connection still reading a replaced file is then reopened
+    before results are cached again.
+    Results are kept by database file (that of the pool in use, see RomePool.use)
+    and version of a store (see RomeDatabase.at_version).
+    Results are shared between calls, they must not be modified.
+
+    Other parameters are those of LRUCache.
+    """
+
+    def __init__(self, database=s.rome_db, check_interval=1.0, **kwargs):
+        self.database = database
+        self.check_interval = check_interval
+        self.cache = LRUCache(**kwargs)
+        self.invalidations = 0
+        # (generation, time of check) by path of database file
+        self._generations = {}
+        # incremented each time the cache is emptied, see cached
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.get_ogr = self.cached(rome.get_ogr)
+        self.get_rome = self.cached(rome.get_rome)
+        self.referentiel = self.cached(rome.referentiel)
+
+    def generation(self, path):
+        """identity of the database file at path, changing each time it is written
+        """
+        if not path or path == ":memory:":
+            return None
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size
+
+    def check(self, path):
+        """empty cache if the database file at path changed since last check
+
+        Return whether results of the connection of this thread can be cached,
+        reopening it if its file was replaced since it was opened,
+        unless it is in a transaction.
+        """
+        now = time.monotonic()
+        generation, checked = self._generations.get(path, (None, None))
+        if checked is None or now - checked >= self.check_interval:
+            generation = self.update_generation(path, now)
+        if self.reads_file(generation):
+            return True
+        # the file, or the connection, changed since the last check
+        if self.reads_file(self.update_generation(path, now)):
+            return True
+        if self.database.transaction_depth():
+            return False
+        self.database.reconnect()
+        return True
+
+    def update_generation(self, path, now):
+        generation = self.generation(path)
+        previous, checked = self._generations.get(path, (None, None))
+        self._generations[path] = generation, now
+        if checked is not None and generation != previous:
+            self.invalidate()
+        return generation
+
+    def reads_file(self, generation):
+        """whether the connection of this thread, if open, reads the file of generation
+        """
+        connection_file_id = self.database.connection_file_id()
+        return (
+            generation is None or connection_file_id is None or
+            connection_file_id == generation[:2])
+
+    def invalidate(self):
+        with self._lock:
+            self._epoch += 1
+            self.cache.clear()
+            self.invalidations += 1
+
+    def cached(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, version=None, **kwargs):
+            version = version or self.database.current_version()
+            path = self.database.current_path()
+            if not self.check(path):
+                return func(*args, version=version, **kwargs)
+            key = (func.__name__, path, version, args, tuple(sorted(kwargs.items())))
+            found, value = self.cache.get(key)
+            if not found:
+                epoch = self._epoch
+                value = func(*args, version=version, **kwargs)
+                # not kept if the cache was emptied meanwhile, value may be outdated
+                with self._lock:
+                    if epoch == self._epoch:
+                        self.cache.set(key, value)
+            return value
+        return wrapper
+
+    def stats(self):
+        return {
+            "hits": self.cache.hits,
+            "misses": self.cache.misses,
+            "evictions": self.cache.evictions,
+            "invalidations": self.invalidations,
+            "entries": len(self.cache),
+            "bytes": self.cache.bytes}
@@ -0,0 +1,183 @@
+"""Integrity checks of a built database
+
+    python -m pyrome.check rome.db [--zip rome.zip]
+
+    failures = check_db()
+
+Each invariant is a single sql query giving the offending rows.
+"""
+import peewee as pw
+
+from . import schema as s
+
+
+# number of offending keys given for each failed check
+SAMPLE_SIZE = 5
+
+_FEUILLE = {v: k for k, v in s.Arborescence.TYPE_NOEUD}["FEUILLE"]
+_RACINE = {v: k for k, v in s.Arborescence.TYPE_NOEUD}["RACINE"]
+
+
+class CheckError(Exception):
+    """the database failed some checks, given as failures
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__("Failed checks: %s" % ", ".join(f["check"] for f in failures))
+
+
+def _models():
+    return [s.Ogr] + [
+        m for m in s.BaseModel.__subclasses__() if m is not s.Ogr]
+
+
+def iter_checks(database=None):
+    """yield (name, sql) of invariants, sql selecting offending keys
+
+    Tables missing from the database are not checked.
+    """
+    database = database or s.rome_db
+    quote = database.compiler().quote
+    tables = set(database.get_tables())
+    names = {
+        "ogr": quote(s.Ogr._meta.db_table),
+        "code": quote(s.Ogr.code.db_column),
+        "type": quote(s.Ogr.type.db_column),
+        "arborescence": quote(s.Arborescence._meta.db_table),
+        "ogr_id": quote(s.Arborescence.ogr.db_column),
+        "pere": quote(s.Arborescence.pere.db_column),
+        "referentiel": quote(s.Arborescence.referentiel.db_column),
+        "item_ogr": quote(s.Arborescence.item_ogr.db_column),
+        "type_noeud": quote(s.Arborescence.type_noeud.db_column),
+        "fiche": quote(s.Fiche._meta.db_table),
+        "numero": quote(s.Fiche.numero.db_column),
+        "feuille": _FEUILLE,
+        "racine": _RACINE,
+    }
+
+    # foreign keys pointing nowhere
+    for model in _models():
+        if model._meta.db_table not in tables:
+            continue
+        for field in model._meta.declared_fields:
+            if not isinstance(field, pw.ForeignKeyField):
+                continue
+            yield "orphan.%s.%s" % (model._meta.db_table, field.name), """
+                SELECT t.{fk} FROM {table} AS t
+                LEFT JOIN {rel_table} AS r ON r.{to_field} = t.{fk}
+                WHERE t.{fk} IS NOT NULL AND r.{to_field} IS NULL""".format(
+                fk=quote(field.db_column),
+                table=quote(model._meta.db_table),
+                rel_table=quote(field.rel_model._meta.db_table),
+                to_field=quote(field.to_field.db_column))
+
+    # each ogr is in the table of its type, and only there
+    for t, model in sorted(s.ogr_type_model.items()):
+        if model._meta.db_table not in tables:
+            continue
+        fmt = dict(
+            names, t=t, table=quote(model._meta.db_table), key=quote(model.ogr.db_column))
+        yield "ogr_type.%s" % model._meta.db_table, """
+            SELECT o.{code} FROM {ogr} AS o
+            LEFT JOIN {table} AS m ON m.{key} = o.{code}
+            WHERE o.{type} = {t} AND m.{key} IS NULL
+            UNION ALL
+            SELECT m.{key} FROM {table} AS m
+            JOIN {ogr} AS o ON o.{code} = m.{key}
+            WHERE o.{type} != {t}""".format(**fmt)
+
+    if s.Arborescence._meta.db_table in tables:
+        # leaves, and only them, have an item
+        yield "arborescence.feuille_item", """
+            SELECT {ogr_id} FROM {arborescence}
+            WHERE ({type_noeud} = {feuille}) != ({item_ogr} IS NOT NULL)""".format(**names)
+        # leaves have no children
+        yield "arborescence.feuille_fils", """
+            SELECT DISTINCT p.{ogr_id} FROM {arborescence} AS a
+            JOIN {arborescence} AS p ON p.{ogr_id} = a.{pere}
+            WHERE p.{type_noeud} = {feuille}""".format(**names)
+        # roots, and only them, have no father
+        yield "arborescence.racine", """
+            SELECT {ogr_id} FROM {arborescence}
+            WHERE ({type_noeud} = {racine}) != ({pere} IS NULL)""".format(**names)
+        # items of a referentiel are of a single type, see rome.referentiel
+        yield "arborescence.referentiel_types", """
+            SELECT a.{referentiel} FROM {arborescence} AS a
+            JOIN {ogr} AS o ON o.{code} = a.{item_ogr}
+            GROUP BY a.{referentiel} HAVING COUNT(DISTINCT o.{type}) > 1""".format(**names)
+        yield "arborescence.referentiel_sans_item", """
+            SELECT r.{ogr_id} FROM {arborescence} AS r
+            WHERE r.{pere} IS NULL AND NOT EXISTS (
+                SELECT 1 FROM {arborescence} AS a
+                WHERE a.{referentiel} = r.{ogr_id} AND a.{item_ogr} IS NOT NULL)""".format(
+            **names)
+
+    # columns of models missing from their table, whose values would be lost
+    for model in _models():
+        if model._meta.db_table not in tables:
+            continue
+        yield "columns.%s" % model._meta.db_table, """
+            SELECT c.name FROM ({columns}) AS c
+            WHERE c.name NOT IN (SELECT name FROM pragma_table_info({table}))""".format(
+            columns=" UNION ALL ".join(
+                "SELECT '%s' AS name" % f.db_column for f in model._meta.sorted_fields),
+            table="'%s'" % model._meta.db_table)
+
+    if s.Fiche._meta.db_table in tables:
+        # fields of the card filled from the numero element
+        for field in s.Fiche._meta.sorted_fields:
+            if field.name in ("id", "numero", "rome"):
+                continue
+            yield "fiche.%s" % field.name, """
+                SELECT {numero} FROM {fiche}
+                WHERE {column} = CAST({numero} AS TEXT)""".format(
+                column=quote(field.db_column), **names)
+
+
+def check_db(expected_counts=None, database=None):
+    """check invariants of the connected database (or database), return failures
+
+    expected_counts gives the number of rows of tables by name,
+    as loaded from the zip (see Loader.count_rows).
+    A failure is a dict with the check name, the count of offending rows
+    and a sample of their keys (or the expected count).
+    """
+    database = database or s.rome_db
+    quote = database.compiler().quote
+    failures = []
+    for name, sql in iter_checks(database):
+        rows = database.execute_sql(
+            "SELECT *, COUNT(*) OVER () FROM (%s) LIMIT %d" % (sql, SAMPLE_SIZE)).fetchall()
+        if rows:
+            failures.append(
+                {"check": name, "count": rows[0][-1], "sample": [row[0] for row in rows]})
+    tables = set(database.get_tables())
+    for table, expected in sorted((expected_counts or {}).items()):
+        count = 0
+        if table in tables:
+            sql = "SELECT COUNT(*) FROM %s" % quote(table)
+            count = database.execute_sql(sql).fetchone()[0]
+        if count != expected:
+            failures.append(
+                {"check": "row_count.%s" % table, "count": count, "expected": expected})
+    return failures
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import sys
+
+    from .parser import Loader
+
+    parser = argparse.ArgumentParser(description='Check integrity of a ROME database')
+    parser.add_argument("db_path", help='Path of database')
+    parser.add_argument("--zip", help='Zip the database was loaded from, to check row counts')
+    args = parser.parse_args()
+    expected_counts = Loader().count_rows(args.zip) if args.zip else None
+    with s.RomeDB(args.db_path):
+        failures = check_db(expected_counts)
+    for failure in failures:
+        print(json.dumps(failure, ensure_ascii=False))
+    sys.exit(1 if failures else 0)
@@ -1,4 +1,9 @@
+import collections
 import copy
+import json
+
+import peewee as pw
+
 from . import schema as s
 
 
@@ -19,15 +24,48 @@ def simple_to_dict(obj):
     return dict(obj._data)
 
 
+def _unwrap(value):
+    """value of a foreign key
+
+    When related objects are set by prefetch,
+    peewee stores the object itself in _data.
+    """
+    while isinstance(value, pw.Model):
+        value = value._get_pk_value()
+    return value
+
+
+def _projection(model, fields=None):
+    """compile a function adding items of _data of a model object to a dict
+
+    Only fields (all fields by default) are kept, in the order of _data,
+    foreign keys being unwrapped.
+    """
+    fields = frozenset(model._meta.fields if fields is None else fields)
+    fks = [
+        name for name, f in model._meta.fields.items()
+        if name in fields and isinstance(f, pw.ForeignKeyField)]
+
+    def project(obj, data):
+        obj_data = obj._data
+        if fields.issuperset(obj_data):
+            data.update(obj_data)
+        else:
+            data.update((k, v) for k, v in obj_data.items() if k in fields)
+        for k in fks:
+            if isinstance(data.get(k), pw.Model):
+                data[k] = _unwrap(data[k])
+        return data
+
+    return project
+
+
 def _relation_to_dict_factory(model, rel_model, rel_name):
-    fields = list(model._meta.fields)
-    rel_fields = list(rel_model._meta.fields)
+    project = _projection(model)
+    rel_project = _projection(rel_model)
 
     def relation_to_dict(obj):
-        related = getattr(obj, rel_name)
-        data = dict((k, v) for k, v in obj._data.items() if k in fields)
-        data.update((k, v) for k, v in related._data.items() if k in rel_fields)
-        return data
+        return rel_project(getattr(obj, rel_name), project(obj, {}))
 
     return relation_to_dict
 
@@ -42,15 +80,15 @@ rome_env_travail_to_dict = _relation_to_dict_factory(
     s.RomeEnvTravail, s.EnvTravail, "env_travail")
 
 
-_rome_fields = _fnames(s.Rome)
-_fiche_fields = _fnames(s.Fiche)
+_rome_projection = _projection(s.Rome)
+_fiche_projection = _projection(s.Fiche)
 
 
 def rome_to_dict(obj):
-    data = dict((k, v) for k, v in obj._data.items() if k in _rome_fields)
+    data = _rome_projection(obj, {})
     fiche = list(obj.fiche)
     if fiche:
-        data.update((k, v) for k, v in fiche[0]._data.items() if k in _fiche_fields)
+        _fiche_projection(fiche[0], data)
     data["appellation"] = [rome_appellation_to_dict(r) for r in obj.rome_appellation]
     data["activite"] = [rome_activite_to_dict(r) for r in obj.rome_activite]
     data["competence"] = [rome_competence_to_dict(r) for r in obj.rome_competence]
@@ -59,10 +97,10 @@ def rome_to_dict(obj):
 
 
 def prefetched_rome_to_dict(obj):
-    data = dict((k, v) for k, v in obj._data.items() if k in _rome_fields)
-    fiche = list(obj.fiche)
+    data = _rome_projection(obj, {})
+    fiche = obj.fiche_prefetch
     if fiche:
-        data.update((k, v) for k, v in obj.fiche[0]._data.items() if k in _fiche_fields)
+        _fiche_projection(fiche[0], data)
     data["appellation"] = [rome_appellation_to_dict(r) for r in obj.rome_appellation_prefetch]
     data["activite"] = [rome_activite_to_dict(r) for r in obj.rome_activite_prefetch]
     data["competence"] = [rome_competence_to_dict(r) for r in obj.rome_competence_prefetch]
@@ -70,20 +108,27 @@ def prefetched_rome_to_dict(obj):
     return data
 
 
-_arborescence_fields = ["ogr_id", "code_noeud", "libelle"]
+_arborescence_fields = frozenset(["ogr", "code_noeud", "libelle"])
 _ogr_type_to_relation = dict(s.Ogr.TYPE)
 
 
-def arborescence_to_dict(obj):
+def arborescence_to_dict(obj, item_to_dict=None):
     data = {k: v for k, v in obj._data.items() if k in _arborescence_fields}
     if obj.item_ogr_id:
         item_ogr = obj.item_ogr
         rel_name = _ogr_type_to_relation[item_ogr.type]
         item_obj = getattr(item_ogr, rel_name)
-        data[rel_name] = to_dict(item_obj)
+        if isinstance(item_obj, pw.SelectQuery):
+            # back reference, when the item was not fetched along (see rome._with_items)
+            item_obj = item_obj.get()
+        data[rel_name] = (item_to_dict or to_dict)(item_obj)
     return data
 
 
+def prefetched_arborescence_to_dict(obj):
+    return arborescence_to_dict(obj, prefetched_to_dict)
+
+
 MODEL_TO_DICT = {
     s.Activite: simple_to_dict,
     s.Appellation: simple_to_dict,
@@ -100,7 +145,73 @@ MODEL_TO_DICT = {
 
 PREFETCH_MODEL_TO_DICT = copy.copy(MODEL_TO_DICT)
 PREFETCH_MODEL_TO_DICT.update({
-    s.Rome: prefetched_rome_to_dict})
+    s.Rome: prefetched_rome_to_dict,
+    s.Arborescence: prefetched_arborescence_to_dict})
+
+
+# lightweight mode: rows are selected as tuples and turned into dicts directly
+
+def _in(field, values):
+    """field IN values, passing values as a single parameter
+
+    this way, the query does not depend on the number of values
+    """
+    values = [field.db_value(v) for v in values]
+    return field << pw.SQL("(SELECT value FROM json_each(?))", json.dumps(values))
+
+
+# key in rome dicts, relation model and related model
+_rome_relations = [
+    ("appellation", s.RomeAppellation, s.Appellation),
+    ("activite", s.RomeActivite, s.Activite),
+    ("competence", s.RomeCompetence, s.Competence),
+    ("env_travail", s.RomeEnvTravail, s.EnvTravail)]
+
+
+def _rows(query, fields):
+    """rows of query, selecting fields, as (field names, cursor)
+
+    Values are those of the database, which are those of python for pyrome fields.
+    """
+    query = query.select(*fields)
+    return [f.name for f in fields], query.database.execute_sql(*query.sql())
+
+
+def light_rome_dicts(ogr_ids):
+    """dicts of romes with ids, the same as rome_to_dict, as an ordered dict by ogr id
+
+    Only needed columns are selected, no model instance being created.
+    """
+    romes = collections.OrderedDict()
+    names, rows = _rows(
+        s.Rome.select().where(_in(s.Rome.ogr, ogr_ids)).order_by(s.Rome.ogr),
+        s.Rome._meta.declared_fields)
+    for row in rows:
+        romes[row[0]] = dict(zip(names, row))
+    ogr_ids = list(romes)
+    # first fiche of each rome
+    names, rows = _rows(
+        s.Fiche.select().where(_in(s.Fiche.rome, ogr_ids)).order_by(s.Fiche.id),
+        s.Fiche._meta.declared_fields)
+    index = names.index("rome")
+    with_fiche = set()
+    for row in rows:
+        if row[index] not in with_fiche:
+            with_fiche.add(row[index])
+            romes[row[index]].update(zip(names, row))
+    for key, model, rel_model in _rome_relations:
+        for data in romes.values():
+            data[key] = []
+        names, rows = _rows(
+            model.select()
+            .join(rel_model, on=getattr(model, key))
+            .where(_in(model.rome, ogr_ids))
+            .order_by(model.id),
+            model._meta.declared_fields + rel_model._meta.declared_fields)
+        index = names.index("rome")
+        for row in rows:
+            romes[row[index]][key].append(dict(zip(names, row)))
+    return romes
 
 
 def to_dict(obj):
@@ -0,0 +1,155 @@
+"""Export of the whole referential, streamed as NDJSON or JSON
+
+    python -m pyrome.export rome.db rome.ndjson.gz
+
+Each rome comes with its appellations, activites, competences, environments,
+fiche and mobilites (as given by get_rome), followed by referentiel trees
+(as given by referentiel).
+Romes are fetched by chunks, so that memory use does not depend on their number.
+"""
+import collections
+import contextlib
+import gzip
+import io
+import json
+import sys
+
+from . import rome
+from . import schema as s
+
+
+CHUNK_SIZE = 100
+
+FORMATS = ["ndjson", "json"]
+
+_mobilite_types = dict(s.Mobilite.TYPE)
+
+
+def _mobilites(ogr_ids):
+    """mobilites of romes, as a dict by origin rome id
+    """
+    query = (
+        s.Mobilite
+        .select(s.Mobilite.origine_rome, s.Mobilite.cible_rome, s.Mobilite.type,
+                s.Rome.code_rome, s.Rome.libelle)
+        .join(s.Rome, on=s.Mobilite.cible_rome)
+        .where(rome._in(s.Mobilite.origine_rome, ogr_ids))
+        .order_by(s.Mobilite.id))
+    mobilites = collections.defaultdict(list)
+    for origine, cible, type_, code_rome, libelle in query.tuples():
+        mobilites[origine].append({
+            "type": _mobilite_types[type_], "cible_rome": cible,
+            "code_rome": code_rome, "libelle": libelle})
+    return mobilites
+
+
+def iter_romes(chunk_size=CHUNK_SIZE):
+    """yield every rome as a dict, by order of ogr id
+
+    Dicts are those of get_rome, with a mobilite list added.
+    """
+    for romes in rome._rome_chunks(chunk_size):
+        mobilites = _mobilites(list(romes))
+        for ogr_id, data in romes.items():
+            data["mobilite"] = mobilites.get(ogr_id, [])
+            yield data
+
+
+def iter_referentiels():
+    """yield each referentiel as a dict, with its tree
+    """
+    query = s.Referentiel.select().order_by(s.Referentiel.ogr)
+    for ogr_id, libelle in query.tuples():
+        yield {"ogr": ogr_id, "libelle": libelle, "arborescence": rome.subtree(ogr_id)}
+
+
+def iter_records(chunk_size=CHUNK_SIZE):
+    """yield (type, data) for the whole referential, type being rome or referentiel
+    """
+    for data in iter_romes(chunk_size):
+        yield "rome", data
+    for data in iter_referentiels():
+        yield "referentiel", data
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def write_ndjson(f, records):
+    """write records as lines of {"type": type, "data": data}
+    """
+    for type_, data in records:
+        f.write(_dumps({"type": type_, "data": data}))
+        f.write("\n")
+
+
+def write_json(f, records):
+    """write records as a single object, with a list by type
+    """
+    f.write("{")
+    current = None
+    for type_, data in records:
+        if type_ != current:
+            if current is not None:
+                f.write("],")
+            f.write("%s:[" % _dumps(type_))
+            current = type_
+        else:
+            f.write(",")
+        f.write(_dumps(data))
+    if current is not None:
+        f.write("]")
+    f.write("}\n")
+
+
+WRITERS = {"ndjson": write_ndjson, "json": write_json}
+
+
+@contextlib.contextmanager
+def open_output(path, compress=False):
+    """text file to write to, path "-" being stdout
+    """
+    if path == "-":
+        if compress:
+            with gzip.GzipFile(fileobj=sys.stdout.buffer, mode="wb") as raw, \
+                    io.TextIOWrapper(raw, encoding="utf-8") as f:
+                yield f
+        else:
+            yield sys.stdout
+            sys.stdout.flush()
+    elif compress:
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            yield f
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            yield f
+
+
+def export(path, format="ndjson", compress=None, chunk_size=CHUNK_SIZE):
+    """write the whole referential of the connected database to path
+
+    compress defaults to whether path ends with .gz
+    """
+    if compress is None:
+        compress = path.endswith(".gz")
+    with open_output(path, compress) as f:
+        WRITERS[format](f, iter_records(chunk_size))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export ROME database as NDJSON or JSON')
+    parser.add_argument("db_path", help='Path of database')
+    parser.add_argument("output", nargs="?", default="-",
+                        help='Path of file to write, default to stdout')
+    parser.add_argument("-f", "--format", choices=FORMATS, default="ndjson",
+                        help='Output format')
+    parser.add_argument("-z", "--gzip", action='store_true', default=None,
+                        help='Compress output (default when output ends with .gz)')
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help='Number of romes fetched at once')
+    args = parser.parse_args()
+    with s.RomeDB(args.db_path):
+        export(args.output, args.format, args.gzip, args.chunk_size)
@@ -0,0 +1,298 @@
+"""Match free text job titles to appellations and romes
+
+    matcher = TitleMatcher.load()
+    matcher.match("Développeur web H/F", k=5)
+    matcher.match_many(titles, workers=4)
+
+Titles and libelles of appellations are normalized (accents, case, punctuation
+and stop words folded), then compared by their sets of character trigrams.
+"""
+import collections
+import functools
+import heapq
+import re
+import unicodedata
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from . import schema as s
+from .ranking import _add, _popcount
+
+
+STOPWORDS = frozenset(
+    "a au aux d de des du en et l la le les ou par pour sur un une "
+    "h f hf fh".split())
+
+_non_word_re = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text):
+    """lower case text without accents, punctuation nor stop words
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(w for w in _non_word_re.split(text) if w and w not in STOPWORDS)
+
+
+def trigrams(normalized):
+    """set of trigrams of words of a normalized text, words being padded with spaces
+    """
+    result = set()
+    for word in normalized.split():
+        padded = " %s " % word
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def _most_shared(planes, k):
+    """bitset of at most k documents having the greatest counters in planes
+
+    planes are counters sliced by bits, see ranking._add.
+    Documents tied with the k-th are taken by index.
+    """
+    candidates = 0
+    for plane in planes:
+        candidates |= plane
+    # same selection as ranking._top, keeping tied documents apart
+    sure, maybe = 0, candidates
+    for plane in reversed(planes):
+        x = sure | (maybe & plane)
+        n = _popcount(x)
+        if n > k:
+            maybe &= plane
+        elif n < k:
+            sure = x
+            maybe &= ~plane
+        else:
+            return x
+    for i in range(k - _popcount(sure)):
+        if not maybe:
+            break
+        low = maybe & -maybe
+        sure |= low
+        maybe ^= low
+    return sure
+
+
+def _bits(x):
+    """indexes of bits set in x
+    """
+    indexes = []
+    while x:
+        low = x & -x
+        x ^= low
+        indexes.append(low.bit_length() - 1)
+    return indexes
+
+
+class TitleMatcher:
+    """trigram inverted index over libelles of appellations
+
+    Each libelle is a document, trigrams of the document at index d being
+    those from doc_offsets[d] to doc_offsets[d + 1] in doc_trigrams.
+    Documents having the trigram at index t are likewise those from
+    offsets[t] to offsets[t + 1] in postings.
+
+    Candidates are the documents sharing the most trigrams with the title,
+    counting only its rarest trigrams: at least min_trigrams of them,
+    and then as long as they are found in max_df of documents in total.
+    When its min_trigrams rarest trigrams are already found in more documents,
+    as for titles made of common words, all of its trigrams are counted at once
+    for all documents, as in ranking.RomeRanking: the documents having each trigram,
+    as a bitset (built from postings when first needed), are added into counters
+    sliced by bits.
+    The best candidates are then scored by the Jaccard index
+    of their trigrams and the title's.
+    """
+
+    def __init__(self, appellations, romes, max_df=0.02, min_trigrams=3, candidates=20,
+                 memo_size=100000):
+        """appellations are (ogr, libelles, ogr of romes) tuples, romes (ogr, code_rome, libelle)
+        """
+        self.max_df = max_df
+        self.min_trigrams = min_trigrams
+        self.candidates = candidates
+        self.appellations = []
+        self.appellation_romes = []
+        self.romes = {ogr: (code_rome, libelle) for ogr, code_rome, libelle in romes}
+        self.trigram_index = {}
+        doc_appellations = []
+        self.doc_offsets = array("l", [0])
+        self.doc_trigrams = array("l")
+        by_trigram = []
+        for a, (ogr, libelles, rome_ids) in enumerate(appellations):
+            self.appellations.append((ogr, libelles[0]))
+            self.appellation_romes.append(tuple(rome_ids))
+            texts = (normalize(libelle) for libelle in libelles if libelle)
+            for text in collections.OrderedDict.fromkeys(texts):
+                d = len(doc_appellations)
+                doc_appellations.append(a)
+                for trigram in sorted(trigrams(text)):
+                    t = self.trigram_index.setdefault(trigram, len(self.trigram_index))
+                    if t == len(by_trigram):
+                        by_trigram.append(array("l"))
+                    by_trigram[t].append(d)
+                    self.doc_trigrams.append(t)
+                self.doc_offsets.append(len(self.doc_trigrams))
+        self.doc_appellations = array("l", doc_appellations)
+        self.offsets = array("l", [0])
+        self.postings = array("l")
+        for postings in by_trigram:
+            self.postings.extend(postings)
+            self.offsets.append(len(self.postings))
+        self._bitsets = {}
+        self._match_normalized = functools.lru_cache(memo_size)(self._match_normalized)
+
+    @classmethod
+    def load(cls, **kwargs):
+        """matcher over appellations of the connected database
+        """
+        romes_of = collections.defaultdict(list)
+        ra = s.RomeAppellation
+        for appellation, rome in ra.select(ra.appellation, ra.rome).order_by(ra.id).tuples():
+            if rome not in romes_of[appellation]:
+                romes_of[appellation].append(rome)
+        a = s.Appellation
+        appellations = [
+            (ogr, (libelle_appellation, libelle_court), romes_of.get(ogr, []))
+            for ogr, libelle_appellation, libelle_court in a.select(
+                a.ogr, a.libelle_appellation, a.libelle_court).order_by(a.ogr).tuples()]
+        romes = s.Rome.select(s.Rome.ogr, s.Rome.code_rome, s.Rome.libelle).tuples()
+        return cls(appellations, romes, **kwargs)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_match_normalized"]
+        state["_bitsets"] = {}
+        state["memo_size"] = self._match_normalized.cache_info().maxsize
+        return state
+
+    def __setstate__(self, state):
+        memo_size = state.pop("memo_size")
+        self.__dict__.update(state)
+        self._match_normalized = functools.lru_cache(memo_size)(
+            functools.partial(type(self)._match_normalized, self))
+
+    def _bitset(self, t):
+        """documents having the trigram at index t, as a bitset
+        """
+        bits = self._bitsets.get(t)
+        if bits is None:
+            data = bytearray(len(self.doc_appellations) // 8 + 1)
+            for d in self.postings[self.offsets[t]:self.offsets[t + 1]]:
+                data[d >> 3] |= 1 << (d & 7)
+            bits = self._bitsets[t] = int.from_bytes(data, "little")
+        return bits
+
+    def _common_candidates(self, query):
+        """documents sharing the most trigrams of query, counted with bitsets
+        """
+        planes = []
+        for t in query:
+            _add(planes, self._bitset(t), 0)
+        return _bits(_most_shared(planes, self.candidates))
+
+    def _scored_documents(self, normalized):
+        """(score, document) of best candidates for a normalized title
+        """
+        query = {self.trigram_index[t] for t in trigrams(normalized) if t in self.trigram_index}
+        if not query:
+            return []
+        offsets, postings = self.offsets, self.postings
+        budget = self.max_df * len(self.doc_appellations)
+        rarest = []
+        for i, t in enumerate(sorted(query, key=lambda t: offsets[t + 1] - offsets[t])):
+            size = offsets[t + 1] - offsets[t]
+            if size > budget:
+                if i < self.min_trigrams:
+                    rarest = None
+                break
+            budget -= size
+            rarest.append(t)
+        if rarest is None:
+            documents = self._common_candidates(query)
+        else:
+            counts = collections.Counter()
+            for t in rarest:
+                counts.update(postings[offsets[t]:offsets[t + 1]])
+            documents = [d for d, c in counts.most_common(self.candidates)]
+        n_query = len(query)
+        doc_offsets, doc_trigrams = self.doc_offsets, self.doc_trigrams
+        scored = []
+        for d in documents:
+            start, end = doc_offsets[d], doc_offsets[d + 1]
+            shared = len(query.intersection(doc_trigrams[start:end]))
+            scored.append((shared / (n_query + end - start - shared), d))
+        return scored
+
+    def _match_normalized(self, normalized, k):
+        best = {}
+        for score, d in self._scored_documents(normalized):
+            a = self.doc_appellations[d]
+            if score > best.get(a, 0):
+                best[a] = score
+        appellations = heapq.nlargest(k, best.items(), key=lambda item: (item[1], -item[0]))
+        rome_scores = {}
+        for a, score in sorted(best.items(), key=lambda item: -item[1]):
+            for rome in self.appellation_romes[a]:
+                rome_scores.setdefault(rome, score)
+        romes = heapq.nlargest(k, rome_scores.items(), key=lambda item: (item[1], -item[0]))
+        return (
+            [{"ogr": self.appellations[a][0], "libelle": self.appellations[a][1], "score": score}
+             for a, score in appellations],
+            [{"ogr": rome, "code_rome": self.romes[rome][0], "libelle": self.romes[rome][1],
+              "score": score}
+             for rome, score in romes])
+
+    def match(self, title, k=5):
+        """best appellations and romes for title
+
+        Return a dict with appellations and romes,
+        each a list of at most k dicts with ogr, libelle (and code_rome) and score,
+        score being from 0 to 1 (identical trigrams), best first.
+        A rome scores as its best appellation.
+        Results of identical normalized titles are shared, they must not be modified.
+        """
+        appellations, romes = self._match_normalized(normalize(title), k)
+        return {"appellations": appellations, "romes": romes}
+
+    def match_many(self, titles, k=5, workers=1, chunksize=1000):
+        """match titles, using as many worker processes, return results in order
+        """
+        titles = list(titles)
+        if workers <= 1:
+            return [self.match(title, k) for title in titles]
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(self,)) as executor:
+            return list(executor.map(
+                _match_worker, titles, [k] * len(titles), chunksize=chunksize))
+
+
+_worker_matcher = None
+
+
+def _init_worker(matcher):
+    global _worker_matcher
+    _worker_matcher = matcher
+
+
+def _match_worker(title, k):
+    return _worker_matcher.match(title, k)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description='Match job titles, one per line on stdin, printing results as NDJSON')
+    parser.add_argument("db_path", help='Path of database')
+    parser.add_argument("-k", type=int, default=5, help='Number of results')
+    parser.add_argument("-j", "--workers", type=int, default=1, help='Number of processes')
+    args = parser.parse_args()
+    with s.RomeDB(args.db_path):
+        matcher = TitleMatcher.load()
+    titles = [line.rstrip("\n") for line in sys.stdin]
+    for title, result in zip(titles, matcher.match_many(titles, args.k, args.workers)):
+        result["title"] = title
+        print(json.dumps(result, ensure_ascii=False))
@@ -0,0 +1,287 @@
+"""Metrics of loads and lookups, reported through plain callbacks
+
+Loader phases are measured by LoaderMetrics, see Loader metrics parameter.
+Memory of each phase is only measured when tracing python allocations (trace_memory),
+which slows the load.
+
+SQL statements run by a thread can be counted and timed with QueryCounter,
+and calls to rome lookups reported to hooks added with add_call_hook,
+each report giving the number of statements the call issued.
+Statements slower than a threshold can be logged, see log_slow_queries.
+"""
+import collections
+import contextlib
+import functools
+import logging
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not on unix
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def peak_memory_kb():
+    """peak resident memory of this process since it started, in KiB, if known
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Phase:
+    """metrics of a loader phase, for a model, if any
+
+    Rows parsed, rows inserted and batches flushed are counted by table,
+    as a phase may fill several tables.
+
+    peak_memory_kb is the peak of memory allocated by python during the phase,
+    when tracing allocations.
+    max_rss_kb is the peak resident memory of the process since it started,
+    at the end of the phase, and workers_max_rss_kb the one of worker processes
+    whose results were received during the phase (see Loader.load_parallel).
+    """
+
+    def __init__(self, name, model=None):
+        self.name = name
+        self.model = model
+        self.rows_parsed = collections.Counter()
+        self.rows_inserted = collections.Counter()
+        self.batches = collections.Counter()
+        self.start = self.end = None
+        self.peak_memory_kb = None
+        self.max_rss_kb = None
+        self.workers_max_rss_kb = None
+
+    @property
+    def elapsed(self):
+        if self.start is None:
+            return None
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def as_dict(self):
+        tables = sorted(set(self.rows_parsed) | set(self.rows_inserted) | set(self.batches))
+        return {
+            "phase": self.name,
+            "model": self.model._meta.db_table if self.model is not None else None,
+            "elapsed": self.elapsed,
+            "peak_memory_kb": self.peak_memory_kb,
+            "max_rss_kb": self.max_rss_kb,
+            "workers_max_rss_kb": self.workers_max_rss_kb,
+            "tables": {
+                table: {
+                    "rows_parsed": self.rows_parsed[table],
+                    "rows_inserted": self.rows_inserted[table],
+                    "batches": self.batches[table]}
+                for table in tables}}
+
+
+def _reset_traced_peak():
+    """have tracemalloc measure the peak from now on
+
+    Before python 3.9, tracing is restarted instead,
+    blocks allocated until then being no longer traced.
+    """
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.stop()
+        tracemalloc.start()
+
+
+class LoaderMetrics:
+    """collect metrics of loader phases
+
+    on_start(phase) and on_end(phase) are called around each phase,
+    on_batch(phase, table, rows) each time rows are inserted in a table,
+    phase being given as a dict (see Phase.as_dict).
+    With trace_memory, python allocations are traced (see tracemalloc)
+    from the start to the end of the outermost phase.
+    """
+
+    def __init__(self, on_start=None, on_end=None, on_batch=None, trace_memory=False):
+        self.on_start = on_start
+        self.on_end = on_end
+        self.on_batch = on_batch
+        self.trace_memory = trace_memory
+        self.phases = []
+        self.current = None
+
+    def _traced_peak(self, phase):
+        """account traced memory peak since the last reset to phase
+        """
+        if phase is not None:
+            peak = tracemalloc.get_traced_memory()[1] // 1024
+            phase.peak_memory_kb = max(phase.peak_memory_kb or 0, peak)
+
+    @contextlib.contextmanager
+    def phase(self, name, model=None):
+        phase = Phase(name, model)
+        self.phases.append(phase)
+        previous, self.current = self.current, phase
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            # the peak of an enclosing phase is kept before measuring this one
+            self._traced_peak(previous)
+            _reset_traced_peak()
+        phase.start = time.perf_counter()
+        if self.on_start is not None:
+            self.on_start(phase.as_dict())
+        try:
+            yield phase
+        finally:
+            phase.end = time.perf_counter()
+            if self.trace_memory:
+                self._traced_peak(phase)
+                self._traced_peak(previous)
+                if tracing:
+                    tracemalloc.stop()
+            phase.max_rss_kb = peak_memory_kb()
+            self.current = previous
+            if self.on_end is not None:
+                self.on_end(phase.as_dict())
+
+    def parsed(self, model, count):
+        if self.current is not None:
+            self.current.rows_parsed[model._meta.db_table] += count
+
+    def inserted(self, model, count):
+        if self.current is not None:
+            table = model._meta.db_table
+            self.current.rows_inserted[table] += count
+            self.current.batches[table] += 1
+            if self.on_batch is not None:
+                self.on_batch(self.current.as_dict(), table, count)
+
+    def worker_memory(self, kb):
+        """account for the peak resident memory of a worker process, as it reported it
+        """
+        if self.current is not None and kb is not None:
+            self.current.workers_max_rss_kb = max(self.current.workers_max_rss_kb or 0, kb)
+
+    def report(self):
+        return [phase.as_dict() for phase in self.phases]
+
+
+# queries
+
+_local = threading.local()
+
+# statements taking more seconds are logged, see log_slow_queries
+slow_query_threshold = None
+
+
+def log_slow_queries(seconds):
+    """log statements slower than seconds (None to stop) as warnings of this module logger
+    """
+    global slow_query_threshold
+    slow_query_threshold = seconds
+
+
+def _counters():
+    return getattr(_local, "counters", ())
+
+
+def is_recording():
+    return bool(_counters()) or slow_query_threshold is not None
+
+
+def record_query(sql, params, seconds):
+    """account for a statement run by this thread
+    """
+    if slow_query_threshold is not None and seconds >= slow_query_threshold:
+        logger.warning("slow query (%.3fs): %s %r", seconds, sql, params)
+    for counter in _counters():
+        counter.record(sql, params, seconds)
+
+
+class QueryCounter:
+    """a context counting and timing statements run by this thread
+
+    on_query(sql, params, seconds) is called for each statement,
+    on_slow_query(sql, params, seconds) for those taking slow_query seconds or more,
+    which are also kept in slow_queries.
+    Time is the one of statement execution, rows are fetched afterwards.
+    """
+
+    def __init__(self, on_query=None, slow_query=None, on_slow_query=None):
+        self.on_query = on_query
+        self.slow_query = slow_query
+        self.on_slow_query = on_slow_query
+        self.count = 0
+        self.seconds = 0.0
+        self.slow_queries = []
+
+    def __enter__(self):
+        _local.counters = _counters() + (self,)
+        return self
+
+    def __exit__(self, *args):
+        _local.counters = tuple(c for c in _counters() if c is not self)
+
+    def record(self, sql, params, seconds):
+        self.count += 1
+        self.seconds += seconds
+        if self.on_query is not None:
+            self.on_query(sql, params, seconds)
+        if self.slow_query is not None and seconds >= self.slow_query:
+            self.slow_queries.append((sql, params, seconds))
+            if self.on_slow_query is not None:
+                self.on_slow_query(sql, params, seconds)
+
+
+# calls
+
+_call_hooks = []
+
+
+def add_call_hook(hook):
+    """have hook(call) called after each lookup
+
+    call is a dict with function, args, kwargs, queries (number of statements),
+    query_seconds and elapsed.
+    Hooks run in the thread of the lookup.
+    """
+    _call_hooks.append(hook)
+
+
+def remove_call_hook(hook):
+    _call_hooks.remove(hook)
+
+
+def instrumented(func):
+    """report calls of a lookup function to call hooks
+
+    Lookups made by an instrumented function are accounted to it,
+    not reported on their own.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _call_hooks or getattr(_local, "in_call", False):
+            return func(*args, **kwargs)
+        _local.in_call = True
+        try:
+            start = time.perf_counter()
+            with QueryCounter() as counter:
+                result = func(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+        finally:
+            _local.in_call = False
+        call = {
+            "function": func.__name__,
+            "args": args,
+            "kwargs": kwargs,
+            "queries": counter.count,
+            "query_seconds": counter.seconds,
+            "elapsed": elapsed}
+        for hook in list(_call_hooks):
+            hook(call)
+        return result
+    return wrapper
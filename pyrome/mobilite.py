@@ -0,0 +1,155 @@
+"""Graph of mobilites between romes
+
+The graph is loaded once from the Mobilite table, then queried in memory:
+
+    graph = MobiliteGraph.load()
+    graph.neighbours(rome_id, hops=2, types=["proche"])
+    graph.shortest_path(rome_id, other_id, weights={"proche": 1, "si_evolution": 3})
+
+Romes are given by ogr id, mobilite types by name (or value).
+"""
+import heapq
+from array import array
+
+from . import schema as s
+
+
+_type_by_name = {v: k for k, v in s.Mobilite.TYPE}
+
+
+class MobiliteGraph:
+    """mobilites as adjacency arrays (compressed sparse rows)
+
+    Edges leaving the node at index i are those from offsets[i] to offsets[i + 1]
+    in targets (index of target node) and types (mobilite type).
+    Nodes are romes having mobilites, ids giving their ogr id.
+    """
+
+    def __init__(self, edges):
+        """edges are (origine, cible, type) tuples
+        """
+        edges = sorted(set(edges))
+        nodes = sorted({e[0] for e in edges} | {e[1] for e in edges})
+        self.ids = array("l", nodes)
+        self.index = {ogr_id: i for i, ogr_id in enumerate(nodes)}
+        self.offsets = array("l", [0] * (len(nodes) + 1))
+        self.targets = array("l")
+        self.types = array("b")
+        for origine, cible, type_ in edges:
+            self.offsets[self.index[origine] + 1] += 1
+            self.targets.append(self.index[cible])
+            self.types.append(type_)
+        for i in range(len(nodes)):
+            self.offsets[i + 1] += self.offsets[i]
+
+    @classmethod
+    def load(cls):
+        """graph of mobilites of the connected database
+        """
+        query = s.Mobilite.select(
+            s.Mobilite.origine_rome, s.Mobilite.cible_rome, s.Mobilite.type).tuples()
+        return cls(query)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _mask(self, types):
+        """bit mask of mobilite types, all types if None
+        """
+        if types is None:
+            return -1
+        mask = 0
+        for t in types:
+            mask |= 1 << _type_by_name.get(t, t)
+        return mask
+
+    def _distances(self, i, hops, mask):
+        """number of hops to nodes reachable from node i, within hops if not None
+        """
+        offsets, targets, types = self.offsets, self.targets, self.types
+        distances = {i: 0}
+        frontier = [i]
+        depth = 0
+        while frontier and (hops is None or depth < hops):
+            depth += 1
+            next_frontier = []
+            for j in frontier:
+                for e in range(offsets[j], offsets[j + 1]):
+                    k = targets[e]
+                    if k not in distances and mask & (1 << types[e]):
+                        distances[k] = depth
+                        next_frontier.append(k)
+            frontier = next_frontier
+        return distances
+
+    def neighbours(self, rome, hops=1, types=None):
+        """romes reachable from rome in at most hops mobilites (of types),
+        as a dict giving their number of hops
+
+        With hops None, all reachable romes are given.
+        """
+        i = self.index.get(int(rome))
+        if i is None:
+            return {}
+        ids = self.ids
+        return {
+            ids[j]: d for j, d in self._distances(i, hops, self._mask(types)).items()
+            if j != i}
+
+    def reachable(self, romes, hops=None, types=None):
+        """batch version of neighbours, giving reachable romes as a set, by rome
+        """
+        mask = self._mask(types)
+        ids = self.ids
+        result = {}
+        for rome in romes:
+            i = self.index.get(int(rome))
+            if i is None:
+                result[rome] = frozenset()
+            else:
+                result[rome] = frozenset(
+                    ids[j] for j in self._distances(i, hops, mask) if j != i)
+        return result
+
+    def shortest_path(self, a, b, types=None, weights=None):
+        """cheapest list of romes going from a to b, following mobilites of types
+
+        weights gives the cost of each mobilite type, by name, defaulting to 1.
+        Return None if b can't be reached from a.
+        """
+        start, end = self.index.get(int(a)), self.index.get(int(b))
+        if start is None or end is None:
+            return [a] if int(a) == int(b) else None
+        mask = self._mask(types)
+        # cost by type, None for types not followed
+        cost = [1 if mask & (1 << t) else None for t in sorted(_type_by_name.values())]
+        for t, w in (weights or {}).items():
+            t = _type_by_name.get(t, t)
+            if cost[t] is not None:
+                cost[t] = w
+        offsets, targets, types = self.offsets, self.targets, self.types
+        best = {start: 0}
+        previous = {}
+        heap = [(0, start)]
+        while heap:
+            d, i = heapq.heappop(heap)
+            if i == end:
+                break
+            if d > best[i]:
+                continue
+            for e in range(offsets[i], offsets[i + 1]):
+                c = cost[types[e]]
+                if c is None:
+                    continue
+                j = targets[e]
+                dj = d + c
+                if j not in best or dj < best[j]:
+                    best[j] = dj
+                    previous[j] = i
+                    heapq.heappush(heap, (dj, j))
+        if end not in best:
+            return None
+        path = [end]
+        while path[-1] != start:
+            path.append(previous[path[-1]])
+        return [self.ids[i] for i in reversed(path)]
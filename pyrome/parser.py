@@ -1,16 +1,41 @@
 import collections
+import contextlib
+import json
+import os
+import re
 import xml.etree.ElementTree as ET
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from itertools import islice
 
+import peewee as pw
 
+from . import rome
 from . import schema as s
+from .similarity import SimilarityIndex
+from .metrics import LoaderMetrics, peak_memory_kb
+from .check import CheckError, check_db
+from .sinks import CountingSink, SqliteSink, insert_sql
+from .store import VersionStore
+
+
+# declaration and root start tag of a member, then the name of its first element
+_MEMBER_HEAD_RE = re.compile(rb"(.*?<([^\s/>?!]+)[^>]*>)\s*<([^\s/>]+)[\s/>]", re.S)
 
 
 class Loader:
 
     BATCH_SIZE = 1000
 
+    # number of top level elements of a member parsed at once by a worker
+    PARSE_CHUNK_SIZE = 100
+
+    # bytes read at once when splitting a member in chunks
+    READ_SIZE = 1 << 16
+
+    # number of romes prefetched at once by build_documents
+    DOCUMENTS_CHUNK_SIZE = 100
+
     ogr_fname = collections.OrderedDict([
         (s.Activite, "unix_referentiel_activite_v330_iso8859-15.xml"),
         (s.Appellation, "unix_referentiel_appellation_v330_iso8859-15.xml"),
@@ -18,15 +43,25 @@ class Loader:
         (s.Competence, "unix_referentiel_competence_v330_iso8859-15.xml"),
         (s.Rome, "unix_referentiel_code_rome_v330_iso8859-15.xml")])
 
-    ogr_types = {v: k for k, v in s.Ogr.TYPE}
+    # ogr type of models, whose rows get an Ogr entry
+    ogr_types = {v: k for k, v in s.ogr_type_model.items()}
 
     rome_relations = {
         s.RomeAppellation, s.RomeActivite, s.RomeCompetence, s.RomeEnvTravail, s.Mobilite}
 
+    # tables filled by the fiche and arborescence phases of a build
+    fiche_models = [s.Fiche] + sorted(rome_relations, key=lambda m: m._meta.db_table)
+    arborescence_models = [s.Arborescence, s.Referentiel, s.ArborescenceClosure]
+
     fiche_fname = "unix_fiche_emploi_metier_v330_iso8859-15.xml"
 
     arborescence_fname = "unix_arborescence_v330_iso8859-15.xml"
 
+    # version of the release in above file names, see set_version
+    version = "v330"
+
+    version_re = re.compile(r"_(v\d+)_")
+
     keymap = {
         s.Activite: {"ogr": "code_ogr"},
         s.Appellation: {"ogr": "code_ogr"},
@@ -42,20 +77,170 @@ class Loader:
             "pere": "code_ogr_pere",
             "item_ogr": "code_item_arbor_associe"}}
 
+    # relation giving the romes of models indexed for search
+    search_relations = {
+        s.Appellation: s.RomeAppellation.appellation,
+        s.Competence: s.RomeCompetence.competence,
+        s.Activite: s.RomeActivite.activite,
+        s.EnvTravail: s.RomeEnvTravail.env_travail}
+
+    def __init__(self, streaming=True, workers=1, fast_build=False, vacuum=False, version=None,
+                 search_index=True, documents=True, similar_romes=0, metrics=None, resume=True,
+                 sink=None, check=False):
+        # when streaming, members are read from the zip with iterparse,
+        # one top level element at a time, instead of being loaded whole
+        self.streaming = streaming
+        # above one, members are parsed by as many processes, see load_parallel
+        self.workers = workers or os.cpu_count()
+        # fast build loads without journal nor indexes, see finalize
+        self.fast_build = fast_build
+        self.vacuum = vacuum
+        self._deferred_indexes = []
+        # build full text index, see build_search_index
+        self.search_index = search_index
+        # store romes as documents, see build_documents
+        self.documents = documents
+        # number of similar romes to store for each rome, see build_similarities
+        self.similar_romes = similar_romes
+        # rows waiting to be inserted, by model
+        self._buffers = collections.OrderedDict()
+        self._insert_statements = {}
+        # phases durations and row counts, see pyrome.metrics
+        self.metrics = metrics if metrics is not None else LoaderMetrics()
+        # where rows go, see pyrome.sinks
+        self.sink = sink if sink is not None else SqliteSink()
+        # check the database before installing it, see pyrome.check
+        self.check = check
+        # go on with an interrupted build of the same zip, see __call__
+        self.resume = resume
+        self._source = None
+        self._checkpoints = set()
+        if version is not None:
+            self.set_version(version)
+
+    def detect_version(self, zip_file):
+        """return release version found in the names of the zip members, if any
+        """
+        versions = set()
+        for name in zip_file.namelist():
+            match = self.version_re.search(name)
+            if match:
+                versions.add(match.group(1))
+        if len(versions) > 1:
+            raise ValueError("Zip mixes several versions: %s" % ", ".join(sorted(versions)))
+        return versions.pop() if versions else None
+
+    def set_version(self, version):
+        """use member names of another release
+        """
+        def rename(fname):
+            return fname.replace("_%s_" % self.version, "_%s_" % version)
+
+        self.ogr_fname = collections.OrderedDict(
+            (model, rename(fname)) for model, fname in self.ogr_fname.items())
+        self.fiche_fname = rename(self.fiche_fname)
+        self.arborescence_fname = rename(self.arborescence_fname)
+        self.version = version
+
+    def open_zip(self, zip_path):
+        """open zip, adapting member names to its version
+        """
+        zip_file = zipfile.ZipFile(zip_path, 'r')
+        version = self.detect_version(zip_file)
+        if version is not None and version != self.version:
+            self.set_version(version)
+        return zip_file
+
     def _batched(self, iterator):
         while True:
             batch = list(islice(iterator, None, self.BATCH_SIZE))
-            if batch:
-                yield batch
-            else:
-                raise StopIteration()
+            if not batch:
+                return
+            yield batch
 
-    def iter_data(self, content):
-        if not isinstance(content, (ET.Element, ET.ElementTree)):
-            tree = ET.fromstring(content)
+    def iter_elements(self, content):
+        """iterate over top level elements of content
+
+        content may be bytes, an element or a file like object.
+        In the later case, the document is parsed incrementally
+        and each element is cleared once consumed.
+        """
+        if isinstance(content, ET.ElementTree):
+            yield from content.getroot()
+        elif isinstance(content, ET.Element):
+            yield from content
+        elif isinstance(content, (bytes, str)):
+            yield from ET.fromstring(content)
         else:
-            tree = content
-        for item in tree:
+            depth = 0
+            root = None
+            for event, elem in ET.iterparse(content, events=("start", "end")):
+                if event == "start":
+                    if root is None:
+                        root = elem
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth == 1:
+                    yield elem
+                    # drop consumed element from root
+                    root.clear()
+
+    def iter_chunks(self, f, size):
+        """split the xml stream f in documents of up to size top level elements, as bytes
+
+        Elements are found by their end tag, without parsing,
+        so that parsing happens where documents are sent (see load_parallel).
+        Each document has the declaration and root element of f.
+        """
+        data = bytearray()
+        match = None
+        while match is None:
+            block = f.read(self.READ_SIZE)
+            if not block:
+                return
+            data += block
+            match = _MEMBER_HEAD_RE.match(data)
+        head, root, name = match.groups()
+        if head.endswith(b"/>"):
+            return
+        tail = b"</" + root + b">"
+        end_tag = b"</" + name + b">"
+        start = pos = match.end(1)
+        count = 0
+        while True:
+            end = data.find(end_tag, pos)
+            if end == -1:
+                block = f.read(self.READ_SIZE)
+                if not block:
+                    break
+                # drop elements already sent
+                del data[:start]
+                pos -= start
+                start = 0
+                data += block
+                continue
+            pos = end + len(end_tag)
+            count += 1
+            if count == size:
+                yield head + data[start:pos] + tail
+                start = pos
+                count = 0
+        if count:
+            yield head + data[start:pos] + tail
+
+    @contextlib.contextmanager
+    def open_member(self, zip_file, path):
+        """give access to a member of the zip, as a stream if we are streaming
+        """
+        if self.streaming:
+            with zip_file.open(path) as f:
+                yield f
+        else:
+            yield zip_file.read(path)
+
+    def iter_data(self, content):
+        for item in self.iter_elements(content):
             yield {child.tag: child.text for child in item}
 
     def iter_transform(self, iterator, model, defaults={}):
@@ -70,150 +255,803 @@ class Loader:
                 data[cname] = data.get(key, defaults.get(key))
             yield data
 
+    def insert_statement(self, model):
+        """return the insert sql and the fields it expects for model
+
+        It is computed once, so that sqlite can reuse the prepared statement.
+        """
+        try:
+            return self._insert_statements[model]
+        except KeyError:
+            pass
+        fields = [f for k, f in model._meta.fields.items() if k != "id"]
+        sql = insert_sql(model, fields)
+        self._insert_statements[model] = sql, fields
+        return sql, fields
+
+    def create_table(self, model):
+        """create table for model
+
+        On fast builds, indexes are deferred until data is loaded.
+        """
+        if self.fast_build:
+            model._meta.database.create_table(model)
+            self._deferred_indexes.append(model)
+        else:
+            model.create_table()
+
+    def finalize(self, db):
+        """create deferred indexes and leave the database optimized for reading
+        """
+        with db.atomic():
+            for model in self._deferred_indexes:
+                # left by an interrupted build
+                model._drop_indexes(safe=True)
+                model._create_indexes()
+        self._deferred_indexes = []
+        db.execute_sql("ANALYZE")
+        if self.vacuum:
+            db.execute_sql("VACUUM")
+
+    def to_rows(self, model, data):
+        """convert transformed data to tuples of database values
+        """
+        sql, fields = self.insert_statement(model)
+        return [tuple(f.db_value(d[f.name]) for f in fields) for d in data]
+
+    def prepare_data(self, model, data):
+        """return a list of (model, rows) to insert for data, ogr entries first
+        """
+        prepared = []
+        self.metrics.parsed(model, len(data))
+        if model in self.ogr_types:
+            t = self.ogr_types[model]
+            ogr_data = [{"code": d["ogr"], "type": t} for d in data]
+            prepared.append((s.Ogr, self.to_rows(s.Ogr, ogr_data)))
+        prepared.append((model, self.to_rows(model, data)))
+        return prepared
+
+    def insert_rows(self, model, rows):
+        """write rows to the sink
+        """
+        sql, fields = self.insert_statement(model)
+        self.sink.write(model, fields, rows)
+        self.metrics.inserted(model, len(rows))
+
     def insert_data(self, model, data):
-        fields = [k for k in model._meta.fields.keys() if k != "id"]
-        if model._meta.name in self.ogr_types.keys():
-            # create ogr entries first
-            t = self.ogr_types[model._meta.name]
-            s.Ogr.insert_many([{"code": d["ogr"], "type":t} for d in data]).execute()
-        # keep columns only
-        data = [{k: d[k] for k in fields} for d in data]
-        model.insert_many(data).execute()
+        for model, rows in self.prepare_data(model, data):
+            self.insert_rows(model, rows)
 
-    def load_data(self, model, content, defaults={}):
+    def buffer_rows(self, model, rows):
+        """add rows to the buffer of model, inserting them by batches
+        """
+        buffer = self._buffers.setdefault(model, [])
+        buffer.extend(rows)
+        while len(buffer) >= self.BATCH_SIZE:
+            self.insert_rows(model, buffer[:self.BATCH_SIZE])
+            del buffer[:self.BATCH_SIZE]
+
+    def buffer_data(self, model, data):
+        for model, rows in self.prepare_data(model, data):
+            self.buffer_rows(model, rows)
+
+    def flush(self):
+        """insert all remaining buffered rows
+        """
+        for model, buffer in self._buffers.items():
+            if buffer:
+                self.insert_rows(model, buffer)
+        self._buffers.clear()
+
+    def iter_batches(self, model, content, defaults={}):
         iterator = self.iter_transform(self.iter_data(content), model, defaults)
-        for data in self._batched(iterator):
+        yield from self._batched(iterator)
+
+    def load_data(self, model, content, defaults={}):
+        for data in self.iter_batches(model, content, defaults):
             self.insert_data(model, data)
 
-    def load_card_bloc(self, bloc, defaults):
-        self.load_data(
+    def transform_content(self, model, content, defaults={}):
+        return list(self.iter_transform(self.iter_data(content), model, defaults))
+
+    def iter_card_bloc(self, bloc, defaults):
+        yield s.RomeActivite, self.transform_content(
             s.RomeActivite,
             bloc.find("activite_de_base") or bloc.find("activite_specifique"),
             defaults)
-        self.load_data(
+        yield s.RomeCompetence, self.transform_content(
             s.RomeCompetence,
             bloc.find("savoir_theorique_et_proceduraux"),
             defaults)
-        self.load_data(
+        yield s.RomeCompetence, self.transform_content(
             s.RomeCompetence,
             bloc.find("savoir_action"),
             defaults)
 
-    def collect_rome_code(self):
-        results = s.Rome.select(s.Rome.code_rome, s.Rome.ogr).execute()
-        self.rome_code_ogr = {r.code_rome: r.ogr for r in results}
-
-    def load_mobilite(self, content, defaults):
-        iterator = self.iter_transform(self.iter_data(content), s.Mobilite, defaults)
-        for data in self._batched(iterator):
-            # adjust
-            for d in data:
-                code = d["code_rome_cible"].split(maxsplit=1)[0]
-                d["cible_rome"] = self.rome_code_ogr[code]
-            # create
-            self.insert_data(s.Mobilite, data)
-
-    def load_fiche(self, content):
-        """load fiche
+    def collect_rome_code(self, zip_file=None):
+        """collect ogr of romes by code, from the database or the rome referentiel of zip_file
+        """
+        if zip_file is None:
+            results = s.Rome.select(s.Rome.code_rome, s.Rome.ogr).tuples()
+            self.rome_code_ogr = dict(results)
+        else:
+            with self.open_member(zip_file, self.ogr_fname[s.Rome]) as content:
+                self.rome_code_ogr = {
+                    d["code_rome"]: d["code_ogr"] for d in self.iter_data(content)}
+
+    def iter_mobilite(self, content, defaults):
+        data = self.transform_content(s.Mobilite, content, defaults)
+        # adjust
+        for d in data:
+            code = d["code_rome_cible"].split(maxsplit=1)[0]
+            d["cible_rome"] = self.rome_code_ogr[code]
+        yield s.Mobilite, data
+
+    def iter_card(self, card):
+        """yield (model, data) for all rows of a fiche card
+
+        rome_code_ogr must have been collected first.
         """
-        tree = ET.fromstring(content)
-        self.collect_rome_code()
-        cards = []
         simple_attrs = [
             "numero", "definition", "formations_associees",
             "condition_exercice_activite", "classement_emploi_metier"]
-        for card in tree:
-            data = {}
-            for attrname in simple_attrs:
-                data[attrname] = card.find("numero").text
-            data["rome"] = card.find("bloc_code_rome").find("code_ogr").text
-
-            defaults = {"rome": data["rome"], "bloc": None}
-            self.load_data(
-                s.RomeAppellation,
-                card.find("appellation"),
-                defaults)
-            self.load_data(
-                s.RomeEnvTravail,
-                card.find("environnement_de_travail"),
-                defaults)
-            self.load_card_bloc(card.find("les_activites_de_base"), defaults)
-
-            for bloc in card.find("les_activites_specifique"):
-                defaults = {
-                    "rome": data["rome"],
-                    "bloc": bloc.find("position_bloc").text}
-                self.load_card_bloc(bloc, defaults)
-
-            self.load_mobilite(
-                card.find("les_mobilites").find("proche"),
-                {"origine_rome": data["rome"], "type": 0})
-            self.load_mobilite(
-                card.find("les_mobilites").find("si_evolution"),
-                {"origine_rome": data["rome"], "type": 1})
-
-            cards.append(data)
-
-        for data in self._batched(iter(cards)):
-            self.insert_data(s.Fiche, data)
+        data = {}
+        for attrname in simple_attrs:
+            # optional elements may be missing, empty ones give None as before
+            data[attrname] = card.findtext(attrname) or None
+        data["rome"] = card.find("bloc_code_rome").find("code_ogr").text
 
-    def load_arborescence(self, content):
-        """Load arborescence table
+        defaults = {"rome": data["rome"], "bloc": None}
+        yield s.RomeAppellation, self.transform_content(
+            s.RomeAppellation,
+            card.find("appellation"),
+            defaults)
+        yield s.RomeEnvTravail, self.transform_content(
+            s.RomeEnvTravail,
+            card.find("environnement_de_travail"),
+            defaults)
+        yield from self.iter_card_bloc(card.find("les_activites_de_base"), defaults)
+
+        for bloc in card.find("les_activites_specifique"):
+            defaults = {
+                "rome": data["rome"],
+                "bloc": bloc.find("position_bloc").text}
+            yield from self.iter_card_bloc(bloc, defaults)
+
+        yield from self.iter_mobilite(
+            card.find("les_mobilites").find("proche"),
+            {"origine_rome": data["rome"], "type": 0})
+        yield from self.iter_mobilite(
+            card.find("les_mobilites").find("si_evolution"),
+            {"origine_rome": data["rome"], "type": 1})
+
+        yield s.Fiche, [data]
+
+    def load_fiche(self, content, zip_file=None):
+        """load fiche
+
+        Rows are buffered across cards, and inserted by batches.
+        Rome codes are taken from zip_file if given, see collect_rome_code.
+        """
+        self.collect_rome_code(zip_file)
+        for card in self.iter_elements(content):
+            for model, data in self.iter_card(card):
+                self.buffer_data(model, data)
+        self.flush()
+
+    def iter_arborescence(self, content):
+        """yield (model, data) batches for arborescence and referentiel tables
+
+        This is done in a single pass, nodes coming before their father
+        (or their root) are kept aside until it is known.
         """
         noeud_to_type = {v: k for k, v in s.Arborescence.TYPE_NOEUD}
 
-        # we need a first pass to map code to id, to have pere as a key
         code_to_ogr_id = {}
         referentiel_label_to_id = {}
-        for d in self.iter_data(content):
-            code_to_ogr_id[d["code_noeud"]] = d["code_ogr"]
-            if not d["code_pere"] or not d["code_pere"].strip():
-                referentiel_label_to_id[d["libelle_referentiel"]] = d["code_ogr"]
+        pending = []
 
-        iterator = self.iter_transform(self.iter_data(content), s.Arborescence)
-        for data in self._batched(iterator):
-            referentiel_data = []
-            # transform
-            for d in data:
+        def resolve(d):
+            d["pere"] = code_to_ogr_id[d["code_pere"]] if d["code_pere"] else None
+            d["referentiel"] = referentiel_label_to_id[d["libelle_referentiel"]]
+
+        def iter_resolved(iterator):
+            for d in iterator:
+                code_to_ogr_id[d["code_noeud"]] = d["code_ogr"]
                 if not d["item_ogr"] or d["item_ogr"] == "0":
                     d["item_ogr"] = None
+                d["type_noeud"] = noeud_to_type[d["libelle_noeud"]]
                 if not d["code_pere"] or not d["code_pere"].strip():
                     # root
-                    d["pere"] = None
-                    referentiel_data.append(
-                        {"ogr": d["ogr"], "libelle": d["libelle_referentiel"]})
+                    d["code_pere"] = None
+                    referentiel_label_to_id[d["libelle_referentiel"]] = d["code_ogr"]
+                try:
+                    resolve(d)
+                except KeyError:
+                    pending.append(d)
                 else:
-                    # get pere
-                    d["pere"] = code_to_ogr_id[d["code_pere"]]
-                d["referentiel"] = referentiel_label_to_id[d["libelle_referentiel"]]
-                d["type_noeud"] = noeud_to_type[d["libelle_noeud"]]
+                    yield d
+            # everything is known now
+            for d in pending:
+                resolve(d)
+                yield d
+
+        iterator = self.iter_transform(self.iter_data(content), s.Arborescence)
+        for data in self._batched(iter_resolved(iterator)):
+            referentiel_data = [
+                {"ogr": d["ogr"], "libelle": d["libelle_referentiel"]}
+                for d in data if d["pere"] is None]
             if referentiel_data:
-                self.insert_data(s.Referentiel, referentiel_data)
-            self.insert_data(s.Arborescence, data)
+                yield s.Referentiel, referentiel_data
+            yield s.Arborescence, data
 
-    def __call__(self, zip_path, db_path):
-        zip_file = zipfile.ZipFile(zip_path, 'r')
-        with s.RomeDB(db_path) as db, zip_file as z:
-            s.Ogr.create_table()
-            # create tables
+    def load_arborescence(self, content):
+        """Load arborescence table
+        """
+        for model, data in self.iter_arborescence(content):
+            self.insert_data(model, data)
+
+    def build_closure(self, db):
+        """fill arborescence closure table, from Arborescence.pere
+        """
+        quote = db.compiler().quote
+        closure = s.ArborescenceClosure
+        db.execute_sql("DELETE FROM %s" % quote(closure._meta.db_table))
+        db.execute_sql(
+            """INSERT INTO {closure} ({ancetre}, {descendant}, {profondeur})
+            WITH RECURSIVE c(ancetre, descendant, profondeur) AS (
+                SELECT {ogr}, {ogr}, 0 FROM {arborescence}
+                UNION ALL
+                SELECT c.ancetre, a.{ogr}, c.profondeur + 1
+                FROM c JOIN {arborescence} AS a ON a.{pere} = c.descendant)
+            SELECT ancetre, descendant, profondeur FROM c""".format(
+                closure=quote(closure._meta.db_table),
+                ancetre=quote(closure.ancetre.db_column),
+                descendant=quote(closure.descendant.db_column),
+                profondeur=quote(closure.profondeur.db_column),
+                arborescence=quote(s.Arborescence._meta.db_table),
+                ogr=quote(s.Arborescence.ogr.db_column),
+                pere=quote(s.Arborescence.pere.db_column)))
+
+    def build_search_index(self, db):
+        """(re)build the full text index over libelles
+
+        There is one document per object, its libelles (without duplicates)
+        being indexed with accents and case folded.
+        The code of related romes are stored along.
+        """
+        db.execute_sql("DROP TABLE IF EXISTS %s" % s.SEARCH_TABLE)
+        db.execute_sql(
+            "CREATE VIRTUAL TABLE %s USING fts5("
+            "texte, libelle UNINDEXED, ogr UNINDEXED, type UNINDEXED, codes_rome UNINDEXED, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')" % s.SEARCH_TABLE)
+        sql = "INSERT INTO %s (texte, libelle, ogr, type, codes_rome) VALUES (?, ?, ?, ?, ?)" % (
+            s.SEARCH_TABLE)
+        cursor = db.get_cursor()
+        for model in self.ogr_fname:
+            libelle_fields = [
+                f for name, f in model._meta.fields.items() if name.startswith("libelle")]
+            if model is s.Rome:
+                codes_rome = dict(s.Rome.select(s.Rome.ogr, s.Rome.code_rome).tuples())
+            else:
+                fk = self.search_relations[model]
+                codes_rome = collections.defaultdict(list)
+                query = fk.model_class.select(fk, s.Rome.code_rome).join(s.Rome).tuples()
+                for ogr, code_rome in query:
+                    if code_rome not in codes_rome[ogr]:
+                        codes_rome[ogr].append(code_rome)
+                codes_rome = {k: " ".join(v) for k, v in codes_rome.items()}
+            rows = []
+            for ogr, libelle, *libelles in model.select(
+                    model.ogr, model.libelle, *libelle_fields).tuples():
+                texte = "\n".join(collections.OrderedDict.fromkeys(filter(None, libelles)))
+                rows.append(
+                    (texte, libelle, ogr, self.ogr_types[model], codes_rome.get(ogr, "")))
+            cursor.executemany(sql, rows)
+
+    def build_documents(self, db):
+        """(re)build documents of romes, that get_rome returns as is
+
+        Romes are serialized as rome_to_dict gives them.
+        """
+        if s.RomeDocument.table_exists():
+            s.RomeDocument.delete().execute()
+        else:
+            self.create_table(s.RomeDocument)
+        for romes in rome._rome_chunks(self.DOCUMENTS_CHUNK_SIZE):
+            data = [
+                {"rome": ogr_id, "code_rome": document["code_rome"],
+                 "document": json.dumps(document, ensure_ascii=False, separators=(",", ":"))}
+                for ogr_id, document in romes.items()]
+            self.insert_rows(s.RomeDocument, self.to_rows(s.RomeDocument, data))
+
+    def build_similarities(self, db):
+        """(re)compute the most similar romes of each rome
+        """
+        if s.RomeSimilaire.table_exists():
+            s.RomeSimilaire.delete().execute()
+        else:
+            self.create_table(s.RomeSimilaire)
+        index = SimilarityIndex.load()
+        for rome_id, similar in index.top_k(self.similar_romes).items():
+            data = [
+                {"rome": rome_id, "similaire": similaire, "rang": rang, "score": score}
+                for rang, (similaire, score) in enumerate(similar, 1)]
+            self.buffer_rows(s.RomeSimilaire, self.to_rows(s.RomeSimilaire, data))
+        self.flush()
+
+    # parsing in worker processes, see load_parallel
+
+    def parse_entities(self, model, content):
+        """return (model, rows) to insert for items of content, of the referentiel of model
+        """
+        return [
+            prepared
+            for data in self.iter_batches(model, content)
+            for prepared in self.prepare_data(model, data)]
+
+    def parse_fiche(self, content):
+        """return (model, rows) to insert for the cards of content
+
+        rome_code_ogr must have been collected first.
+        """
+        return [
+            prepared
+            for card in self.iter_elements(content)
+            for model, data in self.iter_card(card)
+            for prepared in self.prepare_data(model, data)]
+
+    def parse_arborescence(self, content):
+        """return (model, rows) to insert for arborescence and referentiel
+        """
+        return [
+            prepared
+            for model, data in self.iter_arborescence(content)
+            for prepared in self.prepare_data(model, data)]
+
+    def parse_chunks(self, executor, method, f, *args):
+        """parse chunks of the member f with method in executor, yielding (model, rows)
+
+        Results come in the order of the member,
+        at most two chunks per worker being read ahead.
+        """
+        futures = collections.deque()
+        for chunk in self.iter_chunks(f, self.PARSE_CHUNK_SIZE):
+            futures.append(executor.submit(_parse_chunk, method, *args, chunk))
+            if len(futures) >= 2 * self.workers:
+                yield from self.received(*futures.popleft().result())
+        while futures:
+            yield from self.received(*futures.popleft().result())
+
+    def load_serial(self, z, db):
+        """load members one after the other
+        """
+        for model, path in self.ogr_fname.items():
+            if self.pending(model._meta.db_table, [model]):
+                with self.metrics.phase("load_data", model), db.atomic(), \
+                        self.open_member(z, path) as content:
+                    self.create_table(model)
+                    self.load_data(model, content)
+                    self.checkpoint(model._meta.db_table)
+        if self.pending("fiche", self.fiche_models):
+            with self.metrics.phase("load_fiche"), db.atomic(), \
+                    self.open_member(z, self.fiche_fname) as content:
+                for model in self.fiche_models:
+                    self.create_table(model)
+                self.load_fiche(content)
+                self.checkpoint("fiche")
+        if self.pending("arborescence", self.arborescence_models):
+            with db.atomic(), self.open_member(z, self.arborescence_fname) as content:
+                with self.metrics.phase("load_arborescence"):
+                    for model in self.arborescence_models:
+                        self.create_table(model)
+                    self.load_arborescence(content)
+                with self.metrics.phase("build_closure"):
+                    self.build_closure(db)
+                self.checkpoint("arborescence")
+
+    def load_parallel(self, z, db):
+        """parse members in worker processes, while inserting in this one
+
+        This process reads members, sending chunks of their raw elements
+        to workers (see iter_chunks), and inserts rows as results come.
+        The arborescence, parsed in a single pass, goes to one worker.
+        Insertions happen in the same order as a serial load,
+        so that resulting database is the same.
+        Only members of phases still pending are parsed.
+        """
+        with ProcessPoolExecutor(
+                self.workers, initializer=_init_worker,
+                initargs=(type(self), self.streaming, self.version, z.filename)) as executor:
+            arborescence = None
+            if self.pending("arborescence", self.arborescence_models):
+                arborescence = executor.submit(
+                    _parse_member, "parse_arborescence", self.arborescence_fname)
             for model, path in self.ogr_fname.items():
+                if self.pending(model._meta.db_table, [model]):
+                    with self.metrics.phase("load_data", model), db.atomic(), \
+                            z.open(path) as f:
+                        self.create_table(model)
+                        for rows_model, rows in self.parse_chunks(
+                                executor, "parse_entities", f, model):
+                            self.insert_rows(rows_model, rows)
+                        self.checkpoint(model._meta.db_table)
+            if self.pending("fiche", self.fiche_models):
+                with self.metrics.phase("load_fiche"), db.atomic(), \
+                        z.open(self.fiche_fname) as f:
+                    for model in self.fiche_models:
+                        self.create_table(model)
+                    for model, rows in self.parse_chunks(executor, "parse_fiche", f):
+                        self.buffer_rows(model, rows)
+                    self.flush()
+                    self.checkpoint("fiche")
+            if arborescence is not None:
                 with db.atomic():
-                    model.create_table()
-                    self.load_data(model, z.read(path))
-            with db.atomic():
-                for model in self.rome_relations:
-                    model.create_table()
-                s.Fiche.create_table()
-                self.load_fiche(z.read(self.fiche_fname))
+                    with self.metrics.phase("load_arborescence"):
+                        for model in self.arborescence_models:
+                            self.create_table(model)
+                        for model, rows in self.received(*arborescence.result()):
+                            self.insert_rows(model, rows)
+                    with self.metrics.phase("build_closure"):
+                        self.build_closure(db)
+                    self.checkpoint("arborescence")
+
+    def received(self, prepared, worker_memory_kb):
+        """count rows parsed by a worker (see prepare_data), and its memory
+        """
+        self.metrics.worker_memory(worker_memory_kb)
+        for model, rows in prepared:
+            if model is not s.Ogr:
+                self.metrics.parsed(model, len(rows))
+            yield model, rows
+
+    def feed(self, zip_path):
+        """write all rows of the zip to the sink, in a single pass and without database
+
+        Only tables parsed from the zip are written,
+        not those a build computes from them (closure, search index, documents...).
+        """
+        with self.open_zip(zip_path) as z:
+            for model, path in self.ogr_fname.items():
+                with self.metrics.phase("load_data", model), \
+                        self.open_member(z, path) as content:
+                    self.load_data(model, content)
+            with self.metrics.phase("load_fiche"), \
+                    self.open_member(z, self.fiche_fname) as content:
+                self.load_fiche(content, z)
+            with self.metrics.phase("load_arborescence"), \
+                    self.open_member(z, self.arborescence_fname) as content:
+                self.load_arborescence(content)
+        self.sink.close()
+
+    def count_rows(self, zip_path):
+        """number of rows of each table parsed from the zip, by table name
+        """
+        sink = CountingSink()
+        type(self)(streaming=self.streaming, version=self.version, sink=sink).feed(zip_path)
+        return dict(sink.counts)
+
+    def parsed_counts(self):
+        """number of rows parsed by the load phases that ran, by table name
+        """
+        counts = collections.Counter()
+        for phase in self.metrics.phases:
+            if phase.name in ("load_data", "load_fiche", "load_arborescence"):
+                counts.update(phase.rows_parsed)
+        return dict(counts)
+
+    # atomic and resumable builds
+
+    def build_path(self, db_path):
+        """file where db_path is built, next to it so that it can be renamed
+        """
+        return db_path + ".build"
+
+    def build_source(self, zip_path):
+        """identify the zip and options of a build, that only the same build resumes
+        """
+        stat = os.stat(zip_path)
+        return json.dumps([
+            os.path.abspath(zip_path), stat.st_size, stat.st_mtime_ns, self.version,
+            self.fast_build, self.search_index, self.documents, self.similar_romes])
+
+    def read_checkpoints(self, build_path, source):
+        """phases done by an interrupted build of source at build_path
+
+        Return None if there is no such build, or if the file is damaged.
+        """
+        if not os.path.exists(build_path):
+            return None
+        try:
+            with s.RomeDB(build_path, bound=True) as db:
+                if db.execute_sql("PRAGMA quick_check").fetchone()[0] != "ok":
+                    return None
+                if not s.BuildCheckpoint.table_exists():
+                    return None
+                checkpoints = dict(s.BuildCheckpoint.select(
+                    s.BuildCheckpoint.phase, s.BuildCheckpoint.source).tuples())
+        except pw.DatabaseError:
+            return None
+        if any(v != source for v in checkpoints.values()):
+            return None
+        return set(checkpoints)
+
+    def remove_build(self, build_path):
+        for path in [build_path, build_path + "-journal", build_path + "-wal"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def pending(self, phase, models=()):
+        """whether phase must run, dropping tables of models if so
+
+        Tables (and ogr entries) of models are those filled by the phase,
+        they may hold the partial work of an interrupted build
+        (fast builds having no journal to roll it back).
+        """
+        if phase in self._checkpoints:
+            if self.fast_build:
+                self._deferred_indexes.extend(models)
+            return False
+        for model in models:
+            model.drop_table(fail_silently=True)
+            if model in self.ogr_types and s.Ogr.table_exists():
+                s.Ogr.delete().where(s.Ogr.type == self.ogr_types[model]).execute()
+        return True
+
+    def checkpoint(self, phase):
+        """record phase as done, in the transaction of its data
+        """
+        s.BuildCheckpoint.create(phase=phase, source=self._source)
+        self._checkpoints.add(phase)
+
+    def install(self, build_path, db_path):
+        """replace db_path by the complete build, atomically
+        """
+        with open(build_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(build_path, db_path)
+
+    def __call__(self, zip_path, db_path):
+        """build a database at db_path from the zip
+
+        The database is built in another file, then renamed to db_path:
+        until then, a previous db_path is left untouched for its readers.
+        Each phase is recorded as done in the same transaction as its data,
+        so that if the build is interrupted, running it again goes on
+        from the first phase not done (unless resume is False).
+        """
+        zip_file = self.open_zip(zip_path)
+        build_path = self.build_path(db_path)
+        self._source = self.build_source(zip_path)
+        checkpoints = self.read_checkpoints(build_path, self._source) if self.resume else None
+        if checkpoints is None:
+            self.remove_build(build_path)
+        self._checkpoints = checkpoints or set()
+        self._deferred_indexes = []
+        with s.RomeDB(build_path, bulk_load=self.fast_build, bound=True) as db, zip_file as z:
+            s.BuildCheckpoint.create_table(fail_silently=True)
+            if self.pending("ogr", [s.Ogr]):
+                with db.atomic():
+                    self.create_table(s.Ogr)
+                    self.checkpoint("ogr")
+            if self.workers > 1:
+                self.load_parallel(z, db)
+            else:
+                self.load_serial(z, db)
+            if self.search_index and self.pending("search_index"):
+                with self.metrics.phase("build_search_index"), db.atomic():
+                    self.build_search_index(db)
+                    self.checkpoint("search_index")
+            if self.documents and self.pending("documents", [s.RomeDocument]):
+                with self.metrics.phase("build_documents"), db.atomic():
+                    self.build_documents(db)
+                    self.checkpoint("documents")
+            if self.similar_romes and self.pending("similarities", [s.RomeSimilaire]):
+                with self.metrics.phase("build_similarities"), db.atomic():
+                    self.build_similarities(db)
+                    self.checkpoint("similarities")
+            if self.fast_build and self.pending("finalize"):
+                with self.metrics.phase("finalize"):
+                    self.finalize(db)
+                    self.checkpoint("finalize")
+            if self.check:
+                with self.metrics.phase("check"):
+                    failures = check_db(self.parsed_counts())
+                if failures:
+                    raise CheckError(failures)
+            s.BuildCheckpoint.drop_table()
+        self.install(build_path, db_path)
+
+    def add_version(self, zip_path, store_path, version=None):
+        """add the release in zip to the store at store_path, as version
+
+        version defaults to the one of the zip.
+        The release is first built in a database next to the store, see pyrome.store.
+        Return numbers of (shared, added) rows by table.
+        """
+        built_path = store_path + ".version"
+        loader = type(self)(
+            streaming=self.streaming, workers=self.workers, fast_build=True,
+            version=self.version, search_index=False, documents=False,
+            metrics=self.metrics, resume=False, check=self.check)
+        loader(zip_path, built_path)
+        try:
+            with s.RomeDB(store_path, bound=True):
+                return VersionStore().add(built_path, version or loader.version)
+        finally:
+            os.remove(built_path)
+
+    # incremental update of an existing database
+
+    def iter_prepared(self, zip_file):
+        """yield (model, rows) for the whole zip, in insertion order
+        """
+        for model, path in self.ogr_fname.items():
+            with self.open_member(zip_file, path) as content:
+                yield from self.parse_entities(model, content)
+        # rome codes are taken from the rome referentiel, not the database
+        self.collect_rome_code(zip_file)
+        with self.open_member(zip_file, self.fiche_fname) as content:
+            yield from self.parse_fiche(content)
+        with self.open_member(zip_file, self.arborescence_fname) as content:
+            yield from self.parse_arborescence(content)
+
+    def diff_rows(self, model, rows):
+        """compare rows with the content of model table
+
+        Tables with an ogr primary key are compared by key and content hash,
+        others, having an automatic id, are compared as a multiset of rows.
+        Return rows to insert, rows to update and keys (or ids) to delete.
+        """
+        db = model._meta.database
+        quote = db.compiler().quote
+        sql, fields = self.insert_statement(model)
+        pk = model._meta.primary_key
+        columns = ", ".join(quote(f.db_column) for f in fields)
+        table = quote(model._meta.db_table)
+        names = [f.name for f in fields]
+        inserted, updated = [], []
+        if pk.name in names:
+            index = names.index(pk.name)
+            existing = {
+                row[index]: hash(row)
+                for row in db.execute_sql("SELECT %s FROM %s" % (columns, table))}
+            for row in rows:
+                key = row[index]
+                content_hash = existing.pop(key, None)
+                if content_hash is None:
+                    inserted.append(row)
+                elif content_hash != hash(row):
+                    updated.append(row)
+            deleted = list(existing)
+        else:
+            existing = collections.defaultdict(list)
+            sql = "SELECT %s, %s FROM %s ORDER BY %s" % (
+                quote(pk.db_column), columns, table, quote(pk.db_column))
+            for row in db.execute_sql(sql):
+                existing[row[1:]].append(row[0])
+            for row in rows:
+                ids = existing.get(row)
+                if ids:
+                    ids.pop(0)
+                else:
+                    inserted.append(row)
+            deleted = [i for ids in existing.values() for i in ids]
+        return inserted, updated, deleted
+
+    def apply_diff(self, model, inserted, updated, deleted):
+        db = model._meta.database
+        quote = db.compiler().quote
+        sql, fields = self.insert_statement(model)
+        pk = model._meta.primary_key
+        table = quote(model._meta.db_table)
+        cursor = db.get_cursor()
+        if deleted:
+            cursor.executemany(
+                "DELETE FROM %s WHERE %s = ?" % (table, quote(pk.db_column)),
+                [(key,) for key in deleted])
+        if updated:
+            index = [f.name for f in fields].index(pk.name)
+            others = fields[:index] + fields[index + 1:]
+            cursor.executemany(
+                "UPDATE %s SET %s WHERE %s = ?" % (
+                    table,
+                    ", ".join("%s = ?" % quote(f.db_column) for f in others),
+                    quote(pk.db_column)),
+                [row[:index] + row[index + 1:] + (row[index],) for row in updated])
+        if inserted:
+            cursor.executemany(sql, inserted)
+            self.metrics.inserted(model, len(inserted))
+
+    def update(self, zip_path, db_path):
+        """update an existing database to the release in zip, touching only what changed
+
+        Return a change report, giving for each table
+        inserted, updated and deleted rows.
+        Rows are given by primary key for tables with an ogr key,
+        and as dicts for other tables.
+        """
+        zip_file = self.open_zip(zip_path)
+        with s.RomeDB(db_path, bound=True) as db, zip_file as z:
+            by_model = collections.OrderedDict()
+            with self.metrics.phase("parse"):
+                for model, rows in self.iter_prepared(z):
+                    by_model.setdefault(model, []).extend(rows)
+            changes = collections.OrderedDict()
             with db.atomic():
-                s.Arborescence.create_table()
-                s.Referentiel.create_table()
-                self.load_arborescence(z.read(self.arborescence_fname))
+                for model, rows in by_model.items():
+                    with self.metrics.phase("apply_diff", model):
+                        diff = self.diff_rows(model, rows)
+                        self.apply_diff(model, *diff)
+                    changes[model] = diff
+                s.ArborescenceClosure.create_table(fail_silently=True)
+                if any(changes[s.Arborescence]) or not s.ArborescenceClosure.select().exists():
+                    with self.metrics.phase("build_closure"):
+                        self.build_closure(db)
+                changed = any(any(diff) for diff in changes.values())
+                if self.search_index and changed:
+                    with self.metrics.phase("build_search_index"):
+                        self.build_search_index(db)
+                if self.documents and (changed or not s.RomeDocument.table_exists()):
+                    with self.metrics.phase("build_documents"):
+                        self.build_documents(db)
+                if self.similar_romes and (changed or not s.RomeSimilaire.table_exists()):
+                    with self.metrics.phase("build_similarities"):
+                        self.build_similarities(db)
+        return self.change_report(changes)
+
+    def change_report(self, changes):
+        report = collections.OrderedDict([("version", self.version), ("tables", {})])
+        for model, (inserted, updated, deleted) in changes.items():
+            sql, fields = self.insert_statement(model)
+            pk = model._meta.primary_key
+            names = [f.name for f in fields]
+            if pk.name in names:
+                index = names.index(pk.name)
+                inserted = [row[index] for row in inserted]
+                updated = [row[index] for row in updated]
+            else:
+                inserted = [dict(zip(names, row)) for row in inserted]
+                deleted = [{pk.name: key} for key in deleted]
+            report["tables"][model._meta.db_table] = {
+                "inserted": inserted, "updated": updated, "deleted": deleted}
+        return report
+
+
+# loader of a worker process and the zip it reads, see Loader.load_parallel
+_worker_loader = None
+_worker_zip_path = None
+
+
+def _init_worker(loader_class, streaming, version, zip_path):
+    global _worker_loader, _worker_zip_path
+    _worker_loader = loader_class(streaming=streaming, version=version)
+    _worker_zip_path = zip_path
+    # rome codes are taken from the rome referentiel, not the database
+    with zipfile.ZipFile(zip_path, 'r') as zip_file:
+        _worker_loader.collect_rome_code(zip_file)
+
+
+def _parse_chunk(method, *args):
+    """run a parse method of the worker loader, on a chunk of a member
+
+    Return its result and the peak memory of the worker.
+    """
+    return getattr(_worker_loader, method)(*args), peak_memory_kb()
+
+
+def _parse_member(method, path):
+    """run a parse method of the worker loader, on a whole member of the zip
+
+    Return its result and the peak memory of the worker.
+    """
+    with zipfile.ZipFile(_worker_zip_path, 'r') as zip_file, \
+            _worker_loader.open_member(zip_file, path) as content:
+        return getattr(_worker_loader, method)(content), peak_memory_kb()
 
 
 if __name__ == "__main__":
     import argparse
-    import os
     import sys
 
     parser = argparse.ArgumentParser(description='Load zip of ROME')
@@ -221,15 +1059,61 @@ if __name__ == "__main__":
     parser.add_argument("db_path", help='Path where to store data')
     parser.add_argument("-x", "--overwrite", action='store_true',
                         help='Delete db if it already exists')
+    parser.add_argument("-u", "--update", action='store_true',
+                        help='Update existing db to the zip release, printing a change report')
+    parser.add_argument("-f", "--fast", action='store_true',
+                        help='Fast build: no journal while loading, indexes created at the end')
+    parser.add_argument("--vacuum", action='store_true',
+                        help='Vacuum database at the end of a fast build')
+    parser.add_argument("--no-search", action='store_true',
+                        help='Do not build the full text search index')
+    parser.add_argument("--no-documents", action='store_true',
+                        help='Do not store romes as documents')
+    parser.add_argument("--similar", type=int, default=0, metavar="K",
+                        help='Store the K most similar romes of each rome')
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help='Number of processes parsing data, 0 for one per cpu')
+    parser.add_argument("--check", action='store_true',
+                        help='Check integrity of the database before installing it')
+    parser.add_argument("--restart", action='store_true',
+                        help='Start over an interrupted build instead of resuming it')
+    parser.add_argument("-v", "--verbose", action='store_true',
+                        help='Print time, memory and rows of each phase on stderr')
+    parser.add_argument("--trace-memory", action='store_true',
+                        help='Measure memory allocated by each phase (slower)')
 
     args = parser.parse_args()
-    # verify overwrite of db
-    if os.path.exists(args.db_path):
-        if not args.overwrite:
-            print("database exists", file=sys.stderr)
-            exit(1)
-        else:
-            os.remove(args.db_path)
+
+    def print_phase(phase):
+        rows = sum(t["rows_inserted"] for t in phase["tables"].values())
+        print("%-20s %-16s %8.2fs %8d rows %10s KiB peak %10s KiB max rss %10s KiB workers" % (
+            phase["phase"], phase["model"] or "", phase["elapsed"], rows,
+            phase["peak_memory_kb"], phase["max_rss_kb"], phase["workers_max_rss_kb"]),
+            file=sys.stderr)
+
+    metrics = LoaderMetrics(
+        on_end=print_phase if args.verbose else None, trace_memory=args.trace_memory)
+    if args.update:
+        report = Loader(
+            search_index=not args.no_search, documents=not args.no_documents,
+            similar_romes=args.similar, metrics=metrics).update(
+            args.zip_path, args.db_path)
+        json.dump(report, sys.stdout, indent=2)
+        exit(0)
+    # verify overwrite of db, that is replaced once the build is complete
+    if os.path.exists(args.db_path) and not args.overwrite:
+        print("database exists", file=sys.stderr)
+        exit(1)
 
     # Go
-    Loader()(args.zip_path, args.db_path)
+    loader = Loader(
+        workers=args.workers, fast_build=args.fast, vacuum=args.vacuum,
+        search_index=not args.no_search, documents=not args.no_documents,
+        similar_romes=args.similar, metrics=metrics, resume=not args.restart,
+        check=args.check)
+    try:
+        loader(args.zip_path, args.db_path)
+    except CheckError as e:
+        for failure in e.failures:
+            print(json.dumps(failure, ensure_ascii=False), file=sys.stderr)
+        exit(1)
@@ -0,0 +1,126 @@
+"""Read-only access to rome databases, from many threads
+
+Each RomePool is a handle on a database file, several may be used
+in the same process (eg. to serve two versions of the referential).
+
+    v330 = RomePool("rome-v330.db")
+    v331 = RomePool("rome-v331.db")
+    v331.get_rome(ogr_id)
+    with v330.use():
+        rome.referentiel(ogr_id)
+"""
+import functools
+import os
+import sqlite3
+import threading
+import urllib.parse
+
+from . import rome
+from . import schema as s
+
+
+# lookups of rome run on the pool by RomePool methods of the same name
+LOOKUPS = [
+    "get_ogr", "get_ogrs", "get_rome", "get_rome_by_code", "get_romes", "referentiel",
+    "children", "subtree", "ancestors", "search", "similar_romes"]
+
+
+class RomePool:
+    """read-only connections to a database file, one per thread
+
+    Connections are opened with mode=ro and query_only, the file being mapped
+    in memory up to mmap_size bytes.
+    With immutable, sqlite does no locking nor change detection at all:
+    the file must not be modified while the pool is open.
+    Each connection keeps up to cached_statements prepared statements,
+    reused by subsequent lookups of its thread.
+    """
+
+    def __init__(self, path, immutable=True, mmap_size=256 * 1024 * 1024,
+                 cached_statements=256, database=s.rome_db):
+        self.path = path
+        self.immutable = immutable
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self.database = database
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        for name in LOOKUPS:
+            setattr(self, name, functools.partial(self.call, getattr(rome, name)))
+
+    def uri(self):
+        uri = "file:%s?mode=ro" % urllib.parse.quote(os.path.abspath(self.path))
+        if self.immutable:
+            uri += "&immutable=1"
+        return uri
+
+    def connect(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(self.path)
+        conn = sqlite3.connect(
+            self.uri(), uri=True, check_same_thread=False,
+            cached_statements=self.cached_statements)
+        # transactions are handled by peewee
+        conn.isolation_level = None
+        self.database._add_conn_hooks(conn)
+        conn.execute("PRAGMA mmap_size = %d" % self.mmap_size)
+        conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    def connection(self):
+        """connection of the current thread
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+            self._local.file_id = s.file_id(self.path)
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def connection_file_id(self):
+        """identity of the file the connection of the current thread was opened on, if open
+        """
+        if getattr(self._local, "conn", None) is None:
+            return None
+        return self._local.file_id
+
+    def reconnect(self):
+        """close the connection of the current thread, the next one opening the file now at path
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            self._connections.remove(conn)
+        conn.close()
+
+    def use(self):
+        """context where queries of this thread run on this pool
+        """
+        return self.database.using(self)
+
+    def call(self, func, *args, **kwargs):
+        """call func with queries running on this pool
+        """
+        with self.use():
+            return func(*args, **kwargs)
+
+    def close(self):
+        """close connections of all threads
+
+        The pool must not be in use anymore.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,180 @@
+"""Rank romes against profiles of competences and activites
+
+    ranking = RomeRanking.load()
+    ranking.rank_romes([competence_ogr, activite_ogr, ...], k=10)
+    ranking.rank_romes_many(profiles, k=10)
+
+A rome scores the weights of the competences and activites
+it shares with the profile, each weighting by its bloc and priorisation.
+"""
+from array import array
+
+from . import schema as s
+
+
+# weight of a competence or activite shared with a rome, by tier:
+# bloc ("base" if the rome gives none, else "specifique") and priorisation
+WEIGHTS = {
+    ("base", 1): 3,
+    ("base", 0): 2,
+    ("specifique", 1): 2,
+    ("specifique", 0): 1}
+
+TIERS = sorted(WEIGHTS)
+
+
+def _popcount(x):
+    return bin(x).count("1")
+
+
+if hasattr(int, "bit_count"):  # python 3.10
+    _popcount = int.bit_count  # noqa: F811
+
+
+def _add(planes, bits, shift):
+    """add bits to the counters sliced in planes, at plane shift (ie. times 2 ** shift)
+
+    Bit i of planes[j] is bit j of the counter of rome i.
+    """
+    while len(planes) < shift:
+        planes.append(0)
+    i = shift
+    while bits:
+        if i == len(planes):
+            planes.append(bits)
+            return
+        planes[i], bits = planes[i] ^ bits, planes[i] & bits
+        i += 1
+
+
+def _top(planes, candidates, k):
+    """bitset of the candidates having the k greatest counters, and those tied with them
+    """
+    sure, maybe = 0, candidates
+    for plane in reversed(planes):
+        x = sure | (maybe & plane)
+        n = _popcount(x)
+        if n > k:
+            maybe &= plane
+        elif n < k:
+            sure = x
+            maybe &= ~plane
+        else:
+            return x
+    return sure | maybe
+
+
+class RomeRanking:
+    """romes having each competence or activite, as bitsets by tier
+
+    Bit i of a bitset stands for the rome ids[i].
+    A profile is scored against all romes at once, adding the bitsets
+    of its codes into counters sliced by bits (one integer by bit of the counters),
+    then selecting the best romes from the most significant plane down.
+    Only the selected romes are looked at one by one.
+    """
+
+    def __init__(self, rows):
+        """rows are (rome, code, bloc, priorisation), code being any ogr
+
+        A code given several times for a rome keeps its best tier.
+        """
+        tiers = {}
+        for rome, code, bloc, priorisation in rows:
+            tier = ("base" if bloc is None else "specifique", 1 if priorisation else 0)
+            key = (rome, code)
+            if key not in tiers or WEIGHTS[tier] > WEIGHTS[tiers[key]]:
+                tiers[key] = tier
+        self.ids = array("l", sorted({rome for rome, code in tiers}))
+        self.index = {rome: i for i, rome in enumerate(self.ids)}
+        # number of codes of each rome, by tier
+        self.tier_counts = [[0] * len(TIERS) for rome in self.ids]
+        by_code = {}
+        for (rome, code), tier in tiers.items():
+            i, t = self.index[rome], TIERS.index(tier)
+            bitsets = by_code.setdefault(code, {})
+            bitsets[t] = bitsets.get(t, 0) | (1 << i)
+            self.tier_counts[i][t] += 1
+        # (tier, bitset of romes) by code
+        self.bitsets = {code: sorted(bitsets.items()) for code, bitsets in by_code.items()}
+        self._totals = {}
+
+    @classmethod
+    def load(cls, competences=True, activites=True):
+        """ranking over the connected database
+        """
+        rows = []
+        if competences:
+            rc = s.RomeCompetence
+            rows.extend(rc.select(rc.rome, rc.competence, rc.bloc, rc.priorisation).tuples())
+        if activites:
+            ra = s.RomeActivite
+            rows.extend(ra.select(ra.rome, ra.activite, ra.bloc, ra.priorisation).tuples())
+        return cls(rows)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _weights(self, weights):
+        """weight of each tier, updating WEIGHTS with weights
+        """
+        result = []
+        for tier in TIERS:
+            weight = (weights or {}).get(tier, WEIGHTS[tier])
+            if weight != int(weight) or weight < 0:
+                raise ValueError("Weight of %s must be a non negative integer" % (tier,))
+            result.append(int(weight))
+        return result
+
+    def _rome_totals(self, weights):
+        """total weight of each rome
+        """
+        key = tuple(weights)
+        if key not in self._totals:
+            self._totals[key] = [
+                sum(c * w for c, w in zip(counts, weights)) for counts in self.tier_counts]
+        return self._totals[key]
+
+    def _rank(self, codes, k, weights):
+        planes = []
+        bitsets = self.bitsets
+        for code in {int(c) for c in codes}:
+            for t, bits in bitsets.get(code, ()):
+                weight, shift = weights[t], 0
+                while weight:
+                    if weight & 1:
+                        _add(planes, bits, shift)
+                    weight >>= 1
+                    shift += 1
+        candidates = 0
+        for plane in planes:
+            candidates |= plane
+        top = _top(planes, candidates, k)
+        totals = self._rome_totals(weights)
+        ranked = []
+        while top:
+            low = top & -top
+            top ^= low
+            i = low.bit_length() - 1
+            score = sum(((plane >> i) & 1) << j for j, plane in enumerate(planes))
+            ranked.append((self.ids[i], score, score / totals[i]))
+        ranked.sort(key=lambda r: (-r[1], -r[2], r[0]))
+        return ranked[:k]
+
+    def rank_romes(self, codes, k=10, weights=None):
+        """k romes best matching a profile, given as ogr codes of competences and activites
+
+        Return (ogr id, score, coverage) best first,
+        score being the total weight of shared codes,
+        and coverage the part of the rome's total weight they make.
+        Ties are broken by coverage.
+        Romes sharing nothing with the profile are never given.
+        weights updates WEIGHTS, giving integer weights by tier.
+        """
+        return self._rank(codes, k, self._weights(weights))
+
+    def rank_romes_many(self, profiles, k=10, weights=None):
+        """batch version of rank_romes, as a list in the order of profiles
+        """
+        weights = self._weights(weights)
+        return [self._rank(codes, k, weights) for codes in profiles]
@@ -1,11 +1,20 @@
 import collections
+import json
+import os
+import re
+import threading
 
 import peewee as pw
 
 from . import schema as s
 from . import contents
+from .contents import _in
+from .metrics import instrumented
+from .similarity import SimilarityIndex
 
 
+@instrumented
+@s.versioned
 def get_ogr(code):
     """Generic method to get the ogr from its code, managing retrieval from right table
     """
@@ -16,19 +25,232 @@ def get_ogr(code):
     return obj
 
 
+def _rome_documents(where):
+    """documents of romes matching where, as a dict by ogr id
+
+    Return None if the database has no documents (built by an older loader).
+    """
+    query = s.RomeDocument.select(s.RomeDocument.rome, s.RomeDocument.document).where(where)
+    try:
+        return {rome_id: json.loads(document) for rome_id, document in query.tuples()}
+    except pw.OperationalError:
+        return None
+
+
+@instrumented
+@s.versioned
 def get_rome(ogr_id):
     """Get a rome as a hierarchie of tuple
+
+    It is read from documents prepared by the loader, when there are.
+    """
+    documents = _rome_documents(s.RomeDocument.rome == ogr_id)
+    if documents:
+        return documents.popitem()[1]
+    romes = contents.light_rome_dicts([ogr_id])
+    if not romes:
+        raise s.Rome.DoesNotExist("No rome with ogr %s" % ogr_id)
+    return romes.popitem()[1]
+
+
+@instrumented
+@s.versioned
+def get_rome_by_code(code_rome):
+    """Same as get_rome, from the rome code (eg. "A1101")
     """
-    obj = s.Rome.get(ogr_id=ogr_id)
-    return contents.rome_to_dict(obj)
+    documents = _rome_documents(s.RomeDocument.code_rome == code_rome)
+    if documents:
+        return documents.popitem()[1]
+    return get_rome(s.Rome.get(code_rome=code_rome).ogr_id)
 
 
-def _tree(node, by_pere):
-    data = contents.to_dict(node)
-    data["children"] = [_tree(n, by_pere) for n in by_pere.get(node.ogr_id, [])]
-    return data
+def _by_key(keys, field, objs):
+    """map requested keys to found objects, indexed by database value of field
+    """
+    return {k: objs[field.db_value(k)] for k in keys if field.db_value(k) in objs}
+
+
+def _prefetched_romes(ogr_ids):
+    """romes with ids, having all their related objects prefetched
+    """
+    query = s.Rome.select(s.Rome, s.Ogr).join(s.Ogr).where(_in(s.Rome.ogr, ogr_ids))
+    return s.Rome.full_prefetch(query)
+
+
+def _rome_chunks(chunk_size):
+    """yield dicts of all romes by order of ogr id, as ordered dicts of at most chunk_size
+    """
+    last = None
+    while True:
+        query = s.Rome.select(s.Rome.ogr)
+        if last is not None:
+            query = query.where(s.Rome.ogr > last)
+        ogr_ids = [i for i, in query.order_by(s.Rome.ogr).limit(chunk_size).tuples()]
+        if not ogr_ids:
+            return
+        yield contents.light_rome_dicts(ogr_ids)
+        last = ogr_ids[-1]
+
+
+def _with_items(nodes):
+    """fetch items of arborescence nodes, all items of a type at once
+    """
+    nodes = list(nodes)
+    by_type = collections.defaultdict(dict)
+    for node in nodes:
+        if node.item_ogr_id:
+            by_type[node.item_ogr.type][node.item_ogr_id] = node.item_ogr
+    for type_, item_ogrs in by_type.items():
+        model = s.ogr_type_model[type_]
+        if model is s.Rome:
+            query = _prefetched_romes(item_ogrs)
+        else:
+            query = model.select().where(_in(model.ogr, item_ogrs))
+        rel_name = contents._ogr_type_to_relation[type_]
+        for obj in query:
+            setattr(item_ogrs[obj.ogr_id], rel_name, obj)
+    return nodes
+
+
+@instrumented
+@s.versioned
+def get_ogrs(codes):
+    """Batch version of get_ogr, return objects as a dict indexed by code
+
+    Unknown codes are missing from the result.
+    Objects are fetched type by type, so that the number of queries
+    does not depend on the number of codes.
+    """
+    codes = list(codes)
+    by_type = collections.defaultdict(list)
+    query = s.Ogr.select(s.Ogr.code, s.Ogr.type).where(_in(s.Ogr.code, codes))
+    for code, type_ in query.tuples():
+        by_type[type_].append(code)
+    objs = {}
+    for type_, type_codes in by_type.items():
+        model = s.ogr_type_model[type_]
+        if model is s.Rome:
+            query = _prefetched_romes(type_codes)
+        elif model is s.Arborescence:
+            query = _with_items(
+                s.Arborescence.select(s.Arborescence, s.Ogr)
+                .join(s.Ogr, pw.JOIN.LEFT_OUTER, on=s.Arborescence.item_ogr)
+                .where(_in(s.Arborescence.ogr, type_codes)))
+        else:
+            query = model.select().where(_in(model.ogr, type_codes))
+        for obj in query:
+            objs[obj.ogr_id] = contents.prefetched_to_dict(obj)
+    return _by_key(codes, s.Ogr.code, objs)
+
+
+@instrumented
+@s.versioned
+def get_romes(ogr_ids):
+    """Batch version of get_rome, return romes as a dict indexed by ogr id
+
+    Unknown ids are missing from the result.
+    """
+    ogr_ids = list(ogr_ids)
+    objs = _rome_documents(_in(s.RomeDocument.rome, ogr_ids)) or {}
+    missing = [i for i in ogr_ids if s.Rome.ogr.db_value(i) not in objs]
+    if missing:
+        objs.update(contents.light_rome_dicts(missing))
+    return _by_key(ogr_ids, s.Rome.ogr, objs)
+
+
+def _nodes_query():
+    """arborescence nodes, along with the ogr of their item
+    """
+    return (
+        s.Arborescence
+        .select(s.Arborescence, s.Ogr)
+        .join(s.Ogr, pw.JOIN.LEFT_OUTER, on=s.Arborescence.item_ogr))
+
 
+@instrumented
+@s.versioned
+def children(node):
+    """Return direct children of an arborescence node, for lazy expansion
 
+    Each child has a nb_descendants count.
+    """
+    nodes = _with_items(
+        _nodes_query()
+        .where(s.Arborescence.pere == node)
+        .order_by(s.Arborescence.ogr))
+    counts = descendant_counts(n.ogr_id for n in nodes)
+    result = []
+    for n in nodes:
+        data = contents.prefetched_to_dict(n)
+        data["nb_descendants"] = counts.get(n.ogr_id, 0)
+        result.append(data)
+    return result
+
+
+@instrumented
+@s.versioned
+def descendant_counts(nodes):
+    """Return number of descendants of arborescence nodes, as a dict by node id
+    """
+    closure = s.ArborescenceClosure
+    query = (
+        closure
+        .select(closure.ancetre, pw.fn.COUNT(closure.descendant) - 1)
+        .where(_in(closure.ancetre, nodes))
+        .group_by(closure.ancetre))
+    return dict(query.tuples())
+
+
+@instrumented
+@s.versioned
+def subtree(node, depth=None):
+    """Return arborescence tree under node (included)
+
+    Only levels down to depth under node are given, if depth is not None.
+    """
+    closure = s.ArborescenceClosure
+    descendants = closure.select(closure.descendant).where(closure.ancetre == node)
+    if depth is not None:
+        descendants = descendants.where(closure.profondeur <= depth)
+    nodes = _with_items(
+        _nodes_query()
+        .where(s.Arborescence.ogr << descendants)
+        .order_by(s.Arborescence.ogr))
+    by_id = collections.OrderedDict()
+    for n in nodes:
+        data = by_id[n.ogr_id] = contents.prefetched_to_dict(n)
+        data["children"] = []
+    root = None
+    for n in nodes:
+        if n.ogr_id == int(node):
+            root = by_id[n.ogr_id]
+        else:
+            by_id[n.pere_id]["children"].append(by_id[n.ogr_id])
+    return root
+
+
+@instrumented
+@s.versioned
+def ancestors(node):
+    """Return ancestors of an arborescence node, from root to its father
+    """
+    closure = s.ArborescenceClosure
+    nodes = _with_items(
+        _nodes_query()
+        .where(s.Arborescence.ogr << (
+            closure.select(closure.ancetre).where(closure.descendant == node))))
+    by_id = {n.ogr_id: n for n in nodes}
+    result = []
+    pere_id = by_id[int(node)].pere_id if by_id else None
+    while pere_id is not None:
+        result.append(contents.prefetched_to_dict(by_id[pere_id]))
+        pere_id = by_id[pere_id].pere_id
+    result.reverse()
+    return result
+
+
+@instrumented
+@s.versioned
 def referentiel(ogr_id):
     """Return a complete referentiel, that is a tree of rome
     """
@@ -40,32 +262,89 @@ def referentiel(ogr_id):
         .where(s.Arborescence.referentiel_id == ogr_id).tuples())
     assert len(types) > 0, "can't retrieve referentiel without object types"
     assert len(types) == 1, "can't retrieve referentiel mixing object types"
-    # FIXME can we add prefetch ?
-    leaf_model = s.ogr_type_model[types[0][0]]
-    # retrieve all nodes
-    item_nodes = (
-        s.Arborescence
-        .select(s.Arborescence, s.Ogr, leaf_model)
-        .join(s.Ogr, on=s.Arborescence.item_ogr)
-        .join(leaf_model, on=leaf_model.ogr)
-        .where(s.Arborescence.referentiel_id == ogr_id))
-    non_item_nodes = (
-        s.Arborescence
-        .select(s.Arborescence)
-        .where((s.Arborescence.referentiel_id == ogr_id) &
-               ((s.Arborescence.item_ogr.is_null(True)) |
-                (s.Arborescence.item_ogr == 0))))
-    # nodes indexed by pere id
-    by_pere = collections.defaultdict(list)
-    for n in item_nodes:
-        by_pere[n.pere_id].append(n)
-    for n in non_item_nodes:
-        by_pere[n.pere_id].append(n)
-    # build tree from root
-    tree = _tree(by_pere[None][0], by_pere)
-    return tree
-
-
-#~ def check_db():
-    #~ # all arborescence of type feuille have an ogr associated
-    #~ s.Arborescence.select().where((s.Arborescence
+    return subtree(ogr_id)
+
+
+# similarity indexes computed by similar_romes, with the state of their database file, by path
+_similarity_indexes = {}
+_similarity_lock = threading.Lock()
+
+
+def _similarity_index():
+    """similarity index of the database in use, computed once for each state of its file
+    """
+    path = s.rome_db.current_path()
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, TypeError):
+        # in memory
+        return SimilarityIndex.load()
+    state = st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size
+    with _similarity_lock:
+        known = _similarity_indexes.get(path)
+    if known is not None and known[0] == state:
+        return known[1]
+    index = SimilarityIndex.load()
+    # not kept if the connection still reads a file replaced since
+    if s.rome_db.connection_file_id() == state[:2]:
+        with _similarity_lock:
+            _similarity_indexes[path] = state, index
+    return index
+
+
+@instrumented
+def similar_romes(ogr_id, k=10):
+    """Return the k romes most similar to a rome, as (ogr id, score), best first
+
+    Similarities stored by the loader are used when there are
+    (giving at most the number stored).
+    Otherwise they are computed from an index of the whole database (see pyrome.similarity),
+    built by the first call and kept until the database file changes.
+    """
+    similaire = s.RomeSimilaire
+    query = (
+        similaire
+        .select(similaire.similaire, similaire.score)
+        .where(similaire.rome == ogr_id)
+        .order_by(similaire.rang)
+        .limit(k))
+    try:
+        stored = list(query.tuples())
+    except pw.OperationalError:
+        stored = None
+    if stored:
+        return stored
+    return _similarity_index().similar_romes(ogr_id, k)
+
+
+_ogr_type_by_name = {v: k for k, v in s.Ogr.TYPE}
+
+
+@instrumented
+def search(text, types=None, limit=20):
+    """Full text search over libelles of romes, appellations, competences,
+    activites and environments
+
+    Case and accents are not significant, last word may be a prefix.
+    types restricts results to some ogr types, given by name (eg. "appellation").
+    Return hits best first, as dicts with ogr, type, libelle,
+    codes_rome (the related romes) and score (bm25, lower is better).
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return []
+    match = " ".join('"%s"' % w for w in words) + "*"
+    sql = "SELECT ogr, type, libelle, codes_rome, rank FROM %s WHERE %s MATCH ?" % (
+        s.SEARCH_TABLE, s.SEARCH_TABLE)
+    params = [match]
+    if types is not None:
+        type_ids = [_ogr_type_by_name.get(t, t) for t in types]
+        sql += " AND type IN (%s)" % ", ".join("?" for t in type_ids)
+        params.extend(type_ids)
+    sql += " ORDER BY rank LIMIT ?"
+    params.append(limit)
+    type_names = dict(s.Ogr.TYPE)
+    return [
+        {"ogr": ogr, "type": type_names[type_], "libelle": libelle,
+         "codes_rome": codes_rome.split(), "score": score}
+        for ogr, type_, libelle, codes_rome, score in s.rome_db.execute_sql(sql, params)]
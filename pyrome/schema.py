@@ -1,7 +1,197 @@
+import contextlib
+import functools
+import os
+import time
+
 import peewee as pw
 
+from . import metrics
+
+
+def file_id(path):
+    """identity of the file at path (device and inode), None if there is none
+    """
+    if not path or path == ":memory:":
+        return None
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+class RomeDatabase(pw.SqliteDatabase):
+    """sqlite database reporting statements to metrics, when recording
+
+    A thread may run its queries on the connections of a pool instead,
+    see using, on a version of a store, see at_version,
+    and on a database file of its own, see bound.
+    """
+
+    # connection state of a thread, kept aside by bound
+    _THREAD_STATE = (
+        "autocommit", "closed", "conn", "context_stack", "transactions",
+        "pool", "version", "path", "file_id")
+
+    def connect(self):
+        path = getattr(self._local, "path", None)
+        if path is None:
+            return super().connect()
+        with self._conn_lock:
+            if not self._local.closed:
+                raise pw.OperationalError("Connection already open")
+            with self.exception_wrapper:
+                self._local.conn = self._connect(path, **self.connect_kwargs)
+            self._local.closed = False
+            with self.exception_wrapper:
+                self.initialize_connection(self._local.conn)
+
+    def close(self):
+        if getattr(self._local, "path", None) is None:
+            return super().close()
+        try:
+            with self.exception_wrapper:
+                self._close(self._local.conn)
+        finally:
+            self._local.closed = True
+
+    @contextlib.contextmanager
+    def bound(self, path):
+        """have queries of this thread run on a connection of their own to the file at path
+
+        The database of other threads, and the connection, pool and version
+        this thread used, are given back on exit:
+        a process serving lookups can build databases (see Loader).
+        """
+        local = self._local
+        previous = {name: getattr(local, name, None) for name in self._THREAD_STATE}
+        local.autocommit, local.closed, local.conn = None, True, None
+        local.context_stack, local.transactions = [], []
+        local.pool = local.version = local.file_id = None
+        local.path = path
+        try:
+            yield self
+        finally:
+            try:
+                if not local.closed:
+                    self.close()
+            finally:
+                for name, value in previous.items():
+                    setattr(local, name, value)
+
+    def get_conn(self):
+        pool = getattr(self._local, "pool", None)
+        if pool is not None:
+            return pool.connection()
+        return super().get_conn()
+
+    def _connect(self, database, **kwargs):
+        conn = super()._connect(database, **kwargs)
+        self._local.file_id = file_id(database)
+        return conn
+
+    def current_path(self):
+        """path of the database file queries of this thread run on
+        """
+        pool = getattr(self._local, "pool", None)
+        if pool is not None:
+            return pool.path
+        return getattr(self._local, "path", None) or self.database
+
+    def connection_file_id(self):
+        """identity of the file the connection of this thread was opened on, if open
+        """
+        pool = getattr(self._local, "pool", None)
+        if pool is not None:
+            return pool.connection_file_id()
+        if self.is_closed():
+            return None
+        return getattr(self._local, "file_id", None)
+
+    def reconnect(self):
+        """reopen the connection of this thread, on the file now at its path
+
+        Once a file is replaced (see Loader.install),
+        connections opened before keep reading the previous one.
+        """
+        pool = getattr(self._local, "pool", None)
+        if pool is not None:
+            pool.reconnect()
+            return
+        if not self.is_closed():
+            self.close()
+        self.connect()
+
+    @contextlib.contextmanager
+    def using(self, pool):
+        """have queries of this thread use connections of pool (see pyrome.pool)
+        """
+        previous = getattr(self._local, "pool", None)
+        self._local.pool = pool
+        try:
+            yield pool
+        finally:
+            self._local.pool = previous
+
+    def _add_conn_hooks(self, conn):
+        super()._add_conn_hooks(conn)
+        # tables of a store filter their rows with it, see pyrome.store
+        conn.create_function("store_version", 0, self.current_version)
+
+    def current_version(self):
+        """version of a store used by the queries of this thread, None for the last one
+        """
+        return getattr(self._local, "version", None)
 
-rome_db = pw.SqliteDatabase(None)
+    def check_version(self, version):
+        """raise KeyError if the database is not a store having version
+        """
+        try:
+            found = self.execute_sql(
+                "SELECT 1 FROM %s WHERE name = ?" % STORE_VERSION_TABLE, (version,)).fetchone()
+        except pw.OperationalError:
+            found = None
+        if found is None:
+            raise KeyError("No version %s in store" % version)
+
+    @contextlib.contextmanager
+    def at_version(self, version):
+        """have queries of this thread use version of a store (None for the last one)
+
+        Raise KeyError if the store has no such version.
+        """
+        if version is not None:
+            self.check_version(version)
+        previous = getattr(self._local, "version", None)
+        self._local.version = version
+        try:
+            yield version
+        finally:
+            self._local.version = previous
+
+    def execute_sql(self, sql, params=None, require_commit=True):
+        if not metrics.is_recording():
+            return super().execute_sql(sql, params, require_commit)
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, params, require_commit)
+        finally:
+            metrics.record_query(sql, params, time.perf_counter() - start)
+
+
+rome_db = RomeDatabase(None)
+
+
+def versioned(func):
+    """give func a version argument, running its queries on this version of a store
+    """
+    @functools.wraps(func)
+    def wrapper(*args, version=None, **kwargs):
+        if version is None:
+            return func(*args, **kwargs)
+        with rome_db.at_version(version):
+            return func(*args, **kwargs)
+    return wrapper
 
 
 class BaseModel(pw.Model):
@@ -62,13 +252,17 @@ class Rome(BaseModel):
     @staticmethod
     def full_prefetch(query):
         """full prefetch of corelated tables
+
+        Related objects are prefetched with their ogr rather than joined,
+        as peewee would then load their ogr, one query per row.
         """
         return pw.prefetch(
             query,
-            RomeAppellation.select(RomeAppellation, Appellation).join(Appellation),
-            RomeEnvTravail.select(RomeEnvTravail, EnvTravail).join(EnvTravail),
-            RomeActivite.select(RomeActivite, Activite).join(Activite),
-            RomeCompetence.select(RomeCompetence, Competence).join(Competence))
+            RomeAppellation, Appellation.select(Appellation, Ogr).join(Ogr),
+            RomeEnvTravail, EnvTravail.select(EnvTravail, Ogr).join(Ogr),
+            RomeActivite, Activite.select(Activite, Ogr).join(Ogr),
+            RomeCompetence, Competence.select(Competence, Ogr).join(Ogr),
+            Fiche)
 
 
 class RomeAppellation(BaseModel):
@@ -87,8 +281,8 @@ class RomeEnvTravail(BaseModel):
 class RomeActivite(BaseModel):
     rome = pw.ForeignKeyField(Rome, related_name="rome_activite")
     activite = pw.ForeignKeyField(Activite, related_name="activite_rome")
-    position = pw.IntegerField(),
-    priorisation = pw.IntegerField(),
+    position = pw.IntegerField()
+    priorisation = pw.IntegerField()
     bloc = pw.IntegerField(null=True)
 
 
@@ -112,10 +306,11 @@ class Mobilite(BaseModel):
 class Fiche(BaseModel):
     numero = pw.IntegerField(null=True)
     rome = pw.ForeignKeyField(Rome, related_name="fiche")
-    definition = pw.CharField(),
-    formations_associees = pw.CharField(),
-    condition_exercice_activite = pw.CharField(),
-    classement_emploi_metier = pw.CharField()
+    # elements of a card may be missing or empty, see Loader.iter_card
+    definition = pw.CharField(null=True)
+    formations_associees = pw.CharField(null=True)
+    condition_exercice_activite = pw.CharField(null=True)
+    classement_emploi_metier = pw.CharField(null=True)
 
 
 class Referentiel(BaseModel):
@@ -138,18 +333,94 @@ class Arborescence(BaseModel):
     libelle = pw.CharField()
 
 
+class ArborescenceClosure(BaseModel):
+    """Transitive closure of Arborescence.pere
+
+    There is a row for each node and each of its ancestors,
+    including the node itself at profondeur 0.
+    """
+    ancetre = pw.ForeignKeyField(Arborescence, related_name="descendants")
+    descendant = pw.ForeignKeyField(Arborescence, related_name="ancetres")
+    profondeur = pw.IntegerField()
+
+    class Meta:
+        primary_key = pw.CompositeKey("ancetre", "descendant")
+
+
+class RomeDocument(BaseModel):
+    """Romes as returned by rome_to_dict, serialized as json
+
+    Filled by the loader, see Loader.build_documents.
+    """
+    rome = pw.ForeignKeyField(Rome, primary_key=True, related_name="document")
+    code_rome = pw.CharField(unique=True)
+    document = pw.TextField()
+
+
+class RomeSimilaire(BaseModel):
+    """Most similar romes of each rome, by rang (best first)
+
+    Filled by the loader, see pyrome.similarity.
+    """
+    rome = pw.ForeignKeyField(Rome, related_name="similaires")
+    similaire = pw.ForeignKeyField(Rome, related_name="similaire_de")
+    rang = pw.IntegerField()
+    score = pw.FloatField()
+
+    class Meta:
+        primary_key = pw.CompositeKey("rome", "rang")
+
+
+class BuildCheckpoint(BaseModel):
+    """Phases done by a build in progress, dropped once it is complete
+
+    source identifies the zip and options of the build, see Loader.__call__.
+    """
+    phase = pw.CharField(primary_key=True)
+    source = pw.CharField()
+
+
+# full text index over libelles, a sqlite FTS5 virtual table filled by the loader
+SEARCH_TABLE = "recherche"
+
+# versions of a store, see pyrome.store
+STORE_VERSION_TABLE = "store_version"
+
+
 class RomeDB:
     """a context manager to configure and connect database
+
+    With bulk_load, the connection is tuned for a fast build:
+    no journal, no sync to disk and a large cache.
+    A crash during such a build leaves an unusable file.
+    With bound, only the current thread uses the database,
+    on a connection of its own (see RomeDatabase.bound), rome_db being left as it was.
     """
 
-    def __init__(self, *args):
-        rome_db.init(*args)
+    BULK_LOAD_PRAGMAS = (
+        ("journal_mode", "OFF"),
+        ("synchronous", "OFF"),
+        ("cache_size", -512000),  # in KiB
+        ("temp_store", "MEMORY"))
+
+    def __init__(self, *args, bulk_load=False, bound=False):
+        self.bulk_load = bulk_load
+        self._bound = rome_db.bound(*args) if bound else None
+        if not bound:
+            rome_db.init(*args)
 
     def __enter__(self):
+        if self._bound is not None:
+            self._bound.__enter__()
         rome_db.connect()
+        if self.bulk_load:
+            for pragma in self.BULK_LOAD_PRAGMAS:
+                rome_db.execute_sql("PRAGMA %s = %s" % pragma)
         return rome_db
 
     def __exit__(self, *args, **kwargs):
+        if self._bound is not None:
+            return self._bound.__exit__(*args)
         rome_db.close()
 
 
@@ -0,0 +1,149 @@
+"""Similarity of romes, from the competences and activites they share
+
+    index = SimilarityIndex.load(priorisation_weight=1)
+    index.similar_romes(rome_id, k=10)
+    index.top_k(10, metric="jaccard")
+
+Each rome is a sparse vector over competences and activites,
+weighted by priorisation if asked.
+Romes are compared with cosine or (weighted) Jaccard similarity,
+scores being accumulated over the romes sharing each feature,
+so that only pairs having something in common are ever looked at.
+"""
+import heapq
+import math
+from array import array
+
+from . import schema as s
+
+
+METRICS = ["cosine", "jaccard"]
+
+# kinds of features, offsetting their ids so that they do not collide
+_COMPETENCE, _ACTIVITE = 0, 1
+
+
+class SimilarityIndex:
+    """incidence of romes and features, as sparse rows and columns
+
+    Features of the rome at index i are those from offsets[i] to offsets[i + 1]
+    in features (index of feature) and weights.
+    Romes having the feature at index f are likewise those from
+    feature_offsets[f] to feature_offsets[f + 1] in postings (index of rome)
+    and posting_weights.
+    """
+
+    def __init__(self, rows):
+        """rows are (rome, feature, weight), feature being any hashable
+
+        A feature given several times for a rome keeps its greatest weight.
+        """
+        vectors = {}
+        for rome, feature, weight in rows:
+            vector = vectors.setdefault(rome, {})
+            vector[feature] = max(weight, vector.get(feature, weight))
+        self.ids = array("l", sorted(vectors))
+        self.index = {rome: i for i, rome in enumerate(self.ids)}
+        feature_index = {}
+        self.offsets = array("l", [0])
+        self.features = array("l")
+        self.weights = array("d")
+        self.norms = array("d")
+        self.sums = array("d")
+        by_feature = []
+        for i, rome in enumerate(self.ids):
+            for feature, weight in sorted(vectors[rome].items()):
+                f = feature_index.setdefault(feature, len(feature_index))
+                if f == len(by_feature):
+                    by_feature.append([])
+                by_feature[f].append((i, weight))
+                self.features.append(f)
+                self.weights.append(weight)
+            self.offsets.append(len(self.features))
+            weights = vectors[rome].values()
+            self.norms.append(math.sqrt(sum(w * w for w in weights)))
+            self.sums.append(sum(weights))
+        self.feature_offsets = array("l", [0])
+        self.postings = array("l")
+        self.posting_weights = array("d")
+        for postings in by_feature:
+            for i, weight in postings:
+                self.postings.append(i)
+                self.posting_weights.append(weight)
+            self.feature_offsets.append(len(self.postings))
+
+    @classmethod
+    def load(cls, priorisation_weight=None, competences=True, activites=True):
+        """index of the connected database
+
+        Features weight 1, or 1 + priorisation_weight * priorisation
+        if priorisation_weight is given.
+        """
+        rows = []
+        for enabled, model, field, kind in (
+                (competences, s.RomeCompetence, s.RomeCompetence.competence, _COMPETENCE),
+                (activites, s.RomeActivite, s.RomeActivite.activite, _ACTIVITE)):
+            if not enabled:
+                continue
+            for rome, code, priorisation in model.select(
+                    model.rome, field, model.priorisation).tuples():
+                weight = 1
+                if priorisation_weight is not None:
+                    weight += priorisation_weight * (priorisation or 0)
+                rows.append((rome, (kind, code), weight))
+        return cls(rows)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _scores(self, i, metric):
+        """similarity of rome at index i with each rome sharing a feature with it
+        """
+        offsets, features, weights = self.offsets, self.features, self.weights
+        feature_offsets, postings, posting_weights = (
+            self.feature_offsets, self.postings, self.posting_weights)
+        acc = {}
+        if metric == "cosine":
+            for e in range(offsets[i], offsets[i + 1]):
+                f, w = features[e], weights[e]
+                for p in range(feature_offsets[f], feature_offsets[f + 1]):
+                    j = postings[p]
+                    acc[j] = acc.get(j, 0) + w * posting_weights[p]
+            norms = self.norms
+            norm = norms[i]
+            return {j: dot / (norm * norms[j]) for j, dot in acc.items() if j != i}
+        elif metric == "jaccard":
+            for e in range(offsets[i], offsets[i + 1]):
+                f, w = features[e], weights[e]
+                for p in range(feature_offsets[f], feature_offsets[f + 1]):
+                    j = postings[p]
+                    acc[j] = acc.get(j, 0) + min(w, posting_weights[p])
+            sums = self.sums
+            total = sums[i]
+            # sum of max is sum of both minus sum of min
+            return {
+                j: inter / (total + sums[j] - inter) for j, inter in acc.items() if j != i}
+        raise ValueError("Unknown metric %r, use one of %s" % (metric, ", ".join(METRICS)))
+
+    def similar_romes(self, rome, k=10, metric="cosine"):
+        """k romes most similar to rome, as (ogr id, score) best first
+
+        Romes sharing nothing with rome are never given.
+        """
+        i = self.index.get(int(rome))
+        if i is None:
+            return []
+        ids = self.ids
+        best = heapq.nlargest(
+            k, self._scores(i, metric).items(), key=lambda item: (item[1], -item[0]))
+        return [(ids[j], score) for j, score in best]
+
+    def similar_romes_many(self, romes, k=10, metric="cosine"):
+        """batch version of similar_romes, as a dict by rome
+        """
+        return {rome: self.similar_romes(rome, k, metric) for rome in romes}
+
+    def top_k(self, k=10, metric="cosine"):
+        """similar_romes for all romes
+        """
+        return self.similar_romes_many(self.ids, k, metric)
@@ -0,0 +1,151 @@
+"""Targets of the rows produced by the loader
+
+    sink = FanOutSink(ColumnarSink(), NdjsonSink(f))
+    Loader(sink=sink).feed("rome.zip")
+
+A sink receives rows model by model, in the order of the loader:
+ogr and entities, then fiche relations, then arborescence.
+Rows are tuples of database values, in the order of the fields given along.
+"""
+import collections
+import csv
+import json
+import os
+
+from . import schema as s
+
+
+def insert_sql(model, fields):
+    """sql inserting a row of fields in the table of model
+    """
+    quote = model._meta.database.compiler().quote
+    return "INSERT INTO %s (%s) VALUES (%s)" % (
+        quote(model._meta.db_table),
+        ", ".join(quote(f.db_column) for f in fields),
+        ", ".join("?" for f in fields))
+
+
+class Sink:
+    """base of sinks, which do nothing
+    """
+
+    def write(self, model, fields, rows):
+        """receive a batch of rows of model
+        """
+
+    def close(self):
+        """called once all rows are written
+        """
+
+
+class SqliteSink(Sink):
+    """insert rows in the database (rome_db by default), as the loader always did
+
+    With create_tables, missing tables are created (without indexes)
+    when their first rows come.
+    """
+
+    def __init__(self, database=None, create_tables=True):
+        self.database = database or s.rome_db
+        self.create_tables = create_tables
+        self._statements = {}
+
+    def write(self, model, fields, rows):
+        try:
+            sql = self._statements[model]
+        except KeyError:
+            if self.create_tables:
+                self.database.create_table(model, safe=True)
+            sql = self._statements[model] = insert_sql(model, fields)
+        self.database.get_cursor().executemany(sql, rows)
+
+
+class ColumnarSink(Sink):
+    """keep rows in memory, as a list of values by field name, by table name
+    """
+
+    def __init__(self):
+        self.tables = collections.OrderedDict()
+
+    def write(self, model, fields, rows):
+        table = self.tables.get(model._meta.db_table)
+        if table is None:
+            table = self.tables[model._meta.db_table] = collections.OrderedDict(
+                (f.name, []) for f in fields)
+        for column, values in zip(table.values(), zip(*rows)):
+            column.extend(values)
+
+    def table(self, model):
+        """columns of the table of model, empty if it got no rows
+        """
+        return self.tables.get(model._meta.db_table, {})
+
+
+class NdjsonSink(Sink):
+    """write rows to a text file, as lines of {"type": table name, "data": row as a dict}
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, model, fields, rows):
+        table = model._meta.db_table
+        names = [f.name for f in fields]
+        for row in rows:
+            self.f.write(json.dumps(
+                {"type": table, "data": dict(zip(names, row))},
+                ensure_ascii=False, separators=(",", ":")))
+            self.f.write("\n")
+
+
+class CsvSink(Sink):
+    """write rows to a csv file by table, in directory, with field names as header
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}
+        self._writers = {}
+
+    def write(self, model, fields, rows):
+        writer = self._writers.get(model)
+        if writer is None:
+            csv_file = self._files[model] = open(
+                os.path.join(self.directory, "%s.csv" % model._meta.db_table),
+                "w", encoding="utf-8", newline="")
+            writer = self._writers[model] = csv.writer(csv_file)
+            writer.writerow([f.name for f in fields])
+        writer.writerows(rows)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+        self._writers.clear()
+
+
+class CountingSink(Sink):
+    """count rows by table name
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def write(self, model, fields, rows):
+        self.counts[model._meta.db_table] += len(rows)
+
+
+class FanOutSink(Sink):
+    """write rows to each of sinks
+    """
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def write(self, model, fields, rows):
+        for sink in self.sinks:
+            sink.write(model, fields, rows)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,325 @@
+"""Binary snapshots of the referential, read through mmap
+
+    python -m pyrome.snapshot rome.db rome.snapshot
+
+    snapshot = Snapshot("rome.snapshot")
+    snapshot.get_rome(ogr_id)
+
+A snapshot holds every table as fixed width integer columns,
+strings being ids in a table of utf-8 strings.
+Rows are sorted by key, so that lookups are binary searches.
+Readers map the file in memory and decode only what a lookup returns:
+opening a snapshot is immediate, and processes reading the same file
+share a single copy of it, in the page cache.
+
+Lookups give the same results as those of pyrome.rome.
+Reading snapshots does not need peewee nor sqlite.
+"""
+import bisect
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+
+MAGIC = b"PYROMESN"
+FORMAT_VERSION = 1
+
+# value of missing integers
+NULL = -2 ** 63
+
+# header is MAGIC, then its length and json content
+_header_length = struct.Struct("<Q")
+
+
+def _align(f):
+    """pad file to a multiple of 8 bytes
+    """
+    f.write(b"\0" * (-f.tell() % 8))
+
+
+class _Strings:
+    """table of distinct strings, by id
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.offsets = array("q", [0])
+        self.data = bytearray()
+
+    def add(self, value):
+        if value is None:
+            return NULL
+        try:
+            return self.ids[value]
+        except KeyError:
+            pass
+        self.data.extend(value.encode("utf-8"))
+        self.offsets.append(len(self.data))
+        i = self.ids[value] = len(self.ids)
+        return i
+
+
+def _table_spec(model, order_by):
+    """name, columns (name, db column, kind) and order of the table of model
+    """
+    import peewee as pw  # here, so that reading snapshots does not import peewee
+
+    columns = []
+    for f in model._meta.declared_fields:
+        if isinstance(f, (pw.CharField, pw.TextField)):
+            kind = "s"
+        elif isinstance(f, (pw.IntegerField, pw.ForeignKeyField, pw.PrimaryKeyField)):
+            kind = "i"
+        else:
+            raise ValueError("Can't store %s.%s in a snapshot" % (model.__name__, f.name))
+        columns.append((f.name, f.db_column, kind))
+    return model._meta.db_table, columns, [getattr(model, name).db_column for name in order_by]
+
+
+def write_snapshot(path, database=None):
+    """write a snapshot of the connected database (or database) to path
+    """
+    from . import contents
+    from . import schema as s
+
+    database = database or s.rome_db
+    quote = database.compiler().quote
+    entity_models = [s.ogr_type_model[t] for t in sorted(s.ogr_type_model)]
+    specs = [_table_spec(s.Ogr, ["code"])]
+    specs += [_table_spec(m, ["ogr"]) for m in entity_models if m is not s.Arborescence]
+    specs += [_table_spec(s.Fiche, ["rome", "id"])]
+    specs += [_table_spec(model, ["rome", "id"]) for key, model, rel in contents._rome_relations]
+    specs += [
+        _table_spec(s.Mobilite, ["origine_rome", "id"]),
+        _table_spec(s.Referentiel, ["ogr"]),
+        _table_spec(s.Arborescence, ["ogr"])]
+
+    strings = _Strings()
+    tables = {}
+    columns_data = {}
+    for table, columns, order_by in specs:
+        sql = "SELECT %s FROM %s ORDER BY %s" % (
+            ", ".join(quote(c) for n, c, k in columns), quote(table),
+            ", ".join(quote(c) for c in order_by))
+        data = [array("q") for c in columns]
+        for row in database.execute_sql(sql):
+            for value, (name, column, kind), col in zip(row, columns, data):
+                if kind == "s":
+                    col.append(strings.add(value))
+                else:
+                    col.append(NULL if value is None else value)
+        tables[table] = {"columns": [[n, k] for n, c, k in columns], "rows": len(data[0])}
+        columns_data[table] = data
+
+    # children of arborescence nodes: rows of arborescence, by father then ogr
+    arbo = s.Arborescence._meta.db_table
+    names = [n for n, k in tables[arbo]["columns"]]
+    ogr, pere = columns_data[arbo][names.index("ogr")], columns_data[arbo][names.index("pere")]
+    order = sorted(range(len(ogr)), key=lambda i: (pere[i], ogr[i]))
+    tables["arborescence_fils"] = {"columns": [["pere", "i"], ["row", "i"]], "rows": len(order)}
+    columns_data["arborescence_fils"] = [
+        array("q", [pere[i] for i in order]), array("q", order)]
+
+    # number of item types in each referentiel, that referentiel checks
+    referentiel_types = {}
+    type_of = dict(database.execute_sql("SELECT %s, %s FROM %s" % (
+        quote(s.Ogr.code.db_column), quote(s.Ogr.type.db_column),
+        quote(s.Ogr._meta.db_table))))
+    referentiel = columns_data[arbo][names.index("referentiel")]
+    item_ogr = columns_data[arbo][names.index("item_ogr")]
+    for ref, item in zip(referentiel, item_ogr):
+        types = referentiel_types.setdefault(ref, set())
+        if item != NULL:
+            types.add(type_of[item])
+
+    header = {
+        "version": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "types": {t: [m._meta.db_table, name] for t, name in s.Ogr.TYPE
+                  for m in [s.ogr_type_model[t]]},
+        "relations": [
+            [key, model._meta.db_table, rel._meta.db_table]
+            for key, model, rel in contents._rome_relations],
+        "referentiel_types": {ref: len(types) for ref, types in referentiel_types.items()},
+        "tables": tables,
+    }
+    with open(path, "wb") as f:
+        header_data = json.dumps(header).encode("utf-8")
+        f.write(MAGIC)
+        f.write(_header_length.pack(len(header_data)))
+        f.write(header_data)
+        _align(f)
+        # columns follow, by sorted table names, then strings and their position
+        # (columns being 8 bytes, all stay aligned)
+        for table in sorted(columns_data):
+            for col in columns_data[table]:
+                col.tofile(f)
+        offsets_position = f.tell()
+        strings.offsets.tofile(f)
+        f.write(strings.data)
+        _align(f)
+        f.write(struct.pack("<qq", offsets_position, len(strings.offsets)))
+
+
+class Snapshot:
+    """read-only access to a snapshot, through mmap
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = self._buffer = memoryview(self._mmap)
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a pyrome snapshot" % path)
+        position = len(MAGIC)
+        length, = _header_length.unpack_from(buffer, position)
+        position += _header_length.size
+        header = json.loads(bytes(buffer[position:position + length]).decode("utf-8"))
+        position += length
+        position += -position % 8
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError("Unsupported snapshot version %s" % header["version"])
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError("Snapshot was written on a %s endian machine" % header["byteorder"])
+        self.types = {int(t): tuple(v) for t, v in header["types"].items()}
+        self.relations = header["relations"]
+        self.referentiel_types = {int(k): v for k, v in header["referentiel_types"].items()}
+        self.tables = {}
+        for table in sorted(header["tables"]):
+            spec = header["tables"][table]
+            rows = spec["rows"]
+            columns = {}
+            for name, kind in spec["columns"]:
+                columns[name] = buffer[position:position + 8 * rows].cast("q")
+                position += 8 * rows
+            self.tables[table] = (spec["columns"], columns)
+        strings_position, n_offsets = struct.unpack_from("<qq", buffer, len(buffer) - 16)
+        self._string_offsets = buffer[strings_position:strings_position + 8 * n_offsets].cast("q")
+        self._strings = buffer[strings_position + 8 * n_offsets:]
+
+    def close(self):
+        self._string_offsets.release()
+        self._strings.release()
+        for columns_spec, columns in self.tables.values():
+            for col in columns.values():
+                col.release()
+        self._buffer.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _string(self, i):
+        if i == NULL:
+            return None
+        return str(self._strings[self._string_offsets[i]:self._string_offsets[i + 1]], "utf-8")
+
+    def _find(self, table, key, column=None):
+        """range of rows of table whose first (or given) column is key
+        """
+        columns_spec, columns = self.tables[table]
+        col = columns[column or columns_spec[0][0]]
+        start = bisect.bisect_left(col, key)
+        return start, bisect.bisect_right(col, key, start)
+
+    def _record(self, table, row):
+        columns_spec, columns = self.tables[table]
+        record = {}
+        for name, kind in columns_spec:
+            value = columns[name][row]
+            if kind == "s":
+                value = self._string(value)
+            elif value == NULL:
+                value = None
+            record[name] = value
+        return record
+
+    def _get(self, table, key):
+        start, end = self._find(table, key)
+        if start == end:
+            raise KeyError("%s not found in %s" % (key, table))
+        return self._record(table, start)
+
+    def get_ogr(self, code):
+        """same as rome.get_ogr
+        """
+        ogr = self._get("ogr", int(code))
+        table, name = self.types[ogr["type"]]
+        if name == "rome":
+            return self.get_rome(code)
+        if name == "arborescence":
+            return self._node_dict(self._find(table, int(code))[0])
+        return self._get(table, int(code))
+
+    def get_rome(self, ogr_id):
+        """same as rome.get_rome
+        """
+        ogr_id = int(ogr_id)
+        data = self._get("rome", ogr_id)
+        start, end = self._find("fiche", ogr_id, "rome")
+        if start < end:
+            data.update(self._record("fiche", start))
+        for key, table, rel_table in self.relations:
+            items = data[key] = []
+            start, end = self._find(table, ogr_id, "rome")
+            for row in range(start, end):
+                item = self._record(table, row)
+                item.update(self._get(rel_table, item[key]))
+                items.append(item)
+        return data
+
+    def _node_dict(self, row):
+        """node of arborescence row, with its item, as contents.arborescence_to_dict gives it
+        """
+        record = self._record("arborescence", row)
+        data = {k: record[k] for k in ("ogr", "code_noeud", "libelle")}
+        if record["item_ogr"] is not None:
+            item_type = self._get("ogr", record["item_ogr"])["type"]
+            data[self.types[item_type][1]] = self.get_ogr(record["item_ogr"])
+        return data
+
+    def _node(self, row, depth):
+        record = self._record("arborescence", row)
+        data = self._node_dict(row)
+        data["children"] = []
+        if depth is None or depth > 0:
+            start, end = self._find("arborescence_fils", record["ogr"], "pere")
+            rows = self.tables["arborescence_fils"][1]["row"]
+            for i in range(start, end):
+                data["children"].append(
+                    self._node(rows[i], None if depth is None else depth - 1))
+        return data
+
+    def subtree(self, node, depth=None):
+        """same as rome.subtree
+        """
+        start, end = self._find("arborescence", int(node))
+        if start == end:
+            return None
+        return self._node(start, depth)
+
+    def referentiel(self, ogr_id):
+        """same as rome.referentiel
+        """
+        types = self.referentiel_types.get(int(ogr_id), 0)
+        assert types > 0, "can't retrieve referentiel without object types"
+        assert types == 1, "can't retrieve referentiel mixing object types"
+        return self.subtree(ogr_id)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from . import schema as s
+
+    parser = argparse.ArgumentParser(description='Write a snapshot of a ROME database')
+    parser.add_argument("db_path", help='Path of database')
+    parser.add_argument("snapshot_path", help='Path of snapshot to write')
+    args = parser.parse_args()
+    with s.RomeDB(args.db_path):
+        write_snapshot(args.snapshot_path)
@@ -0,0 +1,310 @@
+"""Several releases of the referential in a single database
+
+    python -m pyrome.store store.db rome-v330.zip rome-v331.zip
+
+    with RomeDB("store.db"):
+        rome.get_rome(ogr_id, version="v330")
+        with rome_db.at_version("v330"):
+            rome.referentiel(ogr_id)
+
+Rows of each table are kept in a store table, once for all the versions having them,
+with a bit mask of these versions.
+Tables of the schema are views over the store tables,
+giving the rows of the version used by the current thread (see RomeDatabase.at_version),
+the last version added by default.
+Rows of relations (having an automatic id) get keys of their own in the store,
+shared by all versions, each version keeping the ids its release gave them
+in an ids table: views give these ids, so that rows come in the same order
+as in a database built from the release.
+"""
+import collections
+import json
+
+import peewee as pw
+
+from . import rome
+from . import schema as s
+
+
+# versions have a bit in masks of rows, an sqlite integer
+MAX_VERSIONS = 63
+
+VERSION_TABLE = s.STORE_VERSION_TABLE
+
+# bit of the version used by the current thread
+CURRENT_VERSION_VIEW = "store_current_version"
+
+# tables kept by a store, others (search index, similar romes) are not
+STORE_MODELS = [
+    s.Ogr, s.EnvTravail, s.Competence, s.Appellation, s.Activite, s.Rome,
+    s.RomeAppellation, s.RomeEnvTravail, s.RomeActivite, s.RomeCompetence, s.Mobilite,
+    s.Fiche, s.Referentiel, s.Arborescence, s.ArborescenceClosure, s.RomeDocument]
+
+# number of romes serialized at once, see VersionStore.build_documents
+DOCUMENTS_CHUNK_SIZE = 100
+
+
+def store_table(model):
+    return "%s_store" % model._meta.db_table
+
+
+def ids_table(model):
+    """table of the ids of rows of model (with an automatic id) in each version
+    """
+    return "%s_store_id" % model._meta.db_table
+
+
+def _auto_id(model):
+    """whether model has an automatic id, that the loader does not fill
+    """
+    return model._meta.primary_key.name == "id"
+
+
+def _key(model):
+    """column identifying rows of the store table of model
+    """
+    return model._meta.primary_key.db_column if _auto_id(model) else "rowid"
+
+
+def _content_fields(model):
+    """fields compared to find identical rows, all but automatic ids
+    """
+    return [f for f in model._meta.sorted_fields if not (_auto_id(model) and f.primary_key)]
+
+
+def _indexed_columns(model):
+    """columns of lookups, indexed in the store table
+    """
+    columns = []
+    for f in _content_fields(model):
+        if f.primary_key or f.index or f.unique or isinstance(f, pw.ForeignKeyField):
+            columns.append(f.db_column)
+    if isinstance(model._meta.primary_key, pw.CompositeKey):
+        columns.extend(
+            model._meta.fields[name].db_column for name in model._meta.primary_key.field_names
+            if model._meta.fields[name].db_column not in columns)
+    return columns
+
+
+class VersionStore:
+    """versions of the referential in the connected database (or database)
+    """
+
+    def __init__(self, database=None):
+        self.database = database or s.rome_db
+        self.quote = self.database.compiler().quote
+
+    def execute(self, sql, params=None):
+        return self.database.execute_sql(sql, params)
+
+    def exists(self):
+        return VERSION_TABLE in self.database.get_tables()
+
+    def create(self):
+        """create store tables and views, if not done yet
+        """
+        if self.exists():
+            return
+        quote = self.quote
+        with self.database.atomic():
+            self.execute(
+                "CREATE TABLE %s (name TEXT PRIMARY KEY, bit INTEGER NOT NULL UNIQUE)" % (
+                    VERSION_TABLE))
+            # the version given by store_version(), or the last one added
+            self.execute(
+                """CREATE VIEW {view} AS SELECT bit FROM {versions}
+                WHERE name = store_version() OR (
+                    store_version() IS NULL
+                    AND rowid = (SELECT MAX(rowid) FROM {versions}))""".format(
+                    view=CURRENT_VERSION_VIEW, versions=VERSION_TABLE))
+            for model in STORE_MODELS:
+                table = store_table(model)
+                columns = [
+                    "%s %s" % (quote(f.db_column), f.get_column_type())
+                    for f in _content_fields(model)]
+                if _auto_id(model):
+                    columns.insert(0, "%s INTEGER PRIMARY KEY" % quote(_key(model)))
+                self.execute("CREATE TABLE %s (%s, versions INTEGER NOT NULL)" % (
+                    quote(table), ", ".join(columns)))
+                for column in _indexed_columns(model):
+                    self.execute("CREATE INDEX %s ON %s (%s)" % (
+                        quote("%s_%s" % (table, column)), quote(table), quote(column)))
+                if not _auto_id(model):
+                    self.execute(
+                        """CREATE VIEW {view} AS SELECT {columns} FROM {table}
+                        WHERE (versions >> (SELECT bit FROM {current})) & 1""".format(
+                            view=quote(model._meta.db_table),
+                            columns=", ".join(
+                                quote(f.db_column) for f in model._meta.sorted_fields),
+                            table=quote(table),
+                            current=CURRENT_VERSION_VIEW))
+                    continue
+                ids = quote(ids_table(model))
+                self.execute(
+                    "CREATE TABLE %s (bit INTEGER NOT NULL, id INTEGER NOT NULL, "
+                    "row INTEGER NOT NULL, PRIMARY KEY (bit, id))" % ids)
+                self.execute("CREATE UNIQUE INDEX %s ON %s (row, bit)" % (
+                    quote("%s_row" % ids_table(model)), ids))
+                self.execute(
+                    """CREATE VIEW {view} AS SELECT i.id AS {key}, {columns}
+                    FROM {table} AS t JOIN {ids} AS i ON i.row = t.{key}
+                    WHERE i.bit = (SELECT bit FROM {current})""".format(
+                        view=quote(model._meta.db_table),
+                        key=quote(_key(model)),
+                        columns=", ".join(
+                            "t.%s" % quote(f.db_column) for f in _content_fields(model)),
+                        table=quote(table),
+                        ids=ids,
+                        current=CURRENT_VERSION_VIEW))
+
+    def versions(self):
+        """names of versions, in the order they were added
+        """
+        if not self.exists():
+            return []
+        return [name for name, in self.execute(
+            "SELECT name FROM %s ORDER BY rowid" % VERSION_TABLE)]
+
+    def _bit(self, version):
+        row = self.execute(
+            "SELECT bit FROM %s WHERE name = ?" % VERSION_TABLE, (version,)).fetchone()
+        if row is None:
+            raise KeyError("No version %s in store" % version)
+        return row[0]
+
+    def remove(self, version):
+        """remove a version, and rows only it had
+        """
+        bit = self._bit(version)
+        mask = 1 << bit
+        quote = self.quote
+        with self.database.atomic():
+            for model in STORE_MODELS:
+                if _auto_id(model):
+                    self.execute("DELETE FROM %s WHERE bit = %d" % (
+                        quote(ids_table(model)), bit))
+                table = quote(store_table(model))
+                self.execute(
+                    "UPDATE %s SET versions = versions & ~%d WHERE versions & %d" % (
+                        table, mask, mask))
+                self.execute("DELETE FROM %s WHERE versions = 0" % table)
+            self.execute("DELETE FROM %s WHERE name = ?" % VERSION_TABLE, (version,))
+
+    def merge_rows(self, model, rows, bit):
+        """add rows to the store table of model, for the version of bit
+
+        Rows are tuples of values of content fields (see _content_fields),
+        preceded by the id of the row in the version if model has an automatic id.
+        A row identical to one already stored only gets its version bit,
+        rows given several times being matched as many times.
+        Return the number of rows shared with other versions, and of added rows.
+        """
+        mask = 1 << bit
+        auto_id = _auto_id(model)
+        quote = self.quote
+        table = quote(store_table(model))
+        key = quote(_key(model))
+        fields = _content_fields(model)
+        columns = ", ".join(quote(f.db_column) for f in fields)
+        existing = collections.defaultdict(list)
+        for row in self.execute("SELECT %s, %s FROM %s WHERE versions & %d = 0 ORDER BY %s" % (
+                key, columns, table, mask, key)):
+            existing[row[1:]].append(row[0])
+        next_key, = self.execute("SELECT COALESCE(MAX(%s), 0) + 1 FROM %s" % (
+            key, table)).fetchone()
+        shared, added, ids = [], [], []
+        for row in rows:
+            row_id, row = (row[0], tuple(row[1:])) if auto_id else (None, tuple(row))
+            keys = existing.get(row)
+            if keys:
+                row_key = keys.pop(0)
+                shared.append((row_key,))
+            else:
+                row_key = next_key
+                next_key += 1
+                added.append((row_key,) + row)
+            ids.append((bit, row_id, row_key))
+        cursor = self.database.get_cursor()
+        cursor.executemany(
+            "UPDATE %s SET versions = versions | %d WHERE %s = ?" % (table, mask, key), shared)
+        cursor.executemany(
+            "INSERT INTO %s (%s, %s, versions) VALUES (?, %s, %d)" % (
+                table, key, columns, ", ".join("?" for f in fields), mask),
+            added)
+        if auto_id:
+            cursor.executemany(
+                "INSERT INTO %s (bit, id, row) VALUES (?, ?, ?)" % quote(ids_table(model)), ids)
+        return len(shared), len(added)
+
+    def build_documents(self, version, bit):
+        """store documents of romes of version, as read through the views
+        """
+        def iter_rows():
+            for romes in rome._rome_chunks(DOCUMENTS_CHUNK_SIZE):
+                for ogr_id, document in romes.items():
+                    yield (ogr_id, document["code_rome"],
+                           json.dumps(document, ensure_ascii=False, separators=(",", ":")))
+
+        with self.database.at_version(version):
+            return self.merge_rows(s.RomeDocument, iter_rows(), bit)
+
+    def add(self, built_path, version):
+        """add the database at built_path (built by Loader) as version
+
+        A version of the same name is replaced, in the same transaction.
+        Return numbers of (shared, added) rows by table.
+        """
+        self.create()
+        quote = self.quote
+        counts = collections.OrderedDict()
+        self.execute("ATTACH DATABASE ? AS built", (built_path,))
+        try:
+            with self.database.atomic():
+                if version in self.versions():
+                    self.remove(version)
+                used = {bit for bit, in self.execute("SELECT bit FROM %s" % VERSION_TABLE)}
+                free = [bit for bit in range(MAX_VERSIONS) if bit not in used]
+                if not free:
+                    raise ValueError("Store can't hold more than %d versions" % MAX_VERSIONS)
+                built_tables = {name for name, in self.execute(
+                    "SELECT name FROM built.sqlite_master WHERE type = 'table'")}
+                for model in STORE_MODELS:
+                    if model is s.RomeDocument or model._meta.db_table not in built_tables:
+                        continue
+                    columns = [quote(f.db_column) for f in _content_fields(model)]
+                    order = ""
+                    if _auto_id(model):
+                        columns.insert(0, quote(_key(model)))
+                        order = " ORDER BY %s" % quote(_key(model))
+                    rows = self.execute("SELECT %s FROM built.%s%s" % (
+                        ", ".join(columns), quote(model._meta.db_table), order))
+                    counts[model._meta.db_table] = self.merge_rows(model, rows, free[0])
+                self.execute(
+                    "INSERT INTO %s (name, bit) VALUES (?, ?)" % VERSION_TABLE,
+                    (version, free[0]))
+                counts[s.RomeDocument._meta.db_table] = self.build_documents(version, free[0])
+        finally:
+            self.execute("DETACH DATABASE built")
+        return counts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from .parser import Loader
+
+    parser = argparse.ArgumentParser(description='Add releases of ROME to a store')
+    parser.add_argument("store_path", help='Path of the store database')
+    parser.add_argument("zip_paths", nargs="*", help='Zip files of releases to add')
+    parser.add_argument("--remove", action="append", default=[], metavar="VERSION",
+                        help='Remove a version')
+    args = parser.parse_args()
+    for zip_path in args.zip_paths:
+        counts = Loader().add_version(zip_path, args.store_path)
+        for table, (shared, added) in counts.items():
+            print("%-20s %8d shared %8d added" % (table, shared, added))
+    with s.RomeDB(args.store_path):
+        store = VersionStore()
+        for version in args.remove:
+            store.remove(version)
+        print(" ".join(store.versions()))
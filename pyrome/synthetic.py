@@ -0,0 +1,226 @@
+"""Generate synthetic ROME zips, for benchmarks
+
+Files follow the structure the loader expects, with sizes close
+to the real referential, multiplied by a scale factor.
+Generation is deterministic for a given seed and streams to the zip.
+
+    python -m pyrome.synthetic rome.zip --scale 10
+"""
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+from .parser import Loader
+from . import schema as s
+
+
+ENCODING = "iso-8859-15"
+
+# approximate sizes of the real referential
+SIZES = {
+    "rome": 532,
+    "appellation": 11000,
+    "activite": 5000,
+    "competence": 10000,
+    "env_travail": 800,
+}
+
+# per card: appellations, environments, base activities, competences by kind,
+# specific blocs, activities by bloc and mobilities (proche, si_evolution)
+CARD_SIZES = {
+    "appellation": 20,
+    "env_travail": 8,
+    "activite_de_base": 10,
+    "savoir": 8,
+    "blocs": 3,
+    "activite_specifique": 4,
+    "proche": 5,
+    "si_evolution": 3,
+}
+
+WORDS = (
+    "agent chef conducteur responsable technicien assistant opérateur ingénieur "
+    "vendeur cuisinier boulanger pâtissier maçon électricien plombier infirmier "
+    "comptable juriste développeur éleveur maraîcher forestier soudeur mécanicien "
+    "gestion suivi contrôle réalisation préparation entretien sécurité qualité "
+    "clientèle production équipement chantier atelier véhicule données réseau "
+    "hôtellerie santé commerce bâtiment industrie transport agriculture").split()
+
+
+def _el(tag, text):
+    return "<%s>%s</%s>" % (tag, escape(str(text)) if text is not None else "", tag)
+
+
+def _item(*pairs):
+    return "<item>%s</item>" % "".join(_el(k, v) for k, v in pairs)
+
+
+class Generator:
+    """write a synthetic zip, scale times the size of the real referential
+    """
+
+    loader_class = Loader
+
+    def __init__(self, scale=1, seed=0):
+        self.scale = scale
+        self.random = random.Random(seed)
+        self._next_code = 10000
+
+    def code(self):
+        self._next_code += 1
+        return self._next_code
+
+    def libelle(self, n=3):
+        return " ".join(self.random.choice(WORDS) for i in range(n)).capitalize()
+
+    def size(self, name):
+        return max(1, int(SIZES[name] * self.scale))
+
+    def entities(self):
+        self.romes = [
+            (self.code(), "%s%04d" % (chr(ord("A") + i // 10000), i % 10000), self.libelle())
+            for i in range(self.size("rome"))]
+        self.appellations = [
+            (self.code(), self.libelle(4)) for i in range(self.size("appellation"))]
+        self.activites = [(self.code(), self.libelle(5)) for i in range(self.size("activite"))]
+        self.competences = [(self.code(), self.libelle(4)) for i in range(self.size("competence"))]
+        self.env_travails = [
+            (self.code(), self.libelle(2)) for i in range(self.size("env_travail"))]
+
+    def write_member(self, zip_file, name, root, items):
+        with zip_file.open(name, "w") as f:
+            f.write(('<?xml version="1.0" encoding="%s"?>\n<%s>' % (
+                ENCODING.upper(), root)).encode(ENCODING))
+            for item in items:
+                f.write(item.encode(ENCODING, "xmlcharrefreplace"))
+            f.write(("</%s>" % root).encode(ENCODING))
+
+    def iter_referentiels(self):
+        loader = self.loader_class
+        yield loader.ogr_fname[s.Activite], (
+            _item(("code_ogr", c), ("libelle_activite", l), ("libelle", l),
+                  ("libelle_application", l), ("libelle_en_tete_rgpmt", None),
+                  ("libelle_impression", l.upper()))
+            for c, l in self.activites)
+        yield loader.ogr_fname[s.Appellation], (
+            _item(("code_ogr", c), ("libelle_appellation", l), ("libelle", l),
+                  ("libelle_court", l[:30]))
+            for c, l in self.appellations)
+        yield loader.ogr_fname[s.EnvTravail], (
+            _item(("code_ogr", c), ("libelle_environnement", l), ("libelle", l))
+            for c, l in self.env_travails)
+        yield loader.ogr_fname[s.Competence], (
+            _item(("code_ogr", c), ("libelle_competence", l), ("libelle", l))
+            for c, l in self.competences)
+        yield loader.ogr_fname[s.Rome], (
+            _item(("code_ogr", c), ("code_rome", code), ("libelle", l))
+            for c, code, l in self.romes)
+
+    def relation(self, objs, n, *extra):
+        items = []
+        for i, (code, libelle) in enumerate(self.random.sample(objs, min(n, len(objs)))):
+            pairs = [("code_ogr", code), ("libelle", libelle)]
+            pairs.extend((name, func(i)) for name, func in extra)
+            items.append(_item(*pairs))
+        return "".join(items)
+
+    def bloc(self, tag, n_activites):
+        return "".join([
+            "<%s>%s</%s>" % (tag, self.relation(
+                self.activites, n_activites,
+                ("position", lambda i: i), ("priorisation", lambda i: i % 2)), tag),
+            "<savoir_theorique_et_proceduraux>%s</savoir_theorique_et_proceduraux>" % (
+                self.relation(self.competences, CARD_SIZES["savoir"],
+                              ("position", lambda i: i), ("priorisation", lambda i: i % 2))),
+            "<savoir_action>%s</savoir_action>" % (
+                self.relation(self.competences, CARD_SIZES["savoir"],
+                              ("position", lambda i: i), ("priorisation", lambda i: i % 2))),
+        ])
+
+    def mobilites(self, n):
+        return "".join(
+            _item(("code_rome_cible", "%s %s" % (code, l)), ("libelle_rome_cible", l))
+            for c, code, l in self.random.sample(self.romes, min(n, len(self.romes))))
+
+    def iter_cards(self):
+        for numero, (c, code, l) in enumerate(self.romes, 1):
+            blocs = "".join(
+                "<bloc_activites_specifique>%s%s</bloc_activites_specifique>" % (
+                    _el("position_bloc", b + 1),
+                    self.bloc("activite_specifique", CARD_SIZES["activite_specifique"]))
+                for b in range(CARD_SIZES["blocs"]))
+            yield "".join([
+                "<fiche_emploi_metier>",
+                _el("numero", numero),
+                "<bloc_code_rome>%s%s%s</bloc_code_rome>" % (
+                    _el("code_rome", code), _el("code_ogr", c), _el("intitule", l)),
+                _el("definition", self.libelle(30)),
+                _el("formations_associees", self.libelle(20)),
+                _el("condition_exercice_activite", self.libelle(20)),
+                _el("classement_emploi_metier", self.libelle(2)),
+                "<appellation>%s</appellation>" % self.relation(
+                    self.appellations, CARD_SIZES["appellation"],
+                    ("priorisation", lambda i: i % 2)),
+                "<environnement_de_travail>%s</environnement_de_travail>" % self.relation(
+                    self.env_travails, CARD_SIZES["env_travail"],
+                    ("priorisation", lambda i: i % 2)),
+                "<les_activites_de_base>%s</les_activites_de_base>" % self.bloc(
+                    "activite_de_base", CARD_SIZES["activite_de_base"]),
+                "<les_activites_specifique>%s</les_activites_specifique>" % blocs,
+                "<les_mobilites><proche>%s</proche><si_evolution>%s</si_evolution>"
+                "</les_mobilites>" % (
+                    self.mobilites(CARD_SIZES["proche"]),
+                    self.mobilites(CARD_SIZES["si_evolution"])),
+                "</fiche_emploi_metier>"])
+
+    def iter_arborescence(self):
+        """a referentiel of romes and one of appellations, in three levels
+        """
+        referentiels = [
+            ("REFERENTIEL DES CODES ROME", [(c, l) for c, code, l in self.romes]),
+            ("REFERENTIEL DES APPELLATIONS", self.appellations)]
+        for libelle_referentiel, leaves in referentiels:
+            root = self.code()
+            yield self.noeud(root, "R%d" % root, None, libelle_referentiel, "RACINE", None,
+                             libelle_referentiel)
+            for i in range(0, len(leaves), 100):
+                grand_domaine = self.code()
+                yield self.noeud(grand_domaine, "G%d" % grand_domaine, "R%d" % root,
+                                 libelle_referentiel, "NOEUD", None, self.libelle(2))
+                for j in range(i, min(i + 100, len(leaves)), 10):
+                    domaine = self.code()
+                    yield self.noeud(domaine, "D%d" % domaine, "G%d" % grand_domaine,
+                                     libelle_referentiel, "NOEUD", None, self.libelle(3))
+                    for item, libelle in leaves[j:j + 10]:
+                        feuille = self.code()
+                        yield self.noeud(feuille, "F%d" % feuille, "D%d" % domaine,
+                                         libelle_referentiel, "FEUILLE", item, libelle)
+
+    def noeud(self, code, code_noeud, code_pere, libelle_referentiel, libelle_noeud, item,
+              libelle):
+        return _item(
+            ("code_ogr", code), ("code_noeud", code_noeud), ("code_pere", code_pere),
+            ("libelle_referentiel", libelle_referentiel), ("libelle_noeud", libelle_noeud),
+            ("code_item_arbor_associe", item or 0), ("libelle", libelle))
+
+    def __call__(self, zip_path):
+        self.entities()
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as z:
+            for name, items in self.iter_referentiels():
+                self.write_member(z, name, "referentiel", items)
+            loader = self.loader_class
+            self.write_member(z, loader.fiche_fname, "fiches_metier", self.iter_cards())
+            self.write_member(
+                z, loader.arborescence_fname, "arborescence", self.iter_arborescence())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic ROME zip')
+    parser.add_argument("zip_path", help='Path of zip file to write')
+    parser.add_argument("-s", "--scale", type=float, default=1,
+                        help='Size relative to the real referential')
+    parser.add_argument("--seed", type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+    Generator(args.scale, args.seed)(args.zip_path)
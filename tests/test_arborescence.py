@@ -0,0 +1,104 @@
+import collections
+
+from pyrome import rome
+from pyrome import schema as s
+
+from .utils import BuiltTestCase
+
+
+class ArborescenceTest(BuiltTestCase):
+    """tree lookups, based on the closure, agree with a walk over Arborescence.pere
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.db_path = cls.build(cls.make_zip("rome.zip"), "rome.db")
+        with s.RomeDB(cls.db_path):
+            cls.peres = dict(
+                s.Arborescence.select(s.Arborescence.ogr, s.Arborescence.pere).tuples())
+        cls.fils = collections.defaultdict(list)
+        for node, pere in sorted(cls.peres.items()):
+            if pere is not None:
+                cls.fils[pere].append(node)
+
+    def setUp(self):
+        self.db = s.RomeDB(self.db_path)
+        self.db.__enter__()
+
+    def tearDown(self):
+        self.db.__exit__()
+
+    def ancestors(self, node):
+        """ancestors of node, from its father to the root
+        """
+        result = []
+        while self.peres[node] is not None:
+            node = self.peres[node]
+            result.append(node)
+        return result
+
+    def descendants(self, node, depth=None):
+        """node and its descendants down to depth, with their depth under node
+        """
+        result = {node: 0}
+        level = [node]
+        while level and (depth is None or result[level[0]] < depth):
+            level = [f for n in level for f in self.fils[n]]
+            result.update((f, result[self.peres[f]] + 1) for f in level)
+        return result
+
+    def tree_ids(self, tree):
+        """ids of nodes of a subtree, with their depth, checking children are sorted
+        """
+        result = {}
+        stack = [(tree, 0)]
+        while stack:
+            data, depth = stack.pop()
+            result[data["ogr"]] = depth
+            children = [c["ogr"] for c in data["children"]]
+            self.assertEqual(children, sorted(children))
+            stack.extend((c, depth + 1) for c in data["children"])
+        return result
+
+    def test_closure(self):
+        closure = s.ArborescenceClosure
+        rows = set(
+            closure.select(closure.ancetre, closure.descendant, closure.profondeur).tuples())
+        expected = {(node, node, 0) for node in self.peres}
+        for node in self.peres:
+            expected.update(
+                (ancetre, node, depth)
+                for depth, ancetre in enumerate(self.ancestors(node), 1))
+        self.assertEqual(rows, expected)
+
+    def test_subtree(self):
+        self.assertGreater(max(len(self.ancestors(n)) for n in self.peres), 2)
+        for node in self.peres:
+            for depth in (None, 0, 1, 2):
+                with self.subTest(node=node, depth=depth):
+                    self.assertEqual(
+                        self.tree_ids(rome.subtree(node, depth)),
+                        self.descendants(node, depth))
+        self.assertIsNone(rome.subtree(0))
+
+    def test_ancestors(self):
+        for node in self.peres:
+            with self.subTest(node=node):
+                self.assertEqual(
+                    [data["ogr"] for data in rome.ancestors(node)],
+                    self.ancestors(node)[::-1])
+        self.assertEqual(rome.ancestors(0), [])
+
+    def test_descendant_counts(self):
+        counts = rome.descendant_counts(self.peres)
+        for node in self.peres:
+            with self.subTest(node=node):
+                self.assertEqual(counts[node], len(self.descendants(node)) - 1)
+
+    def test_children(self):
+        for node in self.peres:
+            with self.subTest(node=node):
+                self.assertEqual(
+                    [(data["ogr"], data["nb_descendants"]) for data in rome.children(node)],
+                    [(f, len(self.descendants(f)) - 1) for f in self.fils[node]])
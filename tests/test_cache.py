@@ -0,0 +1,90 @@
+import os
+import unittest
+
+from pyrome import rome
+from pyrome import schema as s
+from pyrome.cache import LRUCache, RomeCache
+from pyrome.metrics import QueryCounter
+
+from .utils import BuiltTestCase
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_entries(self):
+        cache = LRUCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        # b was the least recently used
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("a"), (True, 1))
+        self.assertEqual(cache.get("c"), (True, 3))
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (3, 1, 1))
+
+    def test_bytes(self):
+        cache = LRUCache(max_entries=None, max_bytes=1000)
+        for i in range(100):
+            cache.set(i, {"libelle": "x" * 100})
+        self.assertLessEqual(cache.bytes, 1000)
+        self.assertGreater(len(cache), 0)
+        self.assertEqual(cache.get(99), (True, {"libelle": "x" * 100}))
+        self.assertEqual(cache.get(0), (False, None))
+
+    def test_ttl(self):
+        now = [0]
+        cache = LRUCache(ttl=10, clock=lambda: now[0])
+        cache.set("a", 1)
+        now[0] = 5
+        self.assertEqual(cache.get("a"), (True, 1))
+        now[0] = 11
+        self.assertEqual(cache.get("a"), (False, None))
+        self.assertEqual(len(cache), 0)
+
+
+class RomeCacheTest(BuiltTestCase):
+    """cached lookups give results of lookups, those of a new file once replaced
+    """
+
+    def setUp(self):
+        self.db_path = self.build(self.make_zip("rome.zip"), "rome.db")
+        self.db = s.RomeDB(self.db_path)
+        self.db.__enter__()
+        self.cache = RomeCache(check_interval=0)
+
+    def tearDown(self):
+        self.db.__exit__()
+
+    def queries(self, func, *args):
+        with QueryCounter() as counter:
+            result = func(*args)
+        return result, counter.count
+
+    def test_cached(self):
+        for ogr_id, in s.Rome.select(s.Rome.ogr).tuples():
+            result, count = self.queries(self.cache.get_rome, ogr_id)
+            self.assertEqual(result, rome.get_rome(ogr_id))
+            self.assertGreater(count, 0)
+            self.assertEqual(self.queries(self.cache.get_rome, ogr_id), (result, 0))
+        for code, in s.Ogr.select(s.Ogr.code).limit(20).tuples():
+            self.assertEqual(self.cache.get_ogr(code), rome.get_ogr(code))
+            self.assertEqual(self.queries(self.cache.get_ogr, code)[1], 0)
+        for ogr_id, in s.Referentiel.select(s.Referentiel.ogr).tuples():
+            self.assertEqual(self.cache.referentiel(ogr_id), rome.referentiel(ogr_id))
+            self.assertEqual(self.queries(self.cache.referentiel, ogr_id)[1], 0)
+        stats = self.cache.stats()
+        self.assertEqual(stats["invalidations"], 0)
+        self.assertEqual(stats["hits"], stats["misses"])
+
+    def test_replaced(self):
+        ogr_ids = [i for i, in s.Rome.select(s.Rome.ogr).tuples()]
+        previous = [self.cache.get_rome(ogr_id) for ogr_id in ogr_ids]
+        # the synthetic release of another seed has other libelles, on the same ogr
+        new_path = self.build(self.make_zip("new.zip", seed=1), "new.db")
+        os.replace(new_path, self.db_path)
+        results = [self.cache.get_rome(ogr_id) for ogr_id in ogr_ids]
+        self.assertEqual(self.cache.stats()["invalidations"], 1)
+        self.assertNotEqual(results, previous)
+        with s.RomeDB(self.db_path, bound=True):
+            self.assertEqual(results, [rome.get_rome(ogr_id) for ogr_id in ogr_ids])
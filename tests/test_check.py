@@ -0,0 +1,80 @@
+import os
+import shutil
+
+from pyrome import schema as s
+from pyrome.check import CheckError, check_db
+from pyrome.parser import Loader
+
+from .utils import BuiltTestCase
+
+
+class CheckTest(BuiltTestCase):
+    """check_db finds no failure in a build, and each kind of damage done to it
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.zip_path = cls.make_zip("rome.zip")
+        cls.db_path = cls.build(cls.zip_path, "rome.db")
+
+    def setUp(self):
+        shutil.copy(self.db_path, self.path("damaged.db"))
+        self.db = s.RomeDB(self.path("damaged.db"))
+        self.db.__enter__()
+
+    def tearDown(self):
+        self.db.__exit__()
+
+    def checks(self, expected_counts=None):
+        return {failure["check"]: failure for failure in check_db(expected_counts)}
+
+    def test_build(self):
+        self.assertEqual(self.checks(Loader().count_rows(self.zip_path)), {})
+
+    def test_orphan(self):
+        code = s.Competence.select(s.Competence.ogr).tuples()[0][0]
+        s.Ogr.delete().where(s.Ogr.code == code).execute()
+        self.assertEqual(self.checks()["orphan.competence.ogr"]["sample"], [code])
+
+    def test_fiche_fields(self):
+        """fields filled from numero, as the loader once did, are found for each field
+        """
+        for field in ("definition", "formations_associees",
+                      "condition_exercice_activite", "classement_emploi_metier"):
+            s.rome_db.execute_sql(
+                "UPDATE fiche SET %s = CAST(numero AS TEXT) WHERE numero = 1" % field)
+            self.assertEqual(self.checks()["fiche.%s" % field]["sample"], [1])
+
+    def test_columns(self):
+        s.rome_db.execute_sql("ALTER TABLE fiche DROP COLUMN definition")
+        self.assertEqual(self.checks()["columns.fiche"]["sample"], ["definition"])
+
+    def test_arborescence(self):
+        leaf = s.Arborescence.select().where(s.Arborescence.item_ogr.is_null(False)).get()
+        s.Arborescence.update(item_ogr=None).where(s.Arborescence.ogr == leaf.ogr).execute()
+        self.assertEqual(
+            self.checks()["arborescence.feuille_item"]["sample"], [leaf.ogr_id])
+
+    def test_row_counts(self):
+        counts = Loader().count_rows(self.zip_path)
+        s.Mobilite.delete().where(s.Mobilite.id == 1).execute()
+        failure = self.checks(counts)["row_count.mobilite"]
+        self.assertEqual(failure["count"], failure["expected"] - 1)
+
+
+class LoaderCheckTest(BuiltTestCase):
+
+    def test_check_error(self):
+        """a build failing its checks is not installed
+        """
+        class DamagingLoader(Loader):
+            def build_closure(self, db):
+                super().build_closure(db)
+                s.Ogr.delete().where(s.Ogr.type == 1).execute()
+
+        db_path = self.path("rome.db")
+        with self.assertRaises(CheckError) as cm:
+            DamagingLoader(check=True)(self.make_zip("rome.zip"), db_path)
+        self.assertIn("orphan.envtravail.ogr", [f["check"] for f in cm.exception.failures])
+        self.assertFalse(os.path.exists(db_path))
@@ -0,0 +1,85 @@
+import gzip
+import json
+
+from pyrome import rome
+from pyrome import schema as s
+from pyrome.export import export
+
+from .utils import BuiltTestCase
+
+
+class ExportTest(BuiltTestCase):
+    """exports read back give romes and referentiels as lookups do
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.db_path = cls.build(cls.make_zip("rome.zip"), "rome.db")
+
+    def setUp(self):
+        self.db = s.RomeDB(self.db_path)
+        self.db.__enter__()
+
+    def tearDown(self):
+        self.db.__exit__()
+
+    def read(self, path, format):
+        """records of an export, as a list by type
+        """
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            if format == "json":
+                return json.load(f)
+            records = {}
+            for line in f:
+                record = json.loads(line)
+                records.setdefault(record["type"], []).append(record["data"])
+            return records
+
+    def expected(self):
+        mobilites = {}
+        query = (
+            s.Mobilite
+            .select(s.Mobilite.origine_rome, s.Mobilite.cible_rome, s.Mobilite.type)
+            .order_by(s.Mobilite.id))
+        for origine, cible, type_ in query.tuples():
+            mobilites.setdefault(origine, []).append((dict(s.Mobilite.TYPE)[type_], cible))
+        romes = []
+        for ogr_id, in s.Rome.select(s.Rome.ogr).order_by(s.Rome.ogr).tuples():
+            data = rome.get_rome(ogr_id)
+            romes.append((data, mobilites.get(ogr_id, [])))
+        referentiels = [
+            (ogr_id, libelle, rome.referentiel(ogr_id))
+            for ogr_id, libelle in s.Referentiel.select().order_by(s.Referentiel.ogr).tuples()]
+        return romes, referentiels
+
+    def assertRecords(self, records, expected):
+        romes, referentiels = expected
+        self.assertEqual(sorted(records), ["referentiel", "rome"])
+        self.assertEqual(len(records["rome"]), len(romes))
+        for data, (rome_data, mobilites) in zip(records["rome"], romes):
+            with self.subTest(rome=rome_data["code_rome"]):
+                self.assertEqual(
+                    [(m["type"], m["cible_rome"]) for m in data.pop("mobilite")], mobilites)
+                self.assertEqual(data, rome_data)
+        self.assertEqual(
+            [(data["ogr"], data["libelle"], data["arborescence"])
+             for data in records["referentiel"]],
+            referentiels)
+
+    def test_export(self):
+        expected = self.expected()
+        self.assertTrue(any(mobilites for data, mobilites in expected[0]))
+        for name, format, kwargs in [
+                ("rome.ndjson", "ndjson", {}),
+                ("rome.ndjson.gz", "ndjson", {}),
+                ("rome.json", "json", {}),
+                ("rome.json.gz", "json", {"chunk_size": 3}),
+                ("chunks.ndjson", "ndjson", {"chunk_size": 1})]:
+            with self.subTest(name=name, **kwargs):
+                path = self.path(name)
+                export(path, format, **kwargs)
+                with open(path, "rb") as f:
+                    self.assertEqual(f.read(2) == b"\x1f\x8b", name.endswith(".gz"))
+                self.assertRecords(self.read(path, format), expected)
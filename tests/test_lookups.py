@@ -0,0 +1,59 @@
+from pyrome import rome
+from pyrome import schema as s
+from pyrome.metrics import QueryCounter
+
+from .utils import BuiltTestCase
+
+
+class BatchLookupTest(BuiltTestCase):
+    """batch lookups give the same objects as single ones, in a fixed number of queries
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.db_path = cls.build(cls.make_zip("rome.zip"), "rome.db")
+
+    def setUp(self):
+        self.db = s.RomeDB(self.db_path)
+        self.db.__enter__()
+
+    def tearDown(self):
+        self.db.__exit__()
+
+    def queries(self, func, *args):
+        with QueryCounter() as counter:
+            func(*args)
+        return counter.count
+
+    def test_get_ogrs(self):
+        codes = [code for code, in s.Ogr.select(s.Ogr.code).order_by(s.Ogr.code).tuples()]
+        objs = rome.get_ogrs(codes + [0])
+        self.assertEqual(sorted(objs), codes)
+        for code in codes:
+            with self.subTest(code=code):
+                self.assertEqual(objs[code], rome.get_ogr(code))
+
+    def test_get_romes(self):
+        ogr_ids = [i for i, in s.Rome.select(s.Rome.ogr).order_by(s.Rome.ogr).tuples()]
+        objs = rome.get_romes(ogr_ids + [0])
+        self.assertEqual(sorted(objs), ogr_ids)
+        for ogr_id in ogr_ids:
+            with self.subTest(ogr_id=ogr_id):
+                self.assertEqual(objs[ogr_id], rome.get_rome(ogr_id))
+
+    def test_get_ogrs_queries(self):
+        # codes of every type in both lookups, objects of a type being fetched together
+        # (and romes items of arborescence nodes)
+        by_type = {}
+        for code, type_ in s.Ogr.select(s.Ogr.code, s.Ogr.type).order_by(s.Ogr.code).tuples():
+            by_type.setdefault(type_, []).append(code)
+        few = [code for codes in by_type.values() for code in codes[:len(codes) // 4 + 1]]
+        many = [code for codes in by_type.values() for code in codes]
+        self.assertGreater(len(many), 2 * len(few))
+        self.assertEqual(self.queries(rome.get_ogrs, few), self.queries(rome.get_ogrs, many))
+
+    def test_get_romes_queries(self):
+        ogr_ids = [i for i, in s.Rome.select(s.Rome.ogr).order_by(s.Rome.ogr).tuples()]
+        self.assertEqual(
+            self.queries(rome.get_romes, ogr_ids[:1]), self.queries(rome.get_romes, ogr_ids))
@@ -0,0 +1,45 @@
+import pickle
+
+from pyrome import schema as s
+from pyrome.matcher import TitleMatcher, normalize
+
+from .utils import BuiltTestCase
+
+
+class MatcherTest(BuiltTestCase):
+    """appellations match their own libelles, synthetic ones being made of common words
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with s.RomeDB(cls.build(cls.make_zip("rome.zip"), "rome.db")):
+            cls.matcher = TitleMatcher.load()
+            a = s.Appellation
+            cls.appellations = list(a.select(a.ogr, a.libelle_appellation).tuples())
+
+    def test_libelles(self):
+        libelles = dict(self.appellations)
+        for ogr, libelle in self.appellations:
+            result = self.matcher.match(libelle.upper() + " H/F", k=3)
+            best = result["appellations"][0]
+            self.assertEqual(best["score"], 1)
+            # appellations may share a libelle
+            self.assertEqual(normalize(libelles[best["ogr"]]), normalize(libelle))
+            self.assertTrue(result["romes"])
+
+    def test_rare_words(self):
+        """titles of rare trigrams are counted over postings, with the same results
+        """
+        matcher = TitleMatcher(
+            [(1, ("Zythologue brasseur",), [10]), (2, ("Zoologiste",), [11])],
+            [(10, "A0001", "Brasserie"), (11, "A0002", "Zoologie")])
+        result = matcher.match("zythologue", k=2)
+        self.assertEqual(result["appellations"][0]["ogr"], 1)
+        self.assertEqual(result["romes"][0]["code_rome"], "A0001")
+
+    def test_pickle(self):
+        titles = [libelle for ogr, libelle in self.appellations[:20]]
+        matcher = pickle.loads(pickle.dumps(self.matcher))
+        self.assertEqual([matcher.match(t) for t in titles],
+                         [self.matcher.match(t) for t in titles])
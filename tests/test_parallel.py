@@ -0,0 +1,38 @@
+from pyrome.parser import Loader
+
+from .utils import BuiltTestCase, dump
+
+
+class SmallChunksLoader(Loader):
+    """chunks of a few elements, read in small blocks, cutting elements anywhere
+    """
+    PARSE_CHUNK_SIZE = 3
+    READ_SIZE = 100
+
+
+class ParallelTest(BuiltTestCase):
+    """builds parsing members in worker processes give the same database as serial ones
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.zip_path = cls.make_zip("rome.zip")
+
+    def assertSameBuild(self, name, loader_class=Loader, **kwargs):
+        serial = self.build(self.zip_path, "%s_serial.db" % name, **kwargs)
+        db_path = self.path("%s_parallel.db" % name)
+        loader_class(workers=2, **kwargs)(self.zip_path, db_path)
+        self.assertEqual(dump(db_path), dump(serial))
+
+    def test_parallel(self):
+        self.assertSameBuild("default", similar_romes=3)
+
+    def test_fast_build(self):
+        self.assertSameBuild("fast", fast_build=True)
+
+    def test_chunks(self):
+        self.assertSameBuild("chunks", SmallChunksLoader)
+
+    def test_not_streaming(self):
+        self.assertSameBuild("dom", streaming=False)
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+
+from pyrome import rome
+from pyrome import schema as s
+from pyrome.aio import AsyncRome
+from pyrome.parser import Loader
+from pyrome.pool import RomePool
+
+from .utils import BuiltTestCase
+
+
+class PoolTest(BuiltTestCase):
+    """pools on several files give the lookups of each file, from any thread
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.paths = [cls.build(cls.make_zip("%d.zip" % seed, seed=seed), "%d.db" % seed)
+                     for seed in (0, 1)]
+        cls.expected = []
+        for path in cls.paths:
+            with s.RomeDB(path):
+                romes = [ogr for ogr, in s.Rome.select(s.Rome.ogr).tuples()]
+                cls.expected.append(rome.get_romes(romes))
+
+    def test_threads(self):
+        pools = [RomePool(path) for path in self.paths]
+        results = {}
+
+        def run(i):
+            pool = pools[i % 2]
+            results[i] = {ogr: pool.get_rome(ogr) for ogr in self.expected[i % 2]}
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for i, result in results.items():
+            self.assertEqual(result, self.expected[i % 2])
+        self.assertEqual(len(results), 4)
+        for pool in pools:
+            pool.close()
+
+    def test_async(self):
+        pool = RomePool(self.paths[1])
+
+        async def lookups():
+            async with AsyncRome(pool) as r:
+                return await asyncio.gather(*[r.get_rome(ogr) for ogr in self.expected[1]])
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(lookups())
+        finally:
+            loop.close()
+        self.assertEqual(results, list(self.expected[1].values()))
+        pool.close()
+
+    def test_build_while_serving(self):
+        """building a database leaves lookups of the process on their database
+        """
+        with s.RomeDB(self.paths[0]):
+            Loader()(self.make_zip("other.zip", seed=2), self.path("other.db"))
+            Loader().add_version(self.make_zip("store.zip", seed=3), self.path("store.db"))
+            self.assertEqual(rome.get_romes(list(self.expected[0])), self.expected[0])
@@ -0,0 +1,75 @@
+import collections
+import random
+
+from pyrome import schema as s
+from pyrome.ranking import WEIGHTS, RomeRanking
+
+from .utils import BuiltTestCase
+
+
+def brute_force(rows, codes, k, weights):
+    """rank_romes scoring each rome one by one, from the rows of the database
+    """
+    tiers = collections.defaultdict(list)
+    for rome, code, bloc, priorisation in rows:
+        tier = ("base" if bloc is None else "specifique", 1 if priorisation else 0)
+        tiers[rome, code].append(tier)
+    totals, scores = collections.Counter(), collections.Counter()
+    for (rome, code), code_tiers in tiers.items():
+        # the best tier is chosen by default weights, see RomeRanking.__init__
+        weight = weights[max(code_tiers, key=WEIGHTS.get)]
+        totals[rome] += weight
+        if code in codes:
+            scores[rome] += weight
+    ranked = [
+        (rome, score, score / totals[rome]) for rome, score in scores.items() if score]
+    ranked.sort(key=lambda r: (-r[1], -r[2], r[0]))
+    return ranked[:k]
+
+
+class RankingTest(BuiltTestCase):
+    """rankings are those of scoring every rome
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.db_path = cls.build(cls.make_zip("rome.zip"), "rome.db")
+
+    def setUp(self):
+        self.db = s.RomeDB(self.db_path)
+        self.db.__enter__()
+        rc, ra = s.RomeCompetence, s.RomeActivite
+        self.rows = list(rc.select(rc.rome, rc.competence, rc.bloc, rc.priorisation).tuples())
+        self.rows.extend(ra.select(ra.rome, ra.activite, ra.bloc, ra.priorisation).tuples())
+        self.ranking = RomeRanking.load()
+        codes = sorted({code for rome, code, bloc, priorisation in self.rows})
+        rand = random.Random(0)
+        self.profiles = [rand.sample(codes, n) for n in (1, 2, 5, 20, 100) for i in range(10)]
+
+    def tearDown(self):
+        self.db.__exit__()
+
+    def assertRanking(self, k, weights=None):
+        all_weights = dict(WEIGHTS)
+        all_weights.update(weights or {})
+        expected = [brute_force(self.rows, set(codes), k, all_weights)
+                    for codes in self.profiles]
+        for codes, ranked in zip(self.profiles, expected):
+            self.assertEqual(self.ranking.rank_romes(codes, k, weights), ranked)
+        self.assertEqual(self.ranking.rank_romes_many(self.profiles, k, weights), expected)
+
+    def test_rank_romes(self):
+        for k in (1, 3, 10, len(self.ranking)):
+            with self.subTest(k=k):
+                self.assertRanking(k)
+
+    def test_weights(self):
+        for weights in ({("base", 1): 10}, {("specifique", 0): 0, ("base", 0): 5}):
+            with self.subTest(weights=weights):
+                self.assertRanking(5, weights)
+
+    def test_unknown_codes(self):
+        self.assertEqual(self.ranking.rank_romes([1, 2]), [])
+        with self.assertRaises(ValueError):
+            self.ranking.rank_romes(self.profiles[0], weights={("base", 1): 1.5})
@@ -0,0 +1,76 @@
+import os
+
+from pyrome.parser import Loader
+
+from .utils import BuiltTestCase, dump
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupted_loader(method):
+    """a loader class failing in method, as would an interrupted build
+    """
+    def fail(self, *args, **kwargs):
+        raise Interrupted(method)
+
+    return type("InterruptedLoader", (Loader,), {method: fail})
+
+
+class ResumeTest(BuiltTestCase):
+    """a build interrupted then run again gives the same database as an uninterrupted one
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.zip_path = cls.make_zip("rome.zip")
+        cls.expected = {
+            fast_build: dump(cls.build(cls.zip_path, "clean%d.db" % fast_build,
+                                       fast_build=fast_build, similar_romes=3))
+            for fast_build in (False, True)}
+
+    def resume(self, method, fast_build=False):
+        db_path = self.path("%s%d.db" % (method, fast_build))
+        kwargs = dict(fast_build=fast_build, similar_romes=3)
+        with self.assertRaises(Interrupted):
+            interrupted_loader(method)(**kwargs)(self.zip_path, db_path)
+        self.assertFalse(os.path.exists(db_path))
+        loader = Loader(**kwargs)
+        build_path = loader.build_path(db_path)
+        done = loader.read_checkpoints(build_path, loader.build_source(self.zip_path))
+        loader(self.zip_path, db_path)
+        self.assertFalse(os.path.exists(build_path))
+        self.assertEqual(dump(db_path), self.expected[fast_build])
+        return done
+
+    def test_entities(self):
+        entities = {model._meta.db_table for model in Loader.ogr_fname}
+        self.assertEqual(self.resume("load_fiche"), {"ogr"} | entities)
+
+    def test_arborescence(self):
+        done = self.resume("build_closure")
+        self.assertIn("fiche", done)
+        self.assertNotIn("arborescence", done)
+
+    def test_documents(self):
+        done = self.resume("build_documents")
+        self.assertIn("search_index", done)
+        self.assertNotIn("documents", done)
+
+    def test_fast_build(self):
+        for method in ("build_closure", "build_similarities", "finalize"):
+            with self.subTest(method=method):
+                self.assertNotIn("finalize", self.resume(method, fast_build=True))
+
+    def test_other_zip(self):
+        """a build of another zip does not go on with the interrupted one
+        """
+        db_path = self.path("other.db")
+        with self.assertRaises(Interrupted):
+            interrupted_loader("build_documents")()(self.zip_path, db_path)
+        other_zip = self.make_zip("other.zip", seed=1)
+        Loader(similar_romes=3)(other_zip, db_path)
+        self.build(other_zip, "other_clean.db", similar_romes=3)
+        self.assertEqual(dump(db_path), dump(self.path("other_clean.db")))
@@ -0,0 +1,83 @@
+import unicodedata
+
+from pyrome import rome
+from pyrome import schema as s
+
+from .utils import BuiltTestCase
+
+
+def without_accents(text):
+    return "".join(
+        c for c in unicodedata.normalize("NFD", text) if not unicodedata.combining(c))
+
+
+class SearchTest(BuiltTestCase):
+    """full text search finds objects by their libelles
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.db_path = cls.build(cls.make_zip("rome.zip"), "rome.db")
+
+    def setUp(self):
+        self.db = s.RomeDB(self.db_path)
+        self.db.__enter__()
+        self.appellations = list(
+            s.Appellation.select(s.Appellation.ogr, s.Appellation.libelle)
+            .order_by(s.Appellation.ogr).limit(50).tuples())
+
+    def tearDown(self):
+        self.db.__exit__()
+
+    def found(self, ogr_id, text, **kwargs):
+        return ogr_id in [hit["ogr"] for hit in rome.search(text, limit=1000, **kwargs)]
+
+    def test_libelle(self):
+        for ogr_id, libelle in self.appellations:
+            with self.subTest(libelle=libelle):
+                self.assertTrue(self.found(ogr_id, libelle))
+                hits = rome.search(libelle, types=["appellation"], limit=1000)
+                hit = next(hit for hit in hits if hit["ogr"] == ogr_id)
+                self.assertEqual((hit["type"], hit["libelle"]), ("appellation", libelle))
+
+    def test_accents_and_case(self):
+        for ogr_id, libelle in self.appellations:
+            with self.subTest(libelle=libelle):
+                self.assertTrue(self.found(ogr_id, without_accents(libelle).upper()))
+                self.assertTrue(self.found(ogr_id, libelle.lower()))
+
+    def test_prefix(self):
+        for ogr_id, libelle in self.appellations:
+            words = libelle.split()
+            with self.subTest(libelle=libelle):
+                self.assertTrue(self.found(ogr_id, " ".join(words[:-1] + [words[-1][:3]])))
+
+    def test_codes_rome(self):
+        relation = s.RomeAppellation
+        for ogr_id, libelle in self.appellations:
+            codes = set(
+                relation.select(s.Rome.code_rome).join(s.Rome)
+                .where(relation.appellation == ogr_id).tuples())
+            hit = next(
+                hit for hit in rome.search(libelle, types=["appellation"], limit=1000)
+                if hit["ogr"] == ogr_id)
+            with self.subTest(libelle=libelle):
+                self.assertEqual(set(hit["codes_rome"]), {code for code, in codes})
+
+    def test_types_and_limit(self):
+        word = self.appellations[0][1].split()[0]
+        hits = rome.search(word, limit=1000)
+        self.assertGreater(len({hit["type"] for hit in hits}), 1)
+        self.assertEqual(
+            rome.search(word, types=["appellation", "competence"], limit=1000),
+            [hit for hit in hits if hit["type"] in ("appellation", "competence")])
+        self.assertGreater(len(hits), 20)
+        self.assertEqual(rome.search(word), hits[:20])
+        self.assertEqual(rome.search(word, limit=5), hits[:5])
+        scores = [hit["score"] for hit in hits]
+        self.assertEqual(scores, sorted(scores))
+
+    def test_nothing(self):
+        self.assertEqual(rome.search(" ,;"), [])
+        self.assertEqual(rome.search("zzzzzz"), [])
@@ -0,0 +1,120 @@
+import csv
+import io
+import json
+import os
+import sqlite3
+
+import peewee as pw
+
+from pyrome import schema as s
+from pyrome.parser import Loader
+from pyrome.sinks import ColumnarSink, CountingSink, CsvSink, FanOutSink, NdjsonSink
+
+from .utils import BuiltTestCase
+
+
+models = {
+    model._meta.db_table: model for model in vars(s).values()
+    if isinstance(model, type) and issubclass(model, pw.Model)}
+
+
+class SinkTest(BuiltTestCase):
+    """rows fed to sinks are those a build inserts
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.zip_path = cls.make_zip("rome.zip")
+        cls.db_path = cls.build(cls.zip_path, "rome.db")
+        # tables of the build not computed from others
+        computed = {s.ArborescenceClosure._meta.db_table, s.RomeDocument._meta.db_table}
+        conn = sqlite3.connect(cls.db_path)
+        try:
+            cls.loaded = {
+                name for name, in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table'")
+                if name in models and name not in computed}
+        finally:
+            conn.close()
+
+    def built(self, table, names):
+        """rows of table in the build, with columns of fields named names, sorted
+        """
+        fields = models[table]._meta.fields
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return sorted(conn.execute('SELECT %s FROM "%s"' % (
+                ", ".join('"%s"' % fields[name].db_column for name in names), table)), key=repr)
+        finally:
+            conn.close()
+
+    def feed(self, sink):
+        Loader(sink=sink).feed(self.zip_path)
+        return sink
+
+    def assertColumnar(self, sink):
+        self.assertEqual(set(sink.tables), self.loaded)
+        for table, columns in sink.tables.items():
+            with self.subTest(table=table):
+                self.assertEqual(
+                    sorted(zip(*columns.values()), key=repr), self.built(table, columns))
+
+    def assertCounts(self, sink):
+        self.assertEqual(dict(sink.counts), {
+            table: len(self.built(table, models[table]._meta.sorted_field_names))
+            for table in self.loaded})
+
+    def assertCsv(self, directory):
+        self.assertEqual(
+            sorted(os.listdir(directory)), sorted("%s.csv" % table for table in self.loaded))
+        for table in self.loaded:
+            with open(os.path.join(directory, "%s.csv" % table), encoding="utf-8") as f:
+                header, *rows = csv.reader(f)
+            expected = [
+                ["" if value is None else str(value) for value in row]
+                for row in self.built(table, header)]
+            with self.subTest(table=table):
+                self.assertEqual(sorted(rows, key=repr), sorted(expected, key=repr))
+
+    def test_columnar(self):
+        sink = self.feed(ColumnarSink())
+        self.assertColumnar(sink)
+        self.assertEqual(sink.table(s.ArborescenceClosure), {})
+
+    def test_counting(self):
+        self.assertCounts(self.feed(CountingSink()))
+        self.assertEqual(
+            Loader().count_rows(self.zip_path), dict(self.feed(CountingSink()).counts))
+
+    def test_ndjson(self):
+        f = io.StringIO()
+        self.feed(NdjsonSink(f))
+        rows = {}
+        for line in f.getvalue().splitlines():
+            record = json.loads(line)
+            rows.setdefault(record["type"], []).append(record["data"])
+        self.assertEqual(set(rows), self.loaded)
+        for table, data in rows.items():
+            names = list(data[0])
+            with self.subTest(table=table):
+                self.assertEqual(
+                    sorted((tuple(d[name] for name in names) for d in data), key=repr),
+                    self.built(table, names))
+
+    def test_csv(self):
+        directory = self.path("csv")
+        os.mkdir(directory)
+        self.feed(CsvSink(directory))
+        self.assertCsv(directory)
+
+    def test_fan_out(self):
+        directory = self.path("fan_out")
+        os.mkdir(directory)
+        columnar, counting, csv_sink = ColumnarSink(), CountingSink(), CsvSink(directory)
+        self.feed(FanOutSink(columnar, counting, csv_sink))
+        self.assertColumnar(columnar)
+        self.assertCounts(counting)
+        # closed along, which flushed the files
+        self.assertEqual(csv_sink._files, {})
+        self.assertCsv(directory)
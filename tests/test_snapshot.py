@@ -0,0 +1,62 @@
+import filecmp
+
+import peewee as pw
+
+from pyrome import rome
+from pyrome import schema as s
+from pyrome.snapshot import Snapshot, write_snapshot
+
+from .utils import BuiltTestCase
+
+
+class SnapshotTest(BuiltTestCase):
+    """a snapshot gives the same results as lookups of the database it was written from
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.db_path = cls.build(cls.make_zip("rome.zip"), "rome.db")
+        with s.RomeDB(cls.db_path):
+            write_snapshot(cls.path("rome.snapshot"))
+
+    def setUp(self):
+        self.db = s.RomeDB(self.db_path)
+        self.db.__enter__()
+        self.snapshot = Snapshot(self.path("rome.snapshot"))
+
+    def tearDown(self):
+        self.snapshot.close()
+        self.db.__exit__()
+
+    def test_get_ogr(self):
+        codes = dict(s.Ogr.select(s.Ogr.code, s.Ogr.type).tuples())
+        self.assertEqual(set(codes.values()), set(s.ogr_type_model))
+        for code, ogr_type in sorted(codes.items()):
+            with self.subTest(code=code, type=ogr_type):
+                self.assertEqual(self.snapshot.get_ogr(code), rome.get_ogr(code))
+
+    def test_get_rome(self):
+        for ogr_id, in s.Rome.select(s.Rome.ogr).tuples():
+            self.assertEqual(self.snapshot.get_rome(ogr_id), rome.get_rome(ogr_id))
+
+    def test_subtree(self):
+        for node, in s.Arborescence.select(s.Arborescence.ogr).tuples():
+            for depth in (None, 0, 1):
+                self.assertEqual(
+                    self.snapshot.subtree(node, depth), rome.subtree(node, depth))
+        self.assertIsNone(self.snapshot.subtree(1))
+
+    def test_database(self):
+        """a snapshot of a given database, the one of lookups being another
+        """
+        database = pw.SqliteDatabase(self.db_path)
+        with s.RomeDB(":memory:", bound=True):
+            write_snapshot(self.path("given.snapshot"), database)
+        database.close()
+        self.assertTrue(filecmp.cmp(
+            self.path("given.snapshot"), self.path("rome.snapshot"), shallow=False))
+
+    def test_referentiel(self):
+        for ogr_id, in s.Referentiel.select(s.Referentiel.ogr).tuples():
+            self.assertEqual(self.snapshot.referentiel(ogr_id), rome.referentiel(ogr_id))
@@ -0,0 +1,120 @@
+import json
+
+from pyrome import rome
+from pyrome import schema as s
+from pyrome.parser import Loader
+from pyrome.store import STORE_MODELS, VersionStore, store_table
+
+from .utils import BuiltTestCase
+
+
+def lookups(version=None):
+    """results of lookups of every ogr, rome and referentiel
+    """
+    with s.rome_db.at_version(version):
+        codes = [code for code, in s.Ogr.select(s.Ogr.code).order_by(s.Ogr.code).tuples()]
+        romes = [ogr for ogr, in s.Rome.select(s.Rome.ogr).order_by(s.Rome.ogr).tuples()]
+        referentiels = [ogr for ogr, in s.Referentiel.select(s.Referentiel.ogr).tuples()]
+    return {
+        "ogr": {code: rome.get_ogr(code, version=version) for code in codes},
+        "rome": {ogr: rome.get_rome(ogr, version=version) for ogr in romes},
+        "referentiel": {
+            ogr: rome.referentiel(ogr, version=version) for ogr in referentiels},
+    }
+
+
+class StoreTest(BuiltTestCase):
+    """versions of a store give the same lookups as databases built from their zip
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.zips = {}
+        cls.expected = {}
+        for version, seed in (("a", 0), ("b", 1)):
+            cls.zips[version] = cls.make_zip("%s.zip" % version, seed=seed)
+            with s.RomeDB(cls.build(cls.zips[version], "%s.db" % version)):
+                cls.expected[version] = lookups()
+
+    def assertLookups(self, version, expected):
+        found = lookups(version)
+        for kind, results in expected.items():
+            self.assertEqual(sorted(found[kind]), sorted(results))
+            for key, result in results.items():
+                with self.subTest(version=version, kind=kind, key=key):
+                    self.assertEqual(found[kind][key], result)
+
+    def add(self, store_path, *versions):
+        return [Loader().add_version(self.zips[v], store_path, v) for v in versions]
+
+    def masks(self):
+        """versions bit masks of rows, by store table
+        """
+        return {
+            model: sorted(v for v, in s.rome_db.execute_sql(
+                "SELECT versions FROM %s" % store_table(model)))
+            for model in STORE_MODELS}
+
+    def test_versions(self):
+        store_path = self.path("store.db")
+        counts_a, counts_b = self.add(store_path, "a", "b")
+        # both versions have the same ogr codes, with the same types
+        self.assertEqual(counts_b["ogr"], (len(self.expected["b"]["ogr"]), 0))
+        with s.RomeDB(store_path):
+            self.assertEqual(VersionStore().versions(), ["a", "b"])
+            self.assertLookups("a", self.expected["a"])
+            self.assertLookups("b", self.expected["b"])
+            self.assertLookups(None, self.expected["b"])
+
+    def test_remove(self):
+        store_path = self.path("remove.db")
+        self.add(store_path, "b")
+        with s.RomeDB(store_path):
+            expected_masks = self.masks()
+        self.add(store_path, "a", "b")
+        with s.RomeDB(store_path):
+            store = VersionStore()
+            store.remove("a")
+            self.assertEqual(store.versions(), ["b"])
+            self.assertLookups("b", self.expected["b"])
+            # rows of "a" only are gone, others only keep the bit of "b"
+            bit = 1 << store._bit("b")
+            self.assertEqual(self.masks(), {
+                model: [bit] * len(masks) for model, masks in expected_masks.items()})
+            with self.assertRaises(KeyError):
+                store.remove("a")
+            with self.assertRaises(KeyError):
+                rome.get_ogr(min(self.expected["a"]["rome"]), version="a")
+
+    def test_replace(self):
+        store_path = self.path("replace.db")
+        self.add(store_path, "a", "b", "a")
+        with s.RomeDB(store_path):
+            self.assertEqual(VersionStore().versions(), ["b", "a"])
+            self.assertLookups("a", self.expected["a"])
+            self.assertLookups("b", self.expected["b"])
+
+    def test_order(self):
+        """related objects and documents of romes come in the order of each release
+        """
+        def related(romes):
+            return {
+                ogr: {key: [item["ogr"] for item in value]
+                      for key, value in data.items() if isinstance(value, list)}
+                for ogr, data in romes.items()}
+
+        def documents():
+            query = s.RomeDocument.select(s.RomeDocument.rome, s.RomeDocument.document)
+            return related({ogr: json.loads(document) for ogr, document in query.tuples()})
+
+        store_path = self.path("order.db")
+        self.add(store_path, "a", "b")
+        for version in ("a", "b"):
+            with s.RomeDB(self.path("%s.db" % version)):
+                expected = documents()
+            self.assertEqual(related(self.expected[version]["rome"]), expected)
+            with s.RomeDB(store_path), s.rome_db.at_version(version):
+                self.assertEqual(documents(), expected)
+                self.assertEqual(related(
+                    {ogr: rome.get_rome(ogr) for ogr in expected}), expected)
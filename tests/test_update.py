@@ -0,0 +1,69 @@
+import shutil
+
+from pyrome import rome
+from pyrome import schema as s
+from pyrome.parser import Loader
+
+from .utils import BuiltTestCase
+
+
+def contents(db_path):
+    """rows of tables by name, search hits and romes,
+    without automatic ids that an update gives anew
+    """
+    result = {}
+    with s.RomeDB(db_path):
+        tables = set(s.rome_db.get_tables())
+        for model in s.BaseModel.__subclasses__():
+            if model in (s.BuildCheckpoint, s.RomeDocument):
+                continue
+            if model._meta.db_table not in tables:
+                continue
+            fields = [f for f in model._meta.sorted_fields if f.name != "id"]
+            result[model._meta.db_table] = sorted(
+                model.select(*fields).tuples(), key=repr)
+        result["search"] = {
+            word: sorted((hit["ogr"], hit["libelle"], sorted(hit["codes_rome"]))
+                         for hit in rome.search(word, limit=100000))
+            for word in ("gestion", "chef", "agent")}
+        result["documents"] = {
+            ogr: rome.get_rome(ogr) for ogr, in s.Rome.select(s.Rome.ogr).tuples()}
+    for document in result["documents"].values():
+        document.pop("id")
+        for value in document.values():
+            if isinstance(value, list):
+                for item in value:
+                    item.pop("id")
+                value.sort(key=repr)
+    return result
+
+
+class UpdateTest(BuiltTestCase):
+    """updating a database to a release gives the same data as building the release
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.zips = [cls.make_zip("%d.zip" % seed, seed=seed) for seed in (0, 1)]
+        cls.built = [cls.build(zip_path, "%d.db" % i) for i, zip_path in enumerate(cls.zips)]
+
+    def test_update(self):
+        db_path = self.path("updated.db")
+        shutil.copy(self.built[0], db_path)
+        report = Loader().update(self.zips[1], db_path)
+        self.assertEqual(contents(db_path), contents(self.built[1]))
+        tables = report["tables"]
+        self.assertEqual(tables["ogr"], {"inserted": [], "updated": [], "deleted": []})
+        self.assertTrue(tables["appellation"]["updated"])
+        self.assertTrue(tables["romeappellation"]["inserted"])
+        self.assertTrue(tables["romeappellation"]["deleted"])
+
+    def test_same_release(self):
+        db_path = self.path("same.db")
+        shutil.copy(self.built[0], db_path)
+        report = Loader().update(self.zips[0], db_path)
+        for table, changes in report["tables"].items():
+            with self.subTest(table=table):
+                self.assertEqual(changes, {"inserted": [], "updated": [], "deleted": []})
+        self.assertEqual(contents(db_path), contents(self.built[0]))
@@ -0,0 +1,55 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from pyrome.parser import Loader
+from pyrome.synthetic import Generator
+
+
+# synthetic referentials of a few dozen romes, see pyrome.synthetic
+SCALE = 0.05
+
+
+def dump(db_path):
+    """rows of every table of the database at db_path, sorted, by table name
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = [name for name, in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+        return {
+            table: sorted(conn.execute('SELECT * FROM "%s"' % table), key=repr)
+            for table in tables}
+    finally:
+        conn.close()
+
+
+class BuiltTestCase(unittest.TestCase):
+    """tests having a directory, and databases built there from synthetic zips
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    @classmethod
+    def path(cls, name):
+        return os.path.join(cls.directory, name)
+
+    @classmethod
+    def make_zip(cls, name, seed=0):
+        zip_path = cls.path(name)
+        Generator(scale=SCALE, seed=seed)(zip_path)
+        return zip_path
+
+    @classmethod
+    def build(cls, zip_path, name, **kwargs):
+        db_path = cls.path(name)
+        Loader(**kwargs)(zip_path, db_path)
+        return db_path